@@ -0,0 +1,76 @@
+"""
+Compares the streaming mpd rewriter (rewrite_mpd) to the minidom implementation (ContentModel.render_dom)
+on a generated mpd with a SegmentTimeline of SEGMENTS entries, as produced for every_frame vectors.
+
+    python benchmarks/mpd_rewrite.py --segments 200000 --periods 2
+"""
+import time
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import click
+
+from tcgen.encode import ContentModel
+from tcgen.mpd import rewrite_mpd, same_document
+from tcgen.models import CmafBrand, CmafStructuralBrand
+
+
+def generate_mpd(path:Path, segments:int, periods:int):
+    with open(path, 'w') as fo:
+        fo.write('<?xml version="1.0"?>\n<!-- MPD file Generated with GPAC -->\n')
+        fo.write('<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" minBufferTime="PT1.500S" type="static" profiles="urn:mpeg:dash:profile:isoff-live:2011">\n')
+        fo.write(' <ProgramInformation moreInformationURL="https://gpac.io">\n  <Title>stream.mpd generated by GPAC</Title>\n </ProgramInformation>\n')
+        for p in range(periods):
+            fo.write(f' <Period id="p{p}" duration="PT1H0M0S">\n')
+            fo.write('  <AdaptationSet segmentAlignment="true" maxWidth="1920" maxHeight="1080" maxFrameRate="60" par="16:9" lang="und" startWithSAP="1">\n')
+            fo.write('   <SegmentTemplate media="1/$Time$.m4s" initialization="1/init.mp4" timescale="60000">\n    <SegmentTimeline>\n')
+            fo.write('     <S t="0" d="1001"/>\n')
+            for i in range(1, segments):
+                fo.write(f'     <S d="{1002 if i % 50 == 0 else 1001}"/>\n')
+            fo.write('    </SegmentTimeline>\n   </SegmentTemplate>\n')
+            fo.write('   <Representation id="1" mimeType="video/mp4" codecs="hvc1.2.4.L123.90" width="1920" height="1080" frameRate="60" sar="1:1" bandwidth="6000000"/>\n')
+            fo.write('  </AdaptationSet>\n </Period>\n')
+        fo.write('</MPD>\n')
+
+
+def measure(func) -> tuple:
+    # timed apart from the memory measurement, tracemalloc slows down allocations
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+@click.command()
+@click.option('--segments', default=100000, help='number of SegmentTimeline entries per Period. default: 100000')
+@click.option('--periods', default=1, help='number of Periods. default: 1')
+def main(segments, periods):
+    with tempfile.TemporaryDirectory() as tmp:
+        mpd = Path(tmp) / 'stream.mpd'
+        generate_mpd(mpd, segments, periods)
+        cm = ContentModel(mpd, CmafStructuralBrand.CMF2.value, CmafBrand.CHH1)
+        notices = ('copyright', 'source', 'title')
+        click.echo(f'{mpd.stat().st_size / 2**20:.1f} MiB mpd, {segments} segments x {periods} periods')
+        dom, dom_elapsed, dom_peak = measure(lambda: cm.render_dom(*notices))
+        click.echo(f'minidom:   {dom_elapsed:.2f}s, peak memory {dom_peak / 2**20:.1f} MiB')
+        patched = Path(tmp) / 'patched.mpd'
+
+        def stream():
+            # written to a file, as ContentModel.process does
+            with open(patched, 'w', encoding='utf-8') as fo:
+                rewrite_mpd(mpd, fo, cm.m_structural_brand, cm.m_wave_media_profile.value, *notices)
+
+        _, elapsed, peak = measure(stream)
+        click.echo(f'streaming: {elapsed:.2f}s, peak memory {peak / 2**20:.1f} MiB')
+        click.echo(f'same document: {same_document(patched.read_text(), dom)}')
+        compacted = cm.render(*notices)
+        click.echo(f'with SegmentTimeline compaction: {len(compacted) / 2**10:.1f} KiB mpd')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,552 @@
+import hashlib
+from pathlib import Path
+from typing import Callable
+
+from tcgen.models import TestContent, FPS_FAMILY, PROFILES_TYPE, locate_source_content
+from tcgen.database import Database
+from tcgen.encode import encode_test_vector, encode_test_vector_pair, encode_shared_stream, encode_shared_stream_chunk, join_shared_stream, encode_fan_out, \
+    produce_frames, stage_mezzanine, promote_test_vector, encoder_settings, encode_cache_key, fan_out_key, frames_key, num_b_frames, clear_stream_location, chunk_ranges, chunk_dir, ELEMENTARY_STREAM
+from tcgen.cache import EncodeCache, FrameCache, StagingCache
+from tcgen.journal import Journal, partial_dir, ENCODE, ENCRYPT, PATCH
+from tcgen.progress import PROGRESS_FILE
+from tcgen.scheduler import Job, JobResult, estimate_memory, estimate_cost, bit_depth, GPAC_BASE_MEMORY
+from tcgen.export import zip_test_vector
+from tcgen.validation import validate_test_vector
+from tcgen.timing import TimingStore, TimingInfo, timing_key, expected_duration
+
+
+def shared_streams_dir(vectors_dir:Path, batch_dir:str) -> Path:
+    """
+    location of the intermediate elementary streams shared by several test vectors of a batch.
+    """
+    return Path(vectors_dir) / 'tmp' / 'es' / batch_dir
+
+
+def iter_batch_vectors(config, framerates:list[FPS_FAMILY], test_id=None):
+    for tc in TestContent.iter_vectors_in_batch_config(config):
+        if test_id != None and tc.test_id != test_id:
+                continue
+        for fps_family in framerates:
+            yield tc, fps_family
+
+
+def is_complete(tc:TestContent, fps_family:FPS_FAMILY, vectors_dir:Path, batch_dir:str, encode:bool, format_mpd:bool, completed:set) -> bool:
+    """
+    True when the journal lists all the steps a test vector requires, and its directory exists.
+    """
+    if not (Path(vectors_dir) / Database.test_entry_location(fps_family, tc, batch_dir)).exists():
+        return False
+    steps = []
+    if tc.encryption:
+        steps.append(ENCRYPT)
+    elif encode:
+        steps.append(ENCODE)
+    if format_mpd:
+        steps.append(PATCH)
+    key = Database.test_entry_key(fps_family, tc, batch_dir)
+    return all((key, step) in completed for step in steps)
+
+
+def chunk_count(m, tc:TestContent, chunks:int) -> int:
+    """
+    number of chunks the encode of a test vector is split in with the --chunks option.
+    encrypted and non video test vectors are never split.
+    """
+    media_type, _, _ = PROFILES_TYPE[tc.cmaf_media_profile]
+    if chunks < 2 or tc.encryption or media_type != "video":
+        return 1
+    return len(chunk_ranges(m, tc, chunks))
+
+
+def job_journal(journal:Journal, *keys:str) -> Journal:
+    """
+    the part of the journal a job producing the test vectors keys reads, see Journal.for_keys.
+    """
+    return None if journal is None else journal.for_keys(*keys)
+
+
+def num_chunks(tc:TestContent, fps_family:FPS_FAMILY, chunks:int) -> int:
+    """
+    chunk_count of a test vector, 1 when its source content can't be located.
+    """
+    if chunks < 2:
+        return 1
+    try:
+        return chunk_count(locate_source_content(tc, fps_family), tc, chunks)
+    except Exception:
+        return 1
+
+
+def cache_key(m, tc:TestContent, chunks:int) -> str:
+    """
+    key a test vector encoded with the --chunks option is stored under in the encode cache, see encode_cache_key.
+    """
+    return encode_cache_key(m, tc, chunk_count(m, tc, chunks))
+
+
+def is_cached(tc:TestContent, fps_family:FPS_FAMILY, cache:EncodeCache=None, chunks=1) -> bool:
+    if cache is None:
+        return False
+    try:
+        return cache.contains(cache_key(locate_source_content(tc, fps_family), tc, chunks))
+    except Exception:
+        return False
+
+
+def group_by_encoder_settings(vectors, cache:EncodeCache=None, chunks=1) -> dict:
+    """
+    group clear video test vectors by encoder_settings.
+    vectors whose source content can't be located are left out, their encode job reports the error.
+    so are vectors found in the cache.
+    """
+    groups = {}
+    for tc, fps_family in vectors:
+        media_type, _, _ = PROFILES_TYPE[tc.cmaf_media_profile]
+        if tc.encryption or media_type != "video":
+            continue
+        try:
+            m = locate_source_content(tc, fps_family)
+            if cache is not None and cache.contains(cache_key(m, tc, chunks)):
+                continue
+        except Exception:
+            continue
+        groups.setdefault(encoder_settings(m, tc), []).append((tc, fps_family))
+    return groups
+
+
+PACKAGE = 'package'
+CHUNK = 'chunk'
+JOIN = 'join'
+FAN_OUT = 'fanout'
+FRAMES = 'frames'
+STAGE = 'stage'
+PROMOTE = 'promote'
+
+
+def timing_info(stage:str, tc:TestContent, fps_family:FPS_FAMILY) -> TimingInfo:
+    """
+    timing key and relative cost of a job, used to estimate its duration. None when the source content can't be located.
+    """
+    try:
+        key = timing_key(stage, tc, fps_family)
+        m = locate_source_content(tc, fps_family)
+    except Exception:
+        return None
+    cost = estimate_cost(m, tc, num_b_frames(m, tc)) if stage in (ENCODE, CHUNK) else 0
+    return TimingInfo(key, cost)
+
+
+def plan_elementary_stream_jobs(tc:TestContent, fps_family:FPS_FAMILY, es_dir:Path, es_key:str, *, dry_run=False, chunks=1,
+                                timings:TimingStore=None, depends:list[str]=()) -> list[Job]:
+    """
+    jobs encoding the elementary stream of es_dir: a single encode job keyed es_key,
+    or with chunks, one encode job per chunk followed by the job joining them, keyed es_key.
+    encode jobs depend on depends.
+    """
+    count = num_chunks(tc, fps_family, chunks)
+    if count < 2:
+        timing = timing_info(ENCODE, tc, fps_family)
+        return [Job(es_key, encode_shared_stream, (tc, fps_family, es_dir, dry_run), memory=estimate_memory(tc), depends=[*depends], stage=ENCODE,
+                    cost=expected_duration(timings, timing), timing=timing, progress=None if dry_run else es_dir / PROGRESS_FILE)]
+    jobs = []
+    timing = timing_info(CHUNK, tc, fps_family)
+    if timing is not None:
+        timing.cost /= count
+    for i in range(count):
+        jobs.append(Job(f'{es_key}/{i}', encode_shared_stream_chunk, (tc, fps_family, es_dir, i, chunks, dry_run), memory=estimate_memory(tc),
+                        depends=[*depends], stage=ENCODE, cost=expected_duration(timings, timing), timing=timing,
+                        progress=None if dry_run else chunk_dir(es_dir, i) / PROGRESS_FILE))
+    timing = timing_info(JOIN, tc, fps_family)
+    jobs.append(Job(es_key, join_shared_stream, (tc, fps_family, es_dir, chunks, dry_run), memory=GPAC_BASE_MEMORY,
+                    depends=[j.key for j in jobs], stage=ENCODE, cost=expected_duration(timings, timing), timing=timing))
+    return jobs
+
+
+def plan_frames_job(tc:TestContent, fps_family:FPS_FAMILY, frame_cache:FrameCache, cache:EncodeCache=None, dry_run=False,
+                    timings:TimingStore=None, chunks=1) -> Job:
+    """
+    job decoding and scaling the mezzanine of a clear video test vector into the frame cache.
+    None when these frames are already cached, the test vector is found in the encode cache, or its source content can't be located.
+    """
+    media_type, _, _ = PROFILES_TYPE[tc.cmaf_media_profile]
+    if tc.encryption or media_type != "video":
+        return None
+    try:
+        m = locate_source_content(tc, fps_family)
+        if cache is not None and cache.contains(cache_key(m, tc, chunks)):
+            return None
+        key = frames_key(m, tc)
+    except Exception:
+        return None
+    if frame_cache.contains(key) and not dry_run:
+        return None
+    timing = timing_info(FRAMES, tc, fps_family)
+    return Job(f'{FRAMES}/{key[:16]}', produce_frames, (tc, fps_family, frame_cache, dry_run), memory=GPAC_BASE_MEMORY, stage=ENCODE,
+               cost=expected_duration(timings, timing), timing=timing, progress=None if dry_run else frame_cache.tmp_dir(key) / PROGRESS_FILE)
+
+
+def plan_staging_job(tc:TestContent, fps_family:FPS_FAMILY, staging:StagingCache, cache:EncodeCache=None, dry_run=False, chunks=1) -> Job:
+    """
+    job copying the mezzanine of a clear video test vector to the staging cache, pinned for this process.
+    None in dry runs, when the test vector is found in the encode cache, or its source content can't be located.
+    """
+    if dry_run or tc.encryption:
+        return None
+    try:
+        m = locate_source_content(tc, fps_family)
+        if cache is not None and cache.contains(cache_key(m, tc, chunks)):
+            return None
+        m.md5
+    except Exception:
+        return None
+    return Job(f'{STAGE}/{m.filename}', stage_mezzanine, (tc, fps_family, staging, StagingCache.process_token()), stage=STAGE)
+
+
+def staging_releaser(jobs:list[Job], staging:StagingCache, on_result:Callable[[JobResult], None]=None) -> Callable[[JobResult], None]:
+    """
+    wraps a Scheduler.run callback, unpinning each staged mezzanine once all the jobs reading it completed.
+    """
+    readers = {}
+    for job in jobs:
+        for key in job.depends:
+            if key.startswith(f'{STAGE}/'):
+                readers.setdefault(key, set()).add(job.key)
+    staged = {}
+
+    def release(r:JobResult):
+        if on_result:
+            on_result(r)
+        if r.key in readers and r.ok and r.value is not None:
+            staged[r.key] = Path(r.value).parent.name
+        for key, pending in readers.items():
+            if r.key in pending:
+                pending.discard(r.key)
+                if not pending and key in staged:
+                    staging.unpin(staged.pop(key), StagingCache.process_token())
+
+    return release
+
+
+def depend_on_promotion(jobs:list[Job]) -> list[Job]:
+    """
+    jobs depending on a test vector encoded in a scratch directory depend on its promotion to the vectors directory instead.
+    """
+    promoted = {j.depends[0] for j in jobs if j.stage == PROMOTE}
+    for job in jobs:
+        if job.stage != PROMOTE:
+            job.depends = [f'{PROMOTE}/{d}' if d in promoted else d for d in job.depends]
+    return jobs
+
+
+def fan_out_candidate(tc:TestContent, fps_family:FPS_FAMILY, cache:EncodeCache=None, chunks=1) -> tuple:
+    """
+    fan_out_key of a clear video test vector, None when its source content can't be located or it is found in the cache.
+    """
+    media_type, _, _ = PROFILES_TYPE[tc.cmaf_media_profile]
+    if tc.encryption or media_type != "video":
+        return None
+    try:
+        m = locate_source_content(tc, fps_family)
+        if cache is not None and cache.contains(cache_key(m, tc, chunks)):
+            return None
+        return fan_out_key(m, tc, fps_family)
+    except Exception:
+        return None
+
+
+def merge_fan_out_jobs(jobs:list[Job], candidates:dict, fan_out:int, vectors_dir:Path, batch_dir:str, *, format_mpd=True,
+                       drm_config=None, dry_run=False, cache:EncodeCache=None, journal:Journal=None) -> list[Job]:
+    """
+    replace encode jobs sharing a fan_out_key by jobs encoding up to fan_out of them in a single gpac session, see encode_fan_out.
+    candidates maps job keys to their (fan_out_key, fps_family, branch). merged jobs provide the keys of the jobs they replace.
+    """
+    groups = {}
+    for job in jobs:
+        if job.key in candidates:
+            fkey, fps_family, branch = candidates[job.key]
+            groups.setdefault(fkey, []).append((job, fps_family, branch))
+    merged = {}
+    for members in groups.values():
+        for i in range(0, len(members), fan_out):
+            session = members[i:i + fan_out]
+            if len(session) < 2:
+                continue
+            keys = [job.key for job, _, _ in session]
+            digest = hashlib.sha1(repr(keys).encode()).hexdigest()[:16]
+            depends = sorted({d for job, _, _ in session for d in job.depends} - set(keys))
+            job = Job(
+                f'{FAN_OUT}/{digest}',
+                encode_fan_out,
+                ([branch for _, _, branch in session], session[0][1], Path(vectors_dir), batch_dir),
+                dict(format_mpd=format_mpd, drm_config=drm_config, dry_run=dry_run, cache=cache, journal=job_journal(journal, *keys)),
+                memory=sum(job.memory for job, _, _ in session) - (len(session) - 1) * GPAC_BASE_MEMORY,
+                depends=depends,
+                stage=ENCODE,
+                cost=sum(job.cost for job, _, _ in session),
+                progress=session[0][0].progress,
+                provides=keys
+            )
+            for key in keys:
+                merged[key] = job
+    merged_jobs = []
+    for job in jobs:
+        if job.key not in merged:
+            merged_jobs.append(job)
+        elif merged[job.key].provides[0] == job.key:
+            merged_jobs.append(merged[job.key])
+    return merged_jobs
+
+
+def plan_encode_jobs(config, vectors_dir:Path, batch_dir:str, *, framerates:list[FPS_FAMILY], test_id=None, encode=True, format_mpd=True,
+                     drm_config=None, dry_run=False, share_encodes=True, cache:EncodeCache=None, journal:Journal=None, single_pass_cenc=True,
+                     timings:TimingStore=None, chunks=1, fan_out=1, frame_cache:FrameCache=None, staging:StagingCache=None,
+                     scratch_dir:Path=None) -> list[Job]:
+    """
+    expand a batch configuration into encode jobs, one per test vector and framerate family.
+    with share_encodes, test vectors only differing in packaging are packaged from a single encode.
+    with chunks, encodes are split into up to that many time ranges encoded concurrently, then joined and packaged.
+    with fan_out, up to that many encodes of the same mezzanine, resolution and pixel format are run by a single gpac session.
+    with a frame_cache, mezzanines are decoded and scaled into the frame cache first, by jobs encodes depend on.
+    with staging, mezzanines are first copied to the staging cache, by jobs encodes (or decoding into the frame cache) depend on.
+    with a scratch_dir, clear test vectors and shared elementary streams are encoded there. promotion jobs then move each test vector
+    to vectors_dir, store it to the cache and patch its mpd. test vectors found in the cache are materialized in vectors_dir directly.
+    with a journal, test vectors it lists as complete are left out.
+    with single_pass_cenc, encrypted test vectors are produced by the job encoding their clear counterpart.
+    job costs are their expected duration, from the timings history when available.
+    """
+    if dry_run or not encode:
+        cache = None
+    if dry_run:
+        journal = None
+    if dry_run or not encode:
+        scratch_dir = None
+    vectors = [*iter_batch_vectors(config, framerates, test_id)]
+    completed = set()
+    if journal is not None:
+        completed = journal.completed()
+        vectors = [(tc, fps_family) for tc, fps_family in vectors
+                   if not is_complete(tc, fps_family, vectors_dir, batch_dir, encode, format_mpd, completed)]
+
+    cenc_pairs = {}
+    if single_pass_cenc and encode and not dry_run:
+        pending = {Database.test_entry_key(fps_family, tc, batch_dir) for tc, fps_family in vectors if not tc.encryption}
+        for tc, fps_family in vectors:
+            clear_key = str(clear_stream_location(Database.test_entry_location(fps_family, tc, batch_dir)))
+            if tc.encryption and clear_key in pending and clear_key not in cenc_pairs:
+                cenc_pairs[clear_key] = (tc, Database.test_entry_key(fps_family, tc, batch_dir))
+    paired = {cenc_key for _, cenc_key in cenc_pairs.values()}
+
+    started = {key for key, _ in completed}
+    shared = {}
+    candidates = {}
+    frames_jobs = {}
+    staging_jobs = {}
+    promote_jobs = []
+    jobs = []
+
+    def staging_depends(tc:TestContent, fps_family:FPS_FAMILY) -> list[str]:
+        job = None if staging is None else plan_staging_job(tc, fps_family, staging, cache, dry_run, chunks)
+        if job is None:
+            return []
+        staging_jobs.setdefault(job.key, job)
+        return [job.key]
+
+    def source_depends(tc:TestContent, fps_family:FPS_FAMILY) -> list[str]:
+        if frame_cache is None:
+            return staging_depends(tc, fps_family)
+        job = plan_frames_job(tc, fps_family, frame_cache, cache, dry_run, timings, chunks)
+        if job is None:
+            return []
+        if job.key not in frames_jobs:
+            job.depends = staging_depends(tc, fps_family)
+            frames_jobs[job.key] = job
+        return [job.key]
+
+    if (share_encodes or chunks > 1) and encode:
+        groups = []
+        for settings, group in group_by_encoder_settings(vectors, cache, chunks).items():
+            if share_encodes:
+                groups.append((settings, group))
+            else:
+                groups += [((*settings, Database.test_entry_key(fps_family, tc, batch_dir)), [(tc, fps_family)]) for tc, fps_family in group]
+        for settings, group in groups:
+            tc, fps_family = group[0]
+            count = num_chunks(tc, fps_family, chunks)
+            if len(group) < 2 and count < 2:
+                continue
+            digest = hashlib.sha1(repr(settings).encode()).hexdigest()[:16]
+            es_dir = shared_streams_dir(scratch_dir or vectors_dir, batch_dir) / digest
+            es_key = f'es/{digest}'
+            jobs += plan_elementary_stream_jobs(tc, fps_family, es_dir, es_key, dry_run=dry_run, chunks=chunks, timings=timings,
+                                                depends=source_depends(tc, fps_family))
+            fkey = fan_out_candidate(tc, fps_family)
+            if count < 2 and fkey is not None:
+                candidates[es_key] = (fkey, fps_family, (tc, None, es_dir))
+            for tc, fps_family in group:
+                shared[Database.test_entry_key(fps_family, tc, batch_dir)] = (es_key, es_dir / ELEMENTARY_STREAM, count)
+
+    for tc, fps_family in vectors:
+        key = Database.test_entry_key(fps_family, tc, batch_dir)
+        if key in paired:
+            continue
+        depends = [str(clear_stream_location(Path(key)))] if tc.encryption else []
+        es_file = None
+        # test vectors found in the cache are materialized under the key of the chunked encode
+        count = num_chunks(tc, fps_family, chunks) if encode else 1
+        memory = estimate_memory(tc)
+        if key in shared:
+            es_key, es_file, count = shared[key]
+            depends.append(es_key)
+            memory = GPAC_BASE_MEMORY
+        elif encode and not tc.encryption:
+            depends += source_depends(tc, fps_family)
+        timing = timing_info(ENCRYPT if tc.encryption else (PACKAGE if es_file else ENCODE), tc, fps_family)
+        cenc_tc, cenc_key = cenc_pairs.get(key, (None, None))
+        # test vectors already in vectors_dir only need their remaining steps
+        scratch = scratch_dir is not None and not tc.encryption and not is_cached(tc, fps_family, cache, chunks) \
+            and not (Path(vectors_dir) / Database.test_entry_location(fps_family, tc, batch_dir)).exists()
+        output_dir = Path(scratch_dir if scratch else vectors_dir)
+        if key in cenc_pairs:
+            func = encode_test_vector_pair
+            args = (tc, cenc_tc, fps_family, output_dir, batch_dir)
+            kwargs = dict(format_mpd=format_mpd and not scratch, drm_config=drm_config, es_file=es_file, cache=None if scratch else cache,
+                          journal=job_journal(journal, key, cenc_key), chunks=count)
+        else:
+            func = encode_test_vector
+            args = (tc, fps_family, output_dir, batch_dir)
+            kwargs = dict(encode=encode, format_mpd=format_mpd and not scratch, drm_config=drm_config, dry_run=dry_run, es_file=es_file,
+                          cache=None if scratch else cache, journal=job_journal(journal, key), chunks=count)
+        progress = None
+        if encode and not (dry_run or tc.encryption):
+            progress = partial_dir(output_dir / Database.test_entry_location(fps_family, tc, batch_dir)) / PROGRESS_FILE
+        jobs.append(Job(key, func, args, kwargs, memory=memory, depends=depends, stage=ENCODE,
+                        cost=expected_duration(timings, timing), timing=timing, progress=progress))
+        if scratch:
+            promote_jobs.append(Job(f'{PROMOTE}/{key}', promote_test_vector, (tc, cenc_tc, fps_family, Path(scratch_dir), Path(vectors_dir), batch_dir),
+                                    dict(format_mpd=format_mpd, cache=cache, journal=job_journal(journal, key, cenc_key), chunks=count),
+                                    depends=[key], stage=PROMOTE))
+        # test vectors partially processed by a previous run are left to encode_test_vector(_pair)
+        if encode and es_file is None and key not in started and cenc_key not in started and scratch == (scratch_dir is not None):
+            fkey = fan_out_candidate(tc, fps_family, cache, chunks)
+            if fkey is not None:
+                candidates[key] = (fkey, fps_family, (tc, cenc_tc, None))
+
+    jobs = [*staging_jobs.values(), *frames_jobs.values(), *jobs]
+    if fan_out > 1:
+        if scratch_dir is not None:
+            jobs = merge_fan_out_jobs(jobs, candidates, fan_out, scratch_dir, batch_dir, format_mpd=False, drm_config=drm_config, dry_run=dry_run,
+                                      journal=journal)
+        else:
+            jobs = merge_fan_out_jobs(jobs, candidates, fan_out, vectors_dir, batch_dir, format_mpd=format_mpd, drm_config=drm_config, dry_run=dry_run,
+                                      cache=cache, journal=journal)
+    return depend_on_promotion(jobs + promote_jobs)
+
+
+ZIP = 'zip'
+VALIDATE = 'validate'
+
+
+def zip_vector(tc:TestContent, fps_family:FPS_FAMILY, vectors_dir:Path, batch_dir:str):
+    test_stream_dir = Path(vectors_dir) / Database.test_entry_location(fps_family, tc, batch_dir)
+    return zip_test_vector(vectors_dir, test_stream_dir, Database.test_id(tc), overwrite=True)
+
+
+def validate_vector(tc:TestContent, fps_family:FPS_FAMILY, vectors_dir:Path, batch_dir:str, jccp:str, vectors_url:str=None):
+    m = locate_source_content(tc, fps_family)
+    test_entry_key, test_entry = Database.format_entry(m, tc, batch_dir)
+    return validate_test_vector(test_entry_key, test_entry, jccp, vectors_url, vectors_dir)
+
+
+def plan_pipeline_jobs(config, vectors_dir:Path, batch_dir:str, *, framerates:list[FPS_FAMILY], test_id=None, drm_config=None,
+                       share_encodes=True, cache:EncodeCache=None, journal:Journal=None, single_pass_cenc=True,
+                       zip=True, jccp:str=None, vectors_url:str=None, timings:TimingStore=None, chunks=1, fan_out=1,
+                       frame_cache:FrameCache=None, staging:StagingCache=None, scratch_dir:Path=None) -> list[Job]:
+    """
+    expand a batch configuration into a graph of jobs: encode (including mpd patching and encryption) then zip
+    and validation of each test vector, each job depending only on the encode job producing its test vector,
+    validation also on the zip job.
+    validation jobs are only planned when a jccp endpoint or container is specified.
+    """
+    jobs = plan_encode_jobs(config, vectors_dir, batch_dir, framerates=framerates, test_id=test_id, drm_config=drm_config,
+                            share_encodes=share_encodes, cache=cache, journal=journal, single_pass_cenc=single_pass_cenc, timings=timings,
+                            chunks=chunks, fan_out=fan_out, frame_cache=frame_cache, staging=staging, scratch_dir=scratch_dir)
+    planned = {key for j in jobs for key in (j.key, *j.provides)}
+    for tc, fps_family in iter_batch_vectors(config, framerates, test_id):
+        key = Database.test_entry_key(fps_family, tc, batch_dir)
+        clear_key = str(clear_stream_location(Database.test_entry_location(fps_family, tc, batch_dir)))
+        if key in planned:
+            depends = [key]
+        elif tc.encryption and clear_key in planned:
+            # produced along with its clear counterpart
+            depends = [clear_key]
+        else:
+            # completed by a previous run
+            depends = []
+        if zip:
+            timing = timing_info(ZIP, tc, fps_family)
+            jobs.append(Job(f'{ZIP}/{key}', zip_vector, (tc, fps_family, Path(vectors_dir), batch_dir), depends=depends, stage=ZIP,
+                            cost=expected_duration(timings, timing), timing=timing))
+        if jccp is not None:
+            timing = timing_info(VALIDATE, tc, fps_family)
+            # the validation report is written to the test vector directory, which must not change while it is zipped
+            validate_depends = [f'{ZIP}/{key}'] if zip else depends
+            jobs.append(Job(f'{VALIDATE}/{key}', validate_vector, (tc, fps_family, Path(vectors_dir), batch_dir, jccp, vectors_url), depends=validate_depends, stage=VALIDATE,
+                            cost=expected_duration(timings, timing), timing=timing))
+    return depend_on_promotion(jobs)
+
+
+def plan_batch(config, vectors_dir:Path, batch_dir:str, *, framerates:list[FPS_FAMILY], test_id=None, cache:EncodeCache=None,
+               zip=True, jccp:str=None, chunks=1) -> list[dict]:
+    """
+    describe the jobs a batch expands to, without running anything: one entry per test vector, framerate family and stage,
+    with the mezzanine it is resolved to (or the reason it can't be), its estimated cost, and whether it is a cache hit
+    or already complete on disk.
+    """
+    entries = []
+    for tc, fps_family in iter_batch_vectors(config, framerates, test_id):
+        key = Database.test_entry_key(fps_family, tc, batch_dir)
+        test_stream_dir = Path(vectors_dir) / Database.test_entry_location(fps_family, tc, batch_dir)
+        _, codec, _ = PROFILES_TYPE[tc.cmaf_media_profile]
+        vector = {
+            "key": key,
+            "test_id": tc.test_id,
+            "fps_family": fps_family.value,
+            "profile": tc.cmaf_media_profile.value,
+            "codec": codec,
+            "resolution": str(tc.resolution),
+            "bit_depth": bit_depth(tc),
+            "mezzanine": tc.get_mezzanine(fps_family).filename,
+            "missing": None,
+            "frames": None,
+            "b_frames": None,
+            "cost": 0
+        }
+        m = None
+        try:
+            m = locate_source_content(tc, fps_family)
+            vector["mezzanine"] = m.filename
+            vector["frames"] = round(float(m.duration) * float(m.fps))
+            vector["b_frames"] = num_b_frames(m, tc)
+        except Exception as e:
+            vector["missing"] = str(e)
+
+        encode_entry = {**vector, "stage": ENCRYPT if tc.encryption else ENCODE, "depends": [], "cache_hit": False,
+                        "complete": (test_stream_dir / 'stream.mpd').exists()}
+        if tc.encryption:
+            encode_entry["depends"] = [str(clear_stream_location(Path(key)))]
+        elif m is not None:
+            encode_entry["cost"] = estimate_cost(m, tc, vector["b_frames"])
+            if cache is not None:
+                try:
+                    encode_entry["cache_hit"] = cache.contains(cache_key(m, tc, chunks))
+                except OSError:
+                    pass
+        entries.append(encode_entry)
+
+        if zip:
+            entries.append({**vector, "stage": ZIP, "depends": [key], "cache_hit": False,
+                            "complete": (test_stream_dir / f'{Database.test_id(tc)}.zip').exists()})
+        if jccp is not None:
+            entries.append({**vector, "stage": VALIDATE, "depends": [f'{ZIP}/{key}' if zip else key], "cache_hit": False,
+                            "complete": (test_stream_dir / 'jccp-validation.json').exists()})
+    return entries
@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import hashlib
+from pathlib import Path
+
+CACHE_DIR = Path('.tcgen') / 'cache'
+DEFAULT_CACHE_SIZE = '200G'
+ENTRY_MANIFEST = 'entry.json'
+
+FRAME_CACHE_DIR = Path('.tcgen') / 'frames'
+DEFAULT_FRAME_CACHE_SIZE = '500G'
+FRAMES_FILE = 'frames.yuv'
+
+DEFAULT_STAGING_SIZE = '200G'
+PINS_DIR = 'pins'
+LOCK_FILE = '.lock'
+# mezzanines are copied by blocks of that size
+COPY_BLOCK_SIZE = 8 * 1024 * 1024
+
+# media files are immutable once written, and shared with the cache.
+# anything else (eg. the mpd, patched in place after encoding) is copied.
+SHARED_SUFFIXES = ('.m4s', '.mp4', '.cmfv', '.cmfa', '.hevc', '.264', '.265', '.yuv')
+
+FICLONE = 0x40049409
+
+
+def clone_file(src:Path, dst:Path):
+    """
+    hardlink src to dst, falling back to a reflink, then to a copy.
+    """
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return
+    except OSError:
+        pass
+    shutil.copyfile(src, dst)
+
+
+def clone_tree(src_dir:Path, dst_dir:Path, ignore=()):
+    for root, _, files in os.walk(src_dir):
+        rel = Path(root).relative_to(src_dir)
+        (dst_dir / rel).mkdir(parents=True, exist_ok=True)
+        for f in files:
+            if rel == Path('.') and f in ignore:
+                continue
+            src, dst = Path(root) / f, dst_dir / rel / f
+            if dst.exists():
+                dst.unlink()
+            if src.suffix in SHARED_SUFFIXES:
+                clone_file(src, dst)
+            else:
+                shutil.copyfile(src, dst)
+
+
+def copy_file_md5(src:Path, dst:Path) -> str:
+    """
+    copy src to dst, returning the md5 of the bytes copied.
+    """
+    h = hashlib.md5()
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        while block := fsrc.read(COPY_BLOCK_SIZE):
+            h.update(block)
+            fdst.write(block)
+    return h.hexdigest()
+
+
+def tree_size(d:Path) -> int:
+    return sum(p.stat().st_size for p in Path(d).rglob('*') if p.is_file())
+
+
+class EncodeCache:
+    """
+    Persistent content addressed store of encoded test vectors.
+    Entries are materialized with hardlinks (or reflinks) whenever possible, and evicted least recently used first.
+    """
+
+    def __init__(self, root:Path, max_size:int=None):
+        self.root = Path(root)
+        self.max_size = max_size
+
+    @classmethod
+    def in_vectors_dir(cls, vectors_dir:Path, max_size:int=None) -> 'EncodeCache':
+        return cls(Path(vectors_dir) / CACHE_DIR, max_size)
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+    def entry_dir(self, key:str) -> Path:
+        return self.root / key[:2] / key
+
+    def iter_entries(self):
+        if not self.root.exists():
+            return
+        for manifest in self.root.glob(f'*/*/{ENTRY_MANIFEST}'):
+            if manifest.parent.suffix == '.tmp':
+                # being stored, or left over by an interrupted store
+                continue
+            try:
+                with open(manifest) as fo:
+                    yield manifest.parent, json.load(fo)
+            except (OSError, ValueError):
+                continue
+
+    def contains(self, key:str) -> bool:
+        return (self.entry_dir(key) / ENTRY_MANIFEST).exists()
+
+    def lookup(self, key:str) -> Path:
+        entry_dir = self.entry_dir(key)
+        manifest = entry_dir / ENTRY_MANIFEST
+        if not manifest.exists():
+            return None
+        with open(manifest) as fo:
+            entry = json.load(fo)
+        entry["last_used"] = time.time()
+        tmp = manifest.with_suffix(f'.{uuid.uuid4().hex}')
+        with open(tmp, 'w') as fo:
+            json.dump(entry, fo)
+        os.replace(tmp, manifest)
+        return entry_dir
+
+    def materialize(self, key:str, dst_dir:Path) -> bool:
+        entry_dir = self.lookup(key)
+        if entry_dir is None:
+            return False
+        clone_tree(entry_dir, Path(dst_dir), ignore=(ENTRY_MANIFEST,))
+        return True
+
+    def store(self, key:str, src_dir:Path, ignore=()):
+        entry_dir = self.entry_dir(key)
+        if entry_dir.exists():
+            return
+        tmp_dir = entry_dir.with_name(f'{key}.{uuid.uuid4().hex}.tmp')
+        clone_tree(Path(src_dir), tmp_dir, ignore)
+        now = time.time()
+        with open(tmp_dir / ENTRY_MANIFEST, 'w') as fo:
+            json.dump({"key": key, "size": tree_size(tmp_dir), "created": now, "last_used": now}, fo)
+        try:
+            tmp_dir.rename(entry_dir)
+        except OSError:
+            # concurrently stored by another job
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def stats(self) -> dict:
+        entries = [e for _, e in self.iter_entries()]
+        return {
+            "location": str(self.root),
+            "entries": len(entries),
+            "size": sum(e["size"] for e in entries),
+            "max_size": self.max_size,
+            "oldest_use": min((e["last_used"] for e in entries), default=None),
+            "latest_use": max((e["last_used"] for e in entries), default=None)
+        }
+
+    def pinned(self, entry_dir:Path) -> bool:
+        return False
+
+    def prune(self, max_size:int=None) -> list[str]:
+        """
+        evict least recently used entries until the cache fits max_size, except pinned ones. returns evicted keys.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        if max_size is None:
+            return []
+        entries = sorted(self.iter_entries(), key=lambda e: e[1]["last_used"])
+        size = sum(e["size"] for _, e in entries)
+        evicted = []
+        for entry_dir, entry in entries:
+            if size <= max_size:
+                break
+            if self.pinned(entry_dir):
+                continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            size -= entry["size"]
+            evicted.append(entry["key"])
+        return evicted
+
+
+class FrameCache(EncodeCache):
+    """
+    Persistent store of decoded and scaled mezzanine frames, as raw video, keyed on mezzanine md5, output size and pixel format.
+    Encodes read these frames instead of decoding and scaling the mezzanine again.
+    """
+
+    @classmethod
+    def in_vectors_dir(cls, vectors_dir:Path, max_size:int=None) -> 'FrameCache':
+        return cls(Path(vectors_dir) / FRAME_CACHE_DIR, max_size)
+
+    def tmp_dir(self, key:str) -> Path:
+        """
+        where frames are written before being stored, on the same file system as the cache.
+        """
+        return self.root / 'tmp' / key
+
+    def frames(self, key:str) -> Path:
+        entry_dir = self.lookup(key)
+        return None if entry_dir is None else entry_dir / FRAMES_FILE
+
+
+class StagingCache(EncodeCache):
+    """
+    Local copies of mezzanine files, keyed on their md5, for mezzanine directories on slow network storage.
+    Mezzanines are copied ahead of the encodes reading them, and verified against their md5 while copying.
+    Entries are pinned while a batch needs them, and only unpinned entries are evicted, least recently used first.
+    The size budget is enforced before each copy and after the batch, concurrent copies may briefly exceed it.
+    """
+
+    @staticmethod
+    def process_token() -> str:
+        return str(os.getpid())
+
+    def pins_dir(self, key:str) -> Path:
+        return self.entry_dir(key) / PINS_DIR
+
+    def pin(self, key:str, token:str):
+        self.pins_dir(key).mkdir(exist_ok=True)
+        (self.pins_dir(key) / token).touch()
+
+    def unpin(self, key:str, token:str):
+        (self.pins_dir(key) / token).unlink(missing_ok=True)
+
+    def pinned(self, entry_dir:Path) -> bool:
+        """
+        True when a pin of a running process is found. pins are named after the pid of the process holding them.
+        """
+        for pin in (entry_dir / PINS_DIR).glob('*'):
+            try:
+                os.kill(int(pin.name), 0)
+                return True
+            except (ValueError, ProcessLookupError):
+                pin.unlink(missing_ok=True)
+            except PermissionError:
+                return True
+        return False
+
+    def staged(self, key:str, filename:str) -> Path:
+        entry_dir = self.lookup(key)
+        return None if entry_dir is None else entry_dir / filename
+
+    def make_room(self, size:int) -> bool:
+        """
+        evict unpinned entries, least recently used first, until size bytes fit in the budget.
+        """
+        if self.max_size is None:
+            return True
+        entries = sorted(self.iter_entries(), key=lambda e: e[1]["last_used"])
+        used = sum(e["size"] for _, e in entries)
+        for entry_dir, entry in entries:
+            if used + size <= self.max_size:
+                break
+            if not self.pinned(entry_dir):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                used -= entry["size"]
+        return used + size <= self.max_size
+
+    def stage(self, key:str, src:Path, md5:str, token:str) -> Path:
+        """
+        copy src to the cache unless already there, and pin it for token.
+        returns the local copy, or None when it doesn't fit in the budget. raises when the copy doesn't match md5.
+        """
+        src = Path(src)
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / LOCK_FILE, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            staged = self.staged(key, src.name)
+            if staged is not None:
+                self.pin(key, token)
+                return staged
+            if not self.make_room(src.stat().st_size):
+                return None
+        entry_dir = self.entry_dir(key)
+        tmp_dir = entry_dir.with_name(f'{key}.{uuid.uuid4().hex}.tmp')
+        tmp_dir.mkdir(parents=True)
+        try:
+            copied = copy_file_md5(src, tmp_dir / src.name)
+            if copied != md5:
+                raise Exception(f'staged copy of "{src}" is corrupt: md5 {copied} expected {md5}')
+            # pinned before the manifest makes it visible to concurrent evictions
+            (tmp_dir / PINS_DIR).mkdir()
+            (tmp_dir / PINS_DIR / token).touch()
+            now = time.time()
+            with open(tmp_dir / ENTRY_MANIFEST, 'w') as fo:
+                json.dump({"key": key, "size": tree_size(tmp_dir), "created": now, "last_used": now}, fo)
+            try:
+                tmp_dir.rename(entry_dir)
+            except OSError:
+                # concurrently staged by another job
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                self.pin(key, token)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return entry_dir / src.name
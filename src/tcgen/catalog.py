@@ -0,0 +1,137 @@
+import os
+import json
+import hashlib
+import fnmatch
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from tcgen.models import Mezzanine
+
+INDEX_FILE = Path('.tcgen') / 'index.json'
+# hashing reads mezzanines by blocks of that size
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def file_md5(path:Path) -> str:
+    h = hashlib.md5()
+    with open(path, 'rb') as fo:
+        while block := fo.read(HASH_BLOCK_SIZE):
+            h.update(block)
+    return h.hexdigest()
+
+
+class MezzanineIndex:
+    """
+    Persistent index of the mezzanine directory, stored in MEZZANINE_DIR/.tcgen/index.json:
+    for each mezzanine file, its size and mtime, the fields parsed from its name, its annotations,
+    and the md5 of its content, only recomputed when size or mtime changed.
+    """
+
+    def __init__(self, root_dir:Path, entries:dict=None):
+        self.root_dir = Path(root_dir)
+        self.entries = entries or {}
+
+    @property
+    def path(self) -> Path:
+        return self.root_dir / INDEX_FILE
+
+    @classmethod
+    def load(cls, root_dir:Path) -> 'MezzanineIndex':
+        """
+        index of root_dir, None when it was never built.
+        """
+        index = cls(root_dir)
+        try:
+            with open(index.path) as fo:
+                index.entries = json.load(fo)["mezzanines"]
+        except (OSError, ValueError, KeyError):
+            return None
+        return index
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w') as fo:
+            json.dump({"mezzanines": self.entries}, fo, indent=2)
+        os.replace(tmp, self.path)
+
+    def update(self, max_workers:int=4, force:bool=False) -> list[str]:
+        """
+        scan root_dir and hash new or modified mezzanines in parallel. returns the filenames that were hashed.
+        """
+        entries = {}
+        to_hash = []
+        for fp in sorted(self.root_dir.glob('*.mp4')):
+            annotation_file = fp.with_suffix('.json')
+            if not annotation_file.exists():
+                continue
+            try:
+                m = Mezzanine.from_filename(fp)
+                with open(annotation_file) as fo:
+                    annotations = json.load(fo)["Mezzanine"]
+            except (ValueError, IndexError, KeyError, NotImplementedError):
+                continue
+            st = fp.stat()
+            previous = self.entries.get(fp.name, {})
+            entries[fp.name] = {
+                "size": st.st_size,
+                "mtime": st.st_mtime,
+                "content": m.content,
+                "label": m.label,
+                "resolution": str(m.resolution),
+                "fps": str(m.fps.to_number()),
+                "duration": m.duration,
+                "hdr": m.hdr,
+                "annotations": annotations,
+                "md5": previous.get("md5")
+            }
+            if force or previous.get("md5") is None or (previous["size"], previous["mtime"]) != (st.st_size, st.st_mtime):
+                to_hash.append(fp.name)
+
+        with ThreadPoolExecutor(max_workers) as executor:
+            for filename, md5 in zip(to_hash, executor.map(lambda f: file_md5(self.root_dir / f), to_hash)):
+                entries[filename]["md5"] = md5
+        self.entries = entries
+        return to_hash
+
+    def filenames(self) -> list[str]:
+        return [*self.entries.keys()]
+
+    def annotations(self, filename:str) -> dict:
+        return self.entries[filename]["annotations"]
+
+    def corrupt(self) -> list[str]:
+        return [f for f, e in self.entries.items() if e["md5"] != e["annotations"].get("md5")]
+
+    def resolve(self, filename:str) -> str:
+        """
+        indexed mezzanine filename, with the duration of splice content (-1) resolved. None when not indexed.
+        """
+        if filename in self.entries:
+            return filename
+        if '_-1.' in filename:
+            matches = fnmatch.filter(self.entries.keys(), filename.replace('-1', '*'))
+            if len(matches) == 1:
+                return matches[0]
+        return None
+
+    def check(self, filename:str):
+        """
+        raise if the md5 of an indexed mezzanine doesn't match its annotations, or if it changed since it was indexed.
+        """
+        entry = self.entries[filename]
+        if entry["md5"] != entry["annotations"].get("md5"):
+            raise Exception(f'mezzanine "{filename}" is corrupt: md5 {entry["md5"]} expected {entry["annotations"].get("md5")}')
+        if entry.get("stale"):
+            raise Exception(f'mezzanine "{filename}" changed since it was indexed, run `tcgen mezzanine index`')
+
+    def refresh(self):
+        """
+        flag entries whose size or mtime changed as stale, without hashing them.
+        """
+        for filename, entry in self.entries.items():
+            try:
+                st = (self.root_dir / filename).stat()
+                entry["stale"] = (entry["size"], entry["mtime"]) != (st.st_size, st.st_mtime)
+            except OSError:
+                entry["stale"] = True
@@ -1,13 +1,20 @@
 from .models import Mezzanine, TestContent, FPS_FAMILY
+from .journal import is_partial
 import json
+import sqlite3
+from dataclasses import dataclass, field
 from pathlib import Path
 from datetime import datetime
 
 PUBLIC_VECTORS_DIRECTORY = "https://dash-large-files.akamaized.net/WAVE/vectors/"
 
+# databases with these suffixes are stored with SqliteDatabase, others as json
+SQLITE_SUFFIXES = ('.sqlite', '.db')
+
 
 def most_recent_batch(vector_dir:Path):
-    return vector_dir / sorted([datetime.strptime(p.stem, '%Y-%m-%d') for p in vector_dir.iterdir() if p.is_dir()])[-1].strftime('%Y-%m-%d')
+    # '.partial' directories are incomplete outputs of an interrupted encode
+    return vector_dir / sorted([datetime.strptime(p.name, '%Y-%m-%d') for p in vector_dir.iterdir() if p.is_dir() and not is_partial(p)])[-1].strftime('%Y-%m-%d')
 
 class Database:
 
@@ -27,7 +34,7 @@ class Database:
         elif 'splice_ad' in tc.test_id:
             return 'splice_ad-cenc' if tc.encryption else 'splice_ad'
         else:
-            return f't{tc.test_id.replace('_enc', '-cenc')}' if tc.encryption else f't{tc.test_id}'
+            return f"t{tc.test_id.replace('_enc', '-cenc')}" if tc.encryption else f't{tc.test_id}'
 
     @staticmethod
     def test_entry_key(fps:FPS_FAMILY, t:TestContent, batch_dir:str):
@@ -57,10 +64,15 @@ class Database:
 
     def __init__(self, data = {}) -> None:
         self.data = data
+        self._latest = None
 
     def load(self, filename):
         with open(filename) as fo:
-            self.data = json.load(fo)
+            self.replace(json.load(fo))
+
+    def replace(self, data:dict):
+        self.data = data
+        self._latest = None
 
     def save(self, filename):
         with open(filename, 'w') as fo:
@@ -72,10 +84,12 @@ class Database:
             self.data[root_key] = {}
         test_entry_key, test_entry = self.format_entry(m, t, batch_dir)
         self.data[root_key][test_entry_key] = test_entry
+        if self._latest is not None:
+            self.index(root_key, test_entry_key)
     
     def find(self, tc:TestContent):
         result = {}
-        for test_entry_key, test_entry in self.data[Database.root_key(tc)].items():
+        for test_entry_key, test_entry in self.data.get(Database.root_key(tc), {}).items():
             if not test_entry_key.startswith(f'{tc.cmaf_media_profile.value}_sets'):
                 continue
             if test_entry_key.split('/')[2] == Database.test_id(tc):
@@ -91,26 +105,312 @@ class Database:
                         yield test_entry_key, test_entry
                     elif test_entry_key.startswith('switching_sets') and (profile in test_entry_key):
                         yield test_entry_key, test_entry
+                else:
+                    yield test_entry_key, test_entry
+
+
+    def entry_keys(self):
+        for root_key, table in self.data.items():
+            for test_entry_key in table:
+                yield root_key, test_entry_key
+
+    def get_entry(self, root_key:str, test_entry_key:str):
+        return self.data.get(root_key, {}).get(test_entry_key)
+
+    def put(self, root_key:str, test_entry_key:str, test_entry:dict):
+        self.data.setdefault(root_key, {})[test_entry_key] = test_entry
+
+    def latest_batches(self) -> dict:
+        """
+        index of the most recent batch of each test vector, {(root_key, test vector): test_entry_key}.
+        built on first use, then kept up to date by add_entry and merge.
+        """
+        if self._latest is None:
+            self._latest = {}
+            # entries a more recent batch of the same test vector deprecates
+            self._deprecated = {}
+            for root_key, test_entry_key in self.entry_keys():
+                self.index(root_key, test_entry_key)
+        return self._latest
+
+    def index(self, root_key:str, test_entry_key:str):
+        """
+        record test_entry_key in the latest batch index.
+        returns the entry key it deprecates, test_entry_key itself when a more recent batch is indexed already, otherwise None.
+        """
+        vector, batch = vector_key(test_entry_key)
+        latest = self._latest.get((root_key, vector))
+        if latest is None or latest == test_entry_key:
+            self._latest[(root_key, vector)] = test_entry_key
+            return None
+        if vector_key(latest)[1] < batch:
+            self._latest[(root_key, vector)] = test_entry_key
+            deprecated = latest
+        else:
+            deprecated = test_entry_key
+        self._deprecated[(root_key, deprecated)] = None
+        return deprecated
+
+    def merge(self, *patches:'Database') -> 'MergeReport':
+        """
+        add the entries of all patches in one pass, then only keep the most recent batch of each test vector in the root keys patches contain.
+        """
+        self.latest_batches()
+        # entries merged or dropped, with their value before the merge
+        before = {}
+        for patch in patches:
+            for root_key, table in patch.data.items():
+                for test_entry_key, test_entry in table.items():
+                    current = self.get_entry(root_key, test_entry_key)
+                    before.setdefault((root_key, test_entry_key), current)
+                    if self.index(root_key, test_entry_key) == test_entry_key:
+                        if current is None:
+                            # never stored, nothing to remove
+                            del self._deprecated[(root_key, test_entry_key)]
+                        continue
+                    if current != test_entry:
+                        self.put(root_key, test_entry_key, test_entry)
+        patched = {root_key for patch in patches for root_key in patch.data}
+        for root_key, test_entry_key in [*self._deprecated]:
+            if root_key in patched:
+                before.setdefault((root_key, test_entry_key), self.get_entry(root_key, test_entry_key))
+                del self.data[root_key][test_entry_key]
+                del self._deprecated[(root_key, test_entry_key)]
+        report = MergeReport()
+        for (root_key, test_entry_key), previous in before.items():
+            after = self.get_entry(root_key, test_entry_key)
+            if after is None:
+                report.dropped.append((root_key, test_entry_key))
+            elif previous is None:
+                report.added.append((root_key, test_entry_key))
+            elif after != previous:
+                report.replaced.append((root_key, test_entry_key))
+            else:
+                report.unchanged.append((root_key, test_entry_key))
+        return report
+
+
+@dataclass
+class MergeReport:
+    """
+    (root_key, test_entry_key) of the entries a merge added, replaced with a different entry, left unchanged, or dropped as deprecated by a more recent batch.
+    entries are compared to their value before the merge.
+    """
+    added: list = field(default_factory=list)
+    replaced: list = field(default_factory=list)
+    unchanged: list = field(default_factory=list)
+    dropped: list = field(default_factory=list)
+
+
+# entry fields compared by diff_databases, the batch is part of mpdPath and zipPath
+DIFF_FIELDS = ('mpdPath', 'zipPath', 'representations')
+
+
+@dataclass
+class DatabaseDiff:
+    """
+    (root_key, test_entry_key) of the test vectors a database version added, removed, or changed, changed ones being listed with their new key.
+    patch is a database of the added and changed entries.
+    """
+    added: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+    changed: list = field(default_factory=list)
+    patch: Database = field(default_factory=lambda: Database({}))
+
+
+def diff_databases(old:Database, new:Database) -> DatabaseDiff:
+    """
+    compare the most recent batch of each test vector in both databases.
+    a test vector changed when its batch, or any of DIFF_FIELDS, differ.
+    """
+    old_latest = old.latest_batches()
+    new_latest = new.latest_batches()
+    diff = DatabaseDiff()
+    for (root_key, vector), test_entry_key in new_latest.items():
+        test_entry = new.get_entry(root_key, test_entry_key)
+        previous = old_latest.get((root_key, vector))
+        if previous is None:
+            diff.added.append((root_key, test_entry_key))
+        elif previous != test_entry_key or any(old.get_entry(root_key, previous).get(f) != test_entry.get(f) for f in DIFF_FIELDS):
+            diff.changed.append((root_key, test_entry_key))
+        else:
+            continue
+        diff.patch.put(root_key, test_entry_key, test_entry)
+    for (root_key, vector), test_entry_key in old_latest.items():
+        if (root_key, vector) not in new_latest:
+            diff.removed.append((root_key, test_entry_key))
+    return diff
+
+
+def split_entry_key(test_entry_key:str) -> tuple:
+    """
+    (sets, fps, test_id, batch) of a test entry key, eg. 'chh1_sets/12.5_25_50/t1/2024-02-01/'. Nones when the key doesn't have 4 parts.
+    """
+    parts = test_entry_key.rstrip('/').split('/')
+    return tuple(parts) if len(parts) == 4 else (None, None, None, None)
 
 
-    def merge(self, patch:'Database'):
-        def remove_deprecated(table):
-            clean = {}
-            keys = {}
-            for entry in table.keys():
-                parts = entry.split("/")
-                batch = parts.pop()
-                k = "/".join(parts)
-                if k in keys:
-                    keys[k].append(batch)
+def vector_key(test_entry_key:str) -> tuple:
+    """
+    (test vector, batch) of a test entry key, eg. ('chh1_sets/12.5_25_50/t1', '2024-02-01'). keys without a batch are their own test vector.
+    """
+    sets, fps, test_id, batch = split_entry_key(test_entry_key)
+    if batch is None:
+        return test_entry_key, None
+    return f'{sets}/{fps}/{test_id}', batch
+
+
+class SqliteDatabase(Database):
+    """
+    Database stored in sqlite, indexed on profile, fps family, test id and batch.
+    Entries are written as they are added, the json database is exported with save().
+    """
+
+    def __init__(self, path:Path):
+        self.path = Path(path)
+        self.con = sqlite3.connect(self.path)
+        self.con.execute('''CREATE TABLE IF NOT EXISTS entries (
+            root_key TEXT NOT NULL, entry_key TEXT NOT NULL, sets TEXT, fps TEXT, test_id TEXT, batch TEXT, entry TEXT NOT NULL,
+            PRIMARY KEY (root_key, entry_key)
+        )''')
+        self.con.execute('CREATE INDEX IF NOT EXISTS entries_test ON entries (root_key, sets, test_id, fps, batch)')
+        self.con.commit()
+        self._latest = None
+
+    @property
+    def data(self) -> dict:
+        data = {}
+        for root_key, entry_key, entry in self.con.execute('SELECT root_key, entry_key, entry FROM entries ORDER BY rowid'):
+            data.setdefault(root_key, {})[entry_key] = json.loads(entry)
+        return data
+
+    def upsert(self, root_key:str, test_entry_key:str, test_entry:dict):
+        self.con.execute('''INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (root_key, entry_key) DO UPDATE SET entry = excluded.entry''',
+            (root_key, test_entry_key, *split_entry_key(test_entry_key), json.dumps(test_entry)))
+
+    def load(self, filename):
+        """
+        replace the content of the database with a json database.
+        """
+        with open(filename) as fo:
+            self.replace(json.load(fo))
+
+    def replace(self, data:dict):
+        """
+        replace the content of the database with data, in a single transaction.
+        """
+        with self.con:
+            self.con.execute('DELETE FROM entries')
+            for root_key, table in data.items():
+                for test_entry_key, test_entry in table.items():
+                    self.upsert(root_key, test_entry_key, test_entry)
+        self._latest = None
+
+    def save(self, filename=None):
+        """
+        export the database as json to filename. entries are already stored when filename is the database itself.
+        """
+        if filename is None or Path(filename).resolve() == self.path.resolve():
+            self.con.commit()
+            return
+        super().save(filename)
+
+    def add_entry(self, t:TestContent, m:Mezzanine, batch_dir:str):
+        test_entry_key, test_entry = self.format_entry(m, t, batch_dir)
+        with self.con:
+            self.upsert(Database.root_key(t), test_entry_key, test_entry)
+        if self._latest is not None:
+            self.index(Database.root_key(t), test_entry_key)
+
+    def find(self, tc:TestContent):
+        rows = self.con.execute('SELECT entry_key, entry FROM entries WHERE root_key = ? AND sets = ? AND test_id = ? ORDER BY rowid',
+                                (Database.root_key(tc), f'{tc.cmaf_media_profile.value}_sets', Database.test_id(tc)))
+        return {test_entry_key: json.loads(test_entry) for test_entry_key, test_entry in rows}
+
+    def iter_entries(self, profile=None):
+        if not profile:
+            for _, test_entry_key, test_entry in self.con.execute('SELECT root_key, entry_key, entry FROM entries ORDER BY rowid'):
+                yield test_entry_key, json.loads(test_entry)
+            return
+        rows = self.con.execute('''SELECT entry_key, entry FROM entries
+            WHERE substr(entry_key, 1, length(?1)) = ?1 OR (substr(entry_key, 1, 14) = 'switching_sets' AND instr(entry_key, ?1) > 0)
+            ORDER BY rowid''', (profile,))
+        for test_entry_key, test_entry in rows:
+            yield test_entry_key, json.loads(test_entry)
+
+    def entry_keys(self):
+        # entries are not decoded
+        yield from self.con.execute('SELECT root_key, entry_key FROM entries ORDER BY rowid')
+
+    def get_entry(self, root_key:str, test_entry_key:str):
+        row = self.con.execute('SELECT entry FROM entries WHERE root_key = ? AND entry_key = ?', (root_key, test_entry_key)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def merge(self, *patches:'Database') -> MergeReport:
+        """
+        same as Database.merge, with a few statements over a temporary table of the patch entries.
+        the most recent batch of a test vector is looked up through the entries_test index, nothing else is read from the database.
+        """
+        con = self.con
+        con.execute('''CREATE TEMP TABLE IF NOT EXISTS patch (
+            root_key TEXT NOT NULL, entry_key TEXT NOT NULL, sets TEXT, fps TEXT, test_id TEXT, batch TEXT, entry TEXT NOT NULL,
+            PRIMARY KEY (root_key, entry_key)
+        )''')
+        con.execute('CREATE INDEX IF NOT EXISTS temp.patch_test ON patch (root_key, sets, test_id, fps, batch)')
+        # entries e of which a more recent batch exists in the database or in the patches
+        deprecated = '''e.batch IS NOT NULL AND (
+            EXISTS (SELECT 1 FROM entries AS x WHERE x.root_key = e.root_key AND x.sets = e.sets AND x.test_id = e.test_id
+                AND x.fps = e.fps AND x.batch > e.batch)
+            OR EXISTS (SELECT 1 FROM patch AS x WHERE x.root_key = e.root_key AND x.sets = e.sets AND x.test_id = e.test_id
+                AND x.fps = e.fps AND x.batch > e.batch))'''
+        report = MergeReport()
+        with con:
+            con.execute('DELETE FROM patch')
+            patched = set()
+            for patch in patches:
+                for root_key, table in patch.data.items():
+                    patched.add(root_key)
+                    con.executemany('''INSERT INTO patch VALUES (?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (root_key, entry_key) DO UPDATE SET entry = excluded.entry''',
+                        [(root_key, k, *split_entry_key(k), json.dumps(v)) for k, v in table.items()])
+            for root_key, test_entry_key, stored, unchanged in con.execute(f'''SELECT e.root_key, e.entry_key, s.entry IS NOT NULL, s.entry = e.entry
+                    FROM patch AS e LEFT JOIN entries AS s ON s.root_key = e.root_key AND s.entry_key = e.entry_key
+                    WHERE NOT ({deprecated}) ORDER BY e.rowid'''):
+                if not stored:
+                    report.added.append((root_key, test_entry_key))
+                elif unchanged:
+                    report.unchanged.append((root_key, test_entry_key))
                 else:
-                    keys[k] = [batch]
-            for k, batches in keys.items():
-                key = k + '/' + sorted(batches)[-1]
-                clean[key] = table[key]
-            return clean
-            
-        for root_key, table in patch.data.items():
-            for test_entry_key, value in table.items():
-                self.data[root_key][test_entry_key] = value
-            self.data[root_key] = remove_deprecated(self.data[root_key])
+                    report.replaced.append((root_key, test_entry_key))
+            # patch entries never stored, then stored entries
+            report.dropped += con.execute(f'''SELECT root_key, entry_key FROM patch AS e WHERE {deprecated}
+                AND NOT EXISTS (SELECT 1 FROM entries AS s WHERE s.root_key = e.root_key AND s.entry_key = e.entry_key) ORDER BY rowid''').fetchall()
+            dropped = con.execute(f'''SELECT root_key, entry_key FROM entries AS e
+                WHERE root_key IN (SELECT value FROM json_each(?)) AND {deprecated} ORDER BY rowid''', (json.dumps(sorted(patched)),)).fetchall()
+            report.dropped += dropped
+            con.execute(f'''INSERT INTO entries SELECT root_key, entry_key, sets, fps, test_id, batch, entry FROM patch AS e
+                WHERE NOT ({deprecated}) ORDER BY rowid
+                ON CONFLICT (root_key, entry_key) DO UPDATE SET entry = excluded.entry WHERE entry != excluded.entry''')
+            con.executemany('DELETE FROM entries WHERE root_key = ? AND entry_key = ?', dropped)
+            con.execute('DELETE FROM patch')
+        self._latest = None
+        return report
+
+    def close(self):
+        self.con.close()
+
+
+def open_database(path, create=True) -> Database:
+    """
+    database stored in path: a SqliteDatabase when its suffix is .sqlite or .db, otherwise a json Database, loaded when the file exists.
+    a database that doesn't exist is only created with create, otherwise FileNotFoundError is raised.
+    """
+    if not create and not Path(path).exists():
+        raise FileNotFoundError(f'database not found: {path}')
+    if Path(path).suffix in SQLITE_SUFFIXES:
+        return SqliteDatabase(path)
+    db = Database({})
+    if Path(path).exists():
+        db.load(path)
+    return db
@@ -1,55 +1,332 @@
+import io
+import os
+import re
+import errno
 import sys
+import math
+import shutil
+import difflib
+import hashlib
 import subprocess
 import xml.dom.minidom
 from pathlib import Path
+from fractions import Fraction
+from contextlib import ExitStack
 
-from tcgen.models import TestContent, Mezzanine, CmafStructuralBrand, CmafBrand, PROFILES_TYPE, HlgSignaling
-from tcgen.run_encode import HR_SPLIT_LOG
+from tcgen.models import TestContent, Mezzanine, CmafStructuralBrand, CmafBrand, CmafFragmentType, PROFILES_TYPE, HlgSignaling, FPS_FAMILY, locate_source_content
+from tcgen.database import Database
+from tcgen.run_encode import HR_SPLIT_LOG, Representation, DASH, format_gpac_command, format_gpac_fan_out_command, gpac_version, assert_gpac
+from tcgen.cache import EncodeCache, FrameCache, StagingCache, FRAMES_FILE
+from tcgen.progress import ProgressMonitor, PROGRESS_INTERVAL, PROGRESS_FILE
+from tcgen.journal import Journal, atomic_dir, ENCODE, ENCRYPT, PATCH
+from tcgen.mpd import rewrite_mpd, verify_segment_timeline
 
 GPAC_EXECUTABLE = "/usr/local/bin/gpac"
-TCGEN_RUN_ENCODE = Path(__file__).parent / 'run_encode.py'
-    
-def encode_stream(m:Mezzanine, tc:TestContent, test_stream_dir:Path, dry_run=False):
+ELEMENTARY_STREAM = 'es.mp4'
+CHUNKS_DIR = 'chunks'
+
+# decoded and scaled frames read by encodes when available, see use_frame_cache
+FRAME_CACHE:FrameCache = None
+
+
+# local copies of mezzanines read by encodes when available, see use_staging
+STAGING:StagingCache = None
+
+
+def use_frame_cache(frame_cache:FrameCache):
+    global FRAME_CACHE
+    FRAME_CACHE = frame_cache
+
+
+def use_staging(staging:StagingCache):
+    global STAGING
+    STAGING = staging
+
+
+def source_file(m:Mezzanine) -> Path:
+    """
+    the local copy of a mezzanine when it was staged, otherwise its location in the mezzanine directory.
+    """
+    if STAGING is not None:
+        staged = STAGING.staged(StagingCache.key(m.md5), m.filename)
+        if staged is not None:
+            return staged
+    return m.root_dir / m.filename
+
+
+def stage_mezzanine(tc:TestContent, fps_family:FPS_FAMILY, staging:StagingCache, token:str) -> Path:
+    """
+    Copy the mezzanine of a test vector to the staging cache, pinned for token.
+    When it doesn't fit, encodes read the mezzanine directory instead.
+    """
+    m = locate_source_content(tc, fps_family)
+    staged = staging.stage(StagingCache.key(m.md5), m.root_dir / m.filename, m.md5, token)
+    if staged is None:
+        print(f'not staged, exceeds the staging cache size: {m.filename}')
+    return staged
+
+
+def encode_stream(m:Mezzanine, tc:TestContent, test_stream_dir:Path, dry_run=False, test_stream_cenc_dir:Path=None, drm_config:Path=None):
     """
     Encode, package, and manifest generation (DASH-only)
+    With test_stream_cenc_dir, the same session also produces the encrypted test vector.
+    """
+    run_encode(m, tc, source_file(m), test_stream_dir, 'stream.mpd', dry_run=dry_run, cenc_dir=test_stream_cenc_dir, drm_config=drm_config)
+    return test_stream_dir / 'stream.mpd'
+
+
+def encode_elementary_stream(m:Mezzanine, tc:TestContent, es_dir:Path, dry_run=False):
+    """
+    Encode only, into an intermediate elementary stream that can be packaged into several test vectors.
+    """
+    run_encode(m, tc, source_file(m), es_dir, ELEMENTARY_STREAM, stage='encode', dry_run=dry_run)
+    return es_dir / ELEMENTARY_STREAM
+
+
+def chunk_ranges(m:Mezzanine, tc:TestContent, chunks:int) -> list[tuple[Fraction, Fraction]]:
+    """
+    split the mezzanine into at most `chunks` time ranges of whole segments, the last one extending to the end.
+    every segment starts with an IDR of a closed GOP (no scenecut, fixed GOP, no open GOP), so that these ranges
+    can be encoded independently, and joined into the elementary stream the serial encode would have produced.
     """
     seg_dur = tc.get_seg_dur(m)
-    
+    segments = math.ceil(Fraction(str(m.duration)) / seg_dur)
+    per_chunk = math.ceil(segments / max(1, chunks))
+    starts = [i * per_chunk * seg_dur for i in range(math.ceil(segments / per_chunk))]
+    return [(start, starts[i + 1] if i + 1 < len(starts) else None) for i, start in enumerate(starts)]
+
+
+def chunk_dir(es_dir:Path, index:int) -> Path:
+    return Path(es_dir) / CHUNKS_DIR / f'{index:03d}'
+
+
+def encode_chunk(m:Mezzanine, tc:TestContent, es_dir:Path, index:int, time_range:tuple, dry_run=False):
+    """
+    Encode only a time range of the mezzanine, into the elementary stream of a chunk of es_dir.
+    """
+    output_dir = chunk_dir(es_dir, index)
+    run_encode(m, tc, source_file(m), output_dir, ELEMENTARY_STREAM, stage='encode', dry_run=dry_run, time_range=time_range)
+    return output_dir / ELEMENTARY_STREAM
+
+
+def join_chunks(es_dir:Path, count:int, dry_run=False):
+    """
+    Concatenate the elementary streams of the chunks of es_dir, in order, into the elementary stream of es_dir.
+    Chunks are removed once joined.
+    """
+    es_file = Path(es_dir) / ELEMENTARY_STREAM
+    chunk_files = [chunk_dir(es_dir, i) / ELEMENTARY_STREAM for i in range(count)]
+    join_cmd = f'{GPAC_EXECUTABLE} -strict-error flist:srcs={",".join(str(f) for f in chunk_files)} -o {es_file}'
+    print(f'\nprocessing: {es_dir}')
+    if dry_run:
+        print(join_cmd + '\n')
+        return es_file
+    logfile = Path(es_dir) / 'log.txt'
+    with open(logfile, 'w') as fo:
+        fo.write(HR_SPLIT_LOG)
+        fo.write(join_cmd + '\n\n')
+        fo.write(HR_SPLIT_LOG)
+        fo.flush()
+        subprocess.run(join_cmd, shell=True, stdout=fo, stderr=subprocess.STDOUT).check_returncode()
+    shutil.rmtree(Path(es_dir) / CHUNKS_DIR)
+    return es_file
+
+
+def package_stream(m:Mezzanine, tc:TestContent, es_file:Path, test_stream_dir:Path, dry_run=False, test_stream_cenc_dir:Path=None, drm_config:Path=None):
+    """
+    Package, and manifest generation (DASH-only) of an elementary stream produced by encode_elementary_stream.
+    With test_stream_cenc_dir, the same session also produces the encrypted test vector.
+    """
+    run_encode(m, tc, es_file, test_stream_dir, 'stream.mpd', stage='package', dry_run=dry_run, cenc_dir=test_stream_cenc_dir, drm_config=drm_config)
+    return test_stream_dir / 'stream.mpd'
+
+
+def encode_representation(m:Mezzanine, tc:TestContent, input_file, time_range:tuple=None, raw_input=False) -> Representation:
+    """
+    encoder options of a test vector
+    """
     # @TODO: remove 'codec_defaults', always infer config from test matrix
     media_type, codec, codec_defaults = PROFILES_TYPE[tc.cmaf_media_profile]
     if codec_defaults is None: 
          codec_defaults = tc.cmaf_media_profile
 
-    reps_command = f"id:{tc.test_id},type:{media_type},codec:{codec},vse:{tc.sample_entry},cmaf:{codec_defaults.value}"
-    reps_command += f",fps:{m.fps.numerator}/{m.fps.denominator},res:{tc.resolution},bitrate:{tc.bitrate}"
-    reps_command += f",input:'{m.root_dir/m.filename}',pic_timing:{tc.picture_timing_sei},vui_timing:{tc.vui_timing},sd:{str(seg_dur)},bf:{tc.fragment_type.value}"
-    if tc.hlg_signaling == HlgSignaling.VUI:
-        reps_command += f",hlg:vui"
-    if tc.aspect_ratio_idc != 1:
-        reps_command += f",sar:{tc.aspect_ratio_idc}" # @TODO: not tested after refactoring
-    if m.mastering_display:
-        reps_command += f',"hdr_mastering_display:{m.mastering_display.replace(',','~')}"'
-    if m.max_cll_fall:
-        reps_command += f",max_cll_fall:{m.max_cll_fall.replace(',','~')}"
-    # Finalize one-AdaptationSet formatting
-    reps_command = "--reps=" + reps_command
-    title = title_notice(m, tc)
-    # TODO: this needs to be integrated as a tcgen function instead of being called as an external script. 
-    # the extra parameter to arguments conversion is error prone and makes debugging difficult. 
-    encode_dash_cmd = f"python3 {TCGEN_RUN_ENCODE} --path={GPAC_EXECUTABLE} --out=stream.mpd --outdir={test_stream_dir}"
-    encode_dash_cmd += f" --dash=sd:{seg_dur},fd:{seg_dur},ft:{tc.fragment_type.value},fr:{m.fps.numerator}/{m.fps.denominator},cmaf:{tc.cmaf_structural_brand.value}"
-    encode_dash_cmd += f" --copyright=\'{m.copyright_notice}\' --source=\'{m.source_notice}\' --title=\'{title}\' --profile={tc.cmaf_media_profile.value}"
-    encode_dash_cmd += f" {reps_command}"
-    print(f'\nprocessing: {test_stream_dir}')
+    return Representation(
+        id=tc.test_id,
+        input=input_file,
+        media_type=media_type,
+        codec=codec,
+        bitrate=tc.bitrate,
+        cmaf_profile=codec_defaults.value,
+        video_sample_entry=tc.sample_entry,
+        resolution=str(tc.resolution),
+        frame_rate=f"{m.fps.numerator}/{m.fps.denominator}",
+        aspect_ratio=tc.aspect_ratio_idc if tc.aspect_ratio_idc != 1 else None, # @TODO: not tested after refactoring
+        num_b_frames=0 if tc.fragment_type == CmafFragmentType.EVERY_FRAME else 2,
+        hlg_signaling=tc.hlg_signaling.value if tc.hlg_signaling == HlgSignaling.VUI else None,
+        pic_timing=tc.picture_timing_sei,
+        vui_timing=tc.vui_timing,
+        segment_duration=tc.get_seg_dur(m),
+        hdr_mastering_display=m.mastering_display,
+        max_cll_fall=m.max_cll_fall,
+        time_range=time_range,
+        raw_input=raw_input
+    )
+
+
+def encode_dash(m:Mezzanine, tc:TestContent) -> DASH:
+    """
+    packaging options of a test vector
+    """
+    seg_dur = tc.get_seg_dur(m)
+    return DASH(
+        segment_duration=seg_dur,
+        fragment_duration=seg_dur,
+        fragment_type=tc.fragment_type.value,
+        frame_rate=f"{m.fps.numerator}/{m.fps.denominator}",
+        cmaf_brand=tc.cmaf_structural_brand.value
+    )
+
+
+def encode_command(m:Mezzanine, tc:TestContent, input_file, output_file, stage=None, cenc_output_file=None, drm_config=None, time_range:tuple=None,
+                   raw_input=False) -> str:
+    return format_gpac_command(GPAC_EXECUTABLE, [encode_representation(m, tc, input_file, time_range, raw_input)], encode_dash(m, tc), output_file, stage,
+                               cenc_output_file, drm_config)
+
+
+def frames_key(m:Mezzanine, tc:TestContent) -> str:
+    """
+    content address of the decoded and scaled frames a test vector is encoded from: mezzanine md5, output size and pixel format.
+    """
+    r = encode_representation(m, tc, m.filename)
+    return FrameCache.key(m.md5, f'{r.m_resolution_w}x{r.m_resolution_h}', r.raw_pixel_format())
+
+
+def cached_frames(m:Mezzanine, tc:TestContent) -> Path:
+    """
+    location of the frames a test vector is encoded from in the frame cache, None when they aren't cached.
+    """
+    if FRAME_CACHE is None:
+        return None
+    return FRAME_CACHE.frames(frames_key(m, tc))
+
+
+def produce_frames(tc:TestContent, fps_family:FPS_FAMILY, frame_cache:FrameCache, dry_run=False):
+    """
+    Decode and scale the mezzanine of a test vector into raw frames, stored to the frame cache.
+    """
+    m = locate_source_content(tc, fps_family)
+    key = frames_key(m, tc)
+    tmp_dir = frame_cache.tmp_dir(key)
+    r = encode_representation(m, tc, source_file(m))
+    command = f'{GPAC_EXECUTABLE} -i "{r.m_input}" {r.format_scaler(r.raw_pixel_format())}:FID=SCL -o {tmp_dir / FRAMES_FILE}:SID=SCL'
+    print(f'\nprocessing: {frame_cache.entry_dir(key)}')
     if dry_run:
-        encode_dash_cmd += " --dry-run"
-        subprocess.run(encode_dash_cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT).check_returncode()
-    else:
-        logfile = Path(test_stream_dir) / 'log.txt'
-        logfile.parent.mkdir(parents=True, exist_ok=True)
-        with open(logfile, 'w') as fo:
-            subprocess.run(encode_dash_cmd, shell=True, stdout=fo, stderr=subprocess.STDOUT).check_returncode()
-    return test_stream_dir / 'stream.mpd'
+        print(command + '\n')
+        return frame_cache.entry_dir(key) / FRAMES_FILE
+    if frame_cache.contains(key):
+        return frame_cache.frames(key)
+    # raw bitrate, in kbps
+    bitrate = tc.resolution.w * tc.resolution.h * 1.5 * (2 if r.raw_pixel_format() == "yuv420_10" else 1) * float(m.fps) * 8 / 1000
+    try:
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        run_gpac(command, tmp_dir, ProgressMonitor(tmp_dir, Fraction(str(m.duration)), m.fps, tc.get_seg_dur(m), bitrate))
+        frame_cache.store(key, tmp_dir, ignore=(PROGRESS_FILE,))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return frame_cache.frames(key)
+
+
+def run_encode(m:Mezzanine, tc:TestContent, input_file:Path, output_dir:Path, output_file:str, stage=None, dry_run=False, cenc_dir:Path=None, drm_config:Path=None,
+               time_range:tuple=None):
+    cenc_output_file = None
+    if cenc_dir is not None:
+        assert Path(drm_config).exists(), f'DRM config file not found: {drm_config}'
+        cenc_output_file = Path(cenc_dir) / output_file
+    frames = None if (stage == 'package' or dry_run) else cached_frames(m, tc)
+    if frames is not None:
+        input_file = frames
+    command = encode_command(m, tc, input_file, Path(output_dir) / output_file, stage, cenc_output_file, drm_config, time_range, frames is not None)
+    print(f'\nprocessing: {output_dir}')
+    if cenc_dir is not None:
+        print(f'processing: {cenc_dir}')
+    if dry_run:
+        print(command + '\n')
+        return
+    duration = Fraction(str(m.duration))
+    if time_range is not None:
+        start, end = time_range
+        duration = (duration if end is None else end) - start
+    run_gpac(command, output_dir, ProgressMonitor(output_dir, duration, m.fps, tc.get_seg_dur(m), tc.bitrate))
+    if cenc_dir is not None:
+        shutil.copyfile(Path(output_dir) / 'log.txt', Path(cenc_dir) / 'log.txt')
+
+
+def run_gpac(command:str, output_dir:Path, monitor:ProgressMonitor):
+    """
+    run a gpac session, logging to output_dir/log.txt, and sampling its progress with monitor while it runs.
+    """
+    assert_gpac(GPAC_EXECUTABLE)
+    logfile = Path(output_dir) / 'log.txt'
+    logfile.parent.mkdir(parents=True, exist_ok=True)
+    with open(logfile, 'w') as fo:
+        fo.write(HR_SPLIT_LOG)
+        fo.write(command)
+        fo.write(HR_SPLIT_LOG)
+        fo.write(gpac_version(GPAC_EXECUTABLE))
+        fo.write(HR_SPLIT_LOG)
+        fo.flush()
+        proc = subprocess.Popen(command, shell=True, stdout=fo, stderr=subprocess.STDOUT)
+        try:
+            while True:
+                try:
+                    proc.wait(timeout=PROGRESS_INTERVAL)
+                    break
+                except subprocess.TimeoutExpired:
+                    monitor.sample()
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+        monitor.sample()
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, command)
+
+
+def encode_cache_key(m:Mezzanine, tc:TestContent, chunks=1):
+    """
+    content address of an encoded test vector: mezzanine md5, effective gpac command, and gpac version.
+    the command is rendered with placeholder input and output locations, so that it doesn't depend on the batch.
+    chunked encodes are addressed separately, rate control differing from the serial encode at chunk boundaries.
+    """
+    command = encode_command(m, tc, '$MEZZANINE', 'stream.mpd')
+    if chunks > 1:
+        command += f' chunks={chunks}'
+    return EncodeCache.key(m.md5, command, gpac_version(GPAC_EXECUTABLE))
+
+
+def num_b_frames(m:Mezzanine, tc:TestContent) -> int:
+    return 0 if (tc.fragment_type == CmafFragmentType.EVERY_FRAME or m.fps < 14) else 2
+
+
+def encoder_settings(m:Mezzanine, tc:TestContent):
+    """
+    the subset of test vector options affecting the encoder output. test vectors sharing these settings
+    only differ in packaging (sample entry, CMAF structural brand, VUI timing and SEI removal, fragmentation),
+    and may be packaged from a single elementary stream.
+    """
+    seg_dur = tc.get_seg_dur(m)
+    b_frames = num_b_frames(m, tc)
+    return (
+        m.filename,
+        tc.cmaf_media_profile.value,
+        str(tc.resolution),
+        tc.bitrate,
+        str(seg_dur),
+        b_frames,
+        tc.picture_timing_sei,
+        tc.hlg_signaling.value,
+        tc.aspect_ratio_idc
+    )
 
 
 def encrypt_stream_cenc(test_stream_cenc_dir:Path, test_stream_dir:Path, drm_config:Path, dry_run=False):
@@ -72,6 +349,293 @@ def encrypt_stream_cenc(test_stream_cenc_dir:Path, test_stream_dir:Path, drm_con
     return stream_cenc_mpd
 
 
+def clear_stream_location(test_stream_cenc_dir:Path) -> Path:
+    """
+    location of the clear test vector an encrypted test vector is generated from.
+    """
+    return Path(re.sub(r"[-_]c?enc/", "/", str(test_stream_cenc_dir)))
+
+
+def produce_stream(m:Mezzanine, tc:TestContent, test_stream_dir:Path, es_file:Path=None, cache:EncodeCache=None, dry_run=False,
+                   test_stream_cenc_dir:Path=None, drm_config:Path=None, chunks=1):
+    """
+    Materialize a clear test vector from the cache, or encode it (package it when es_file is specified) and store it to the cache.
+    With test_stream_cenc_dir, the encrypted test vector is produced in the same gpac session,
+    or encrypted from the clear one when it is found in the cache.
+    chunks is the number of chunks es_file was encoded in, or the test vector is looked up with in the cache without es_file.
+    """
+    cache_key = encode_cache_key(m, tc, chunks) if (cache is not None and not dry_run) else None
+    if cache_key and cache.materialize(cache_key, test_stream_dir):
+        print(f'\ncache hit: {test_stream_dir}')
+        if test_stream_cenc_dir is not None:
+            encrypt_stream_cenc(test_stream_cenc_dir, test_stream_dir, drm_config, dry_run)
+        return test_stream_dir / 'stream.mpd'
+    if es_file is not None:
+        output_mpd = package_stream(m, tc, es_file, test_stream_dir, dry_run, test_stream_cenc_dir, drm_config)
+    else:
+        output_mpd = encode_stream(m, tc, test_stream_dir, dry_run, test_stream_cenc_dir, drm_config)
+        if cache_key:
+            # encoded serially
+            cache_key = encode_cache_key(m, tc)
+    if cache_key:
+        cache.store(cache_key, test_stream_dir, ignore=(PROGRESS_FILE,))
+    return output_mpd
+
+
+def step_done(journal:Journal, key:str, test_stream_dir:Path, step:str) -> bool:
+    return journal is not None and Path(test_stream_dir).exists() and journal.is_done(key, step)
+
+
+def encode_test_vector(tc:TestContent, fps_family:FPS_FAMILY, vectors_dir:Path, batch_dir:str, *, encode=True, format_mpd=True, drm_config=None,
+                       dry_run=False, es_file:Path=None, cache:EncodeCache=None, journal:Journal=None, chunks=1):
+    """
+    Encode (or encrypt) then patch the mpd of a single test vector, for one framerate family.
+    When es_file is specified, the test vector is packaged from that elementary stream instead of being encoded,
+    chunks being the number of chunks it was encoded in.
+    When a cache is specified, the encoded test vector is looked up in and stored to the cache.
+    Outputs are written to a '.partial' directory, moved into place once all steps succeeded.
+    When a journal is specified, completed steps are recorded to it, and steps it already lists are skipped.
+    """
+    m = locate_source_content(tc, fps_family)
+    key = Database.test_entry_key(fps_family, tc, batch_dir)
+    test_stream_dir = Path(vectors_dir) / Database.test_entry_location(fps_family, tc, batch_dir)
+    output_mpd = test_stream_dir / 'stream.mpd'
+    if dry_run:
+        journal = None
+
+    def done(step):
+        return step_done(journal, key, test_stream_dir, step)
+
+    def record(*steps):
+        if journal is not None:
+            for step in steps:
+                journal.record(key, step)
+
+    if tc.encryption:
+        step = ENCRYPT
+        produce = lambda work_dir: encrypt_stream_cenc(work_dir, clear_stream_location(test_stream_dir), drm_config, dry_run)
+    else:
+        step = ENCODE
+        produce = lambda work_dir: produce_stream(m, tc, work_dir, es_file, cache, dry_run or not encode, chunks=chunks)
+
+    if dry_run or not (encode or tc.encryption):
+        produce(test_stream_dir)
+    elif done(step):
+        print(f'\nresumed: {test_stream_dir}')
+    else:
+        with atomic_dir(test_stream_dir) as work_dir:
+            produce(work_dir)
+            if format_mpd:
+                patch_mpd(work_dir / 'stream.mpd', m, tc)
+        record(step)
+        if format_mpd:
+            record(PATCH)
+        return output_mpd
+
+    if format_mpd and not dry_run and not done(PATCH):
+        patch_mpd(output_mpd, m, tc)
+        record(PATCH)
+    return output_mpd
+
+
+def encode_test_vector_pair(tc:TestContent, cenc_tc:TestContent, fps_family:FPS_FAMILY, vectors_dir:Path, batch_dir:str, *, format_mpd=True,
+                            drm_config=None, es_file:Path=None, cache:EncodeCache=None, journal:Journal=None, chunks=1):
+    """
+    Encode a clear test vector and its encrypted counterpart in a single gpac session:
+    the encoded stream is packaged, and also encrypted then packaged, rather than read back from disk for encryption.
+    """
+    key = Database.test_entry_key(fps_family, tc, batch_dir)
+    cenc_key = Database.test_entry_key(fps_family, cenc_tc, batch_dir)
+    test_stream_dir = Path(vectors_dir) / Database.test_entry_location(fps_family, tc, batch_dir)
+    test_stream_cenc_dir = Path(vectors_dir) / Database.test_entry_location(fps_family, cenc_tc, batch_dir)
+    if step_done(journal, key, test_stream_dir, ENCODE) or step_done(journal, cenc_key, test_stream_cenc_dir, ENCRYPT):
+        # resuming a batch where these were processed separately
+        encode_test_vector(tc, fps_family, vectors_dir, batch_dir, format_mpd=format_mpd, drm_config=drm_config, es_file=es_file, cache=cache,
+                           journal=journal, chunks=chunks)
+        return encode_test_vector(cenc_tc, fps_family, vectors_dir, batch_dir, format_mpd=format_mpd, drm_config=drm_config, journal=journal)
+
+    m = locate_source_content(tc, fps_family)
+    m_cenc = locate_source_content(cenc_tc, fps_family)
+    with atomic_dir(test_stream_dir) as work_dir, atomic_dir(test_stream_cenc_dir) as cenc_work_dir:
+        produce_stream(m, tc, work_dir, es_file, cache, False, cenc_work_dir, drm_config, chunks)
+        if format_mpd:
+            patch_mpd(work_dir / 'stream.mpd', m, tc)
+            patch_mpd(cenc_work_dir / 'stream.mpd', m_cenc, cenc_tc)
+    if journal is not None:
+        journal.record(key, ENCODE)
+        journal.record(cenc_key, ENCRYPT)
+        if format_mpd:
+            journal.record(key, PATCH)
+            journal.record(cenc_key, PATCH)
+    return test_stream_cenc_dir / 'stream.mpd'
+
+
+def move_dir(src:Path, dst:Path) -> bool:
+    """
+    move directory src to the empty directory dst: renamed when both are on the same filesystem, otherwise copied.
+    returns True when src was renamed, False when it was copied and is left for the caller to remove.
+    """
+    try:
+        os.replace(src, dst)
+        return True
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    shutil.copytree(src, dst, dirs_exist_ok=True)
+    return False
+
+
+def promote_test_vector(tc:TestContent, cenc_tc:TestContent, fps_family:FPS_FAMILY, scratch_dir:Path, vectors_dir:Path, batch_dir:str, *,
+                        format_mpd=True, cache:EncodeCache=None, journal:Journal=None, chunks=1):
+    """
+    Move a test vector encoded in scratch_dir to vectors_dir, along with its encrypted counterpart cenc_tc when specified,
+    then store it to the cache and patch the mpds, as encode_test_vector(_pair) does when encoding into vectors_dir.
+    """
+    m = locate_source_content(tc, fps_family)
+    for t in (tc, cenc_tc):
+        if t is None:
+            continue
+        location = Database.test_entry_location(fps_family, t, batch_dir)
+        src = Path(scratch_dir) / location
+        with atomic_dir(Path(vectors_dir) / location) as work_dir:
+            renamed = move_dir(src, work_dir)
+            try:
+                if t is tc and cache is not None:
+                    cache.store(encode_cache_key(m, tc, chunks), work_dir, ignore=(PROGRESS_FILE,))
+                if format_mpd:
+                    patch_mpd(work_dir / 'stream.mpd', locate_source_content(t, fps_family), t)
+            except BaseException:
+                if renamed:
+                    # back to scratch_dir, so that promotion can be retried
+                    os.replace(work_dir, src)
+                raise
+        if not renamed:
+            shutil.rmtree(src)
+        if journal is not None and format_mpd:
+            journal.record(Database.test_entry_key(fps_family, t, batch_dir), PATCH)
+    return Path(vectors_dir) / Database.test_entry_location(fps_family, tc, batch_dir) / 'stream.mpd'
+
+
+def encode_shared_stream(tc:TestContent, fps_family:FPS_FAMILY, es_dir:Path, dry_run=False):
+    """
+    Encode the elementary stream shared by test vectors having the same encoder_settings as tc.
+    """
+    m = locate_source_content(tc, fps_family)
+    return encode_elementary_stream(m, tc, es_dir, dry_run)
+
+
+def encode_shared_stream_chunk(tc:TestContent, fps_family:FPS_FAMILY, es_dir:Path, index:int, chunks:int, dry_run=False):
+    """
+    Encode one of the chunk_ranges of the elementary stream encoded by encode_shared_stream.
+    """
+    m = locate_source_content(tc, fps_family)
+    return encode_chunk(m, tc, es_dir, index, chunk_ranges(m, tc, chunks)[index], dry_run)
+
+
+def join_shared_stream(tc:TestContent, fps_family:FPS_FAMILY, es_dir:Path, chunks:int, dry_run=False):
+    """
+    Join the chunks encoded by encode_shared_stream_chunk.
+    """
+    m = locate_source_content(tc, fps_family)
+    return join_chunks(es_dir, len(chunk_ranges(m, tc, chunks)), dry_run)
+
+
+def fan_out_key(m:Mezzanine, tc:TestContent, fps_family:FPS_FAMILY):
+    """
+    test vectors sharing this key have their source content decoded and scaled the same way,
+    and may be encoded by a single gpac session, see encode_fan_out.
+    """
+    r = encode_representation(m, tc, m.filename)
+    return (fps_family.value, m.filename, r.m_resolution_w, r.m_resolution_h, r.m_cmaf_profile)
+
+
+def run_fan_out(outputs:list[tuple], drm_config:Path=None, dry_run=False):
+    """
+    outputs are (m, tc, output_dir, output_file, stage, cenc_dir) tuples sharing the same fan_out_key.
+    the session log is copied to each output directory, its progress is sampled on the first one.
+    """
+    frames = None if dry_run else cached_frames(*outputs[0][:2])
+    command = format_gpac_fan_out_command(GPAC_EXECUTABLE, [
+        (encode_representation(m, tc, frames or source_file(m), raw_input=frames is not None), encode_dash(m, tc), Path(output_dir) / output_file, stage,
+         None if cenc_dir is None else Path(cenc_dir) / output_file)
+        for m, tc, output_dir, output_file, stage, cenc_dir in outputs
+    ], drm_config)
+    log_dirs = []
+    for _, _, output_dir, _, _, cenc_dir in outputs:
+        log_dirs += [Path(output_dir)] if cenc_dir is None else [Path(output_dir), Path(cenc_dir)]
+    for d in log_dirs:
+        print(f'\nprocessing: {d}')
+    if dry_run:
+        print(command + '\n')
+        return
+    if any(cenc_dir is not None for *_, cenc_dir in outputs):
+        assert Path(drm_config).exists(), f'DRM config file not found: {drm_config}'
+    m, tc, output_dir, _, _, _ = outputs[0]
+    run_gpac(command, output_dir, ProgressMonitor(output_dir, Fraction(str(m.duration)), m.fps, tc.get_seg_dur(m), tc.bitrate))
+    for d in log_dirs[1:]:
+        d.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(Path(output_dir) / 'log.txt', d / 'log.txt')
+
+
+def encode_fan_out(branches:list[tuple], fps_family:FPS_FAMILY, vectors_dir:Path, batch_dir:str, *, format_mpd=True, drm_config=None,
+                   dry_run=False, cache:EncodeCache=None, journal:Journal=None):
+    """
+    Encode several test vectors sharing the same fan_out_key in a single gpac session: the mezzanine is decoded and scaled once,
+    feeding one encoder and packager per test vector.
+    branches are (tc, cenc_tc, es_dir) tuples. With es_dir, the branch encodes the elementary stream of encode_shared_stream,
+    otherwise it produces a test vector as encode_test_vector does, along with its encrypted counterpart cenc_tc when specified.
+    Test vectors found in the cache are materialized instead of being encoded.
+    """
+    outputs = []
+    vectors = []
+    with ExitStack() as stack:
+        for tc, cenc_tc, es_dir in branches:
+            m = locate_source_content(tc, fps_family)
+            if es_dir is not None:
+                outputs.append((m, tc, Path(es_dir), ELEMENTARY_STREAM, 'encode', None))
+                continue
+            work_dir = Path(vectors_dir) / Database.test_entry_location(fps_family, tc, batch_dir)
+            cenc_work_dir = None if cenc_tc is None else Path(vectors_dir) / Database.test_entry_location(fps_family, cenc_tc, batch_dir)
+            if not dry_run:
+                work_dir = stack.enter_context(atomic_dir(work_dir))
+                if cenc_work_dir is not None:
+                    cenc_work_dir = stack.enter_context(atomic_dir(cenc_work_dir))
+            cache_key = encode_cache_key(m, tc) if (cache is not None and not dry_run) else None
+            if cache_key and cache.materialize(cache_key, work_dir):
+                print(f'\ncache hit: {work_dir}')
+                if cenc_work_dir is not None:
+                    encrypt_stream_cenc(cenc_work_dir, work_dir, drm_config)
+                cache_key = None
+            else:
+                outputs.append((m, tc, work_dir, 'stream.mpd', None, cenc_work_dir))
+            vectors.append((m, tc, cenc_tc, work_dir, cenc_work_dir, cache_key))
+
+        if len(outputs):
+            run_fan_out(outputs, drm_config, dry_run)
+        if dry_run:
+            return [output_dir / output_file for _, _, output_dir, output_file, _, _ in outputs]
+
+        for m, tc, cenc_tc, work_dir, cenc_work_dir, cache_key in vectors:
+            if cache_key:
+                cache.store(cache_key, work_dir, ignore=(PROGRESS_FILE,))
+            if format_mpd:
+                patch_mpd(work_dir / 'stream.mpd', m, tc)
+                if cenc_work_dir is not None:
+                    patch_mpd(cenc_work_dir / 'stream.mpd', locate_source_content(cenc_tc, fps_family), cenc_tc)
+
+    if journal is not None:
+        for _, tc, cenc_tc, _, _, _ in vectors:
+            key = Database.test_entry_key(fps_family, tc, batch_dir)
+            journal.record(key, ENCODE)
+            if format_mpd:
+                journal.record(key, PATCH)
+            if cenc_tc is not None:
+                cenc_key = Database.test_entry_key(fps_family, cenc_tc, batch_dir)
+                journal.record(cenc_key, ENCRYPT)
+                if format_mpd:
+                    journal.record(cenc_key, PATCH)
+    return [Path(vectors_dir) / Database.test_entry_location(fps_family, tc, batch_dir) / 'stream.mpd' for _, tc, _, _, _, _ in vectors]
+
 
 def patch_mpd(output_file, m:Mezzanine, tc:TestContent):
     """
@@ -79,6 +643,29 @@ def patch_mpd(output_file, m:Mezzanine, tc:TestContent):
     """
     return ContentModel.patch_mpd(output_file, m, tc)
 
+
+def repatch_test_vector(tc:TestContent, fps_family:FPS_FAMILY, vectors_dir:Path, batch_dir:str, dry_run=False, verify_timeline=False) -> str:
+    """
+    Patch the mpd of an existing test vector again, only rewriting it when the patched mpd differs from the one on disk.
+    With verify_timeline, the patched SegmentTimeline is checked against the tfdt of the segments before the mpd is written.
+    returns a unified diff of the changes, empty when the mpd is up to date.
+    """
+    output_file = Path(vectors_dir) / Database.test_entry_location(fps_family, tc, batch_dir) / 'stream.mpd'
+    m = locate_source_content(tc, fps_family)
+    cm = ContentModel(output_file, tc.cmaf_structural_brand.value, tc.cmaf_media_profile)
+    patched = cm.render(m.copyright_notice, m.source_notice, title_notice(m, tc))
+    if verify_timeline:
+        errors = verify_segment_timeline(output_file, patched)
+        if len(errors):
+            raise Exception(f'{len(errors)} segments don\'t match the SegmentTimeline, first: {errors[0]}')
+    current = output_file.read_bytes()
+    if hashlib.sha256(patched.encode('utf-8')).digest() == hashlib.sha256(current).digest():
+        return ''
+    diff = difflib.unified_diff(current.decode('utf-8').splitlines(keepends=True), patched.splitlines(keepends=True), str(output_file), str(output_file))
+    if not dry_run:
+        cm.write(patched)
+    return ''.join(diff)
+
 def title_notice(m:Mezzanine, tc:TestContent):
     media_type, _, _ = PROFILES_TYPE[tc.cmaf_media_profile]
     n = f"{tc.cmaf_media_profile.value}, Test Vector {tc.test_id}"
@@ -93,18 +680,42 @@ class ContentModel:
         cm = ContentModel(output_file, tc.cmaf_structural_brand.value, tc.cmaf_media_profile)
         cm.process(m.copyright_notice, m.source_notice, title_notice(m, tc))
     
-    def __init__(self, filename, structural_brand:CmafStructuralBrand, wave_media_profile:CmafBrand):
+    def __init__(self, filename, structural_brand:CmafStructuralBrand, wave_media_profile:CmafBrand, compact_timeline=True):
         self.m_filename = filename
         self.m_structural_brand = structural_brand
         self.m_wave_media_profile = wave_media_profile
+        # merge consecutive SegmentTimeline entries of equal duration
+        self.m_compact_timeline = compact_timeline
 
-    def process(self, copyright_notice, source_notice, title_notice):
+    def render(self, copyright_notice, source_notice, title_notice) -> str:
+        """
+        the patched mpd, without writing it.
+        """
+        out = io.StringIO()
+        rewrite_mpd(self.m_filename, out, self.m_structural_brand, self.m_wave_media_profile.value, copyright_notice, source_notice, title_notice, self.m_compact_timeline)
+        return out.getvalue()
+
+    def render_dom(self, copyright_notice, source_notice, title_notice) -> str:
+        """
+        same as render without SegmentTimeline compaction, loading the whole mpd with minidom. kept as a reference for MpdRewriter, see benchmarks/mpd_rewrite.py
+        """
         DOMTree = xml.dom.minidom.parse(str(self.m_filename))
         mpd = DOMTree.documentElement
         self.process_mpd(DOMTree, mpd, copyright_notice, source_notice, title_notice)
-        with open(self.m_filename, 'w') as f:
-            prettyOutput = '\n'.join([line for line in DOMTree.toprettyxml(indent=' '*2).split('\n') if line.strip()])
+        return '\n'.join([line for line in DOMTree.toprettyxml(indent=' '*2).split('\n') if line.strip()])
+
+    def process(self, copyright_notice, source_notice, title_notice):
+        # streamed to a file written aside then renamed, an interrupted patch never leaves a truncated mpd
+        tmp = Path(self.m_filename).with_name(Path(self.m_filename).name + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            rewrite_mpd(self.m_filename, f, self.m_structural_brand, self.m_wave_media_profile.value, copyright_notice, source_notice, title_notice, self.m_compact_timeline)
+        os.replace(tmp, self.m_filename)
+
+    def write(self, prettyOutput:str):
+        tmp = Path(self.m_filename).with_name(Path(self.m_filename).name + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
             f.write(prettyOutput)
+        os.replace(tmp, self.m_filename)
 
     def process_mpd(self, DOMTree, mpd, copyright_notice, source_notice, title_notice):
         profiles = mpd.getAttribute('profiles')
@@ -0,0 +1,135 @@
+import os
+import shutil
+import zipfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# text files are deflated, media segments are already entropy coded and stored as is
+DEFLATED_SUFFIXES = ('.mpd', '.m3u8', '.txt', '.json', '.jsonl', '.xml')
+
+
+def compress_type(path:Path) -> int:
+    return zipfile.ZIP_DEFLATED if path.suffix.lower() in DEFLATED_SUFFIXES else zipfile.ZIP_STORED
+
+
+def zip_test_vector(vectors_dir:Path, test_vector_dir:Path, test_id:str, overwrite=False) -> Path:
+    """
+    archive a test vector directory into '{test_id}.zip', stored in the test vector directory itself.
+    paths in the archive are relative to vectors_dir.
+    """
+    vectors_dir = Path(vectors_dir)
+    test_vector_dir = Path(test_vector_dir)
+    batch_zip = test_vector_dir / f'{test_id}.zip'
+    if batch_zip.exists():
+        if not overwrite:
+            return batch_zip
+        batch_zip.unlink()
+    # written aside then renamed, an interrupted export never leaves a truncated archive
+    tmp = batch_zip.with_name(batch_zip.name + '.tmp')
+    try:
+        with zipfile.ZipFile(tmp, 'w') as zf:
+            for root, dirnames, filenames in os.walk(test_vector_dir):
+                dirnames.sort()
+                root = Path(root)
+                zf.write(root, root.relative_to(vectors_dir))
+                for filename in sorted(filenames):
+                    fp = root / filename
+                    if fp in (batch_zip, tmp):
+                        continue
+                    # files are read by blocks, never loaded whole
+                    zf.write(fp, fp.relative_to(vectors_dir), compress_type(fp))
+        os.replace(tmp, batch_zip)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return batch_zip
+
+
+def zip_test_vectors(vectors_dir:Path, test_vectors:list[tuple[Path, str]], max_workers=4, overwrite=False) -> list:
+    """
+    zip_test_vector on each (test_vector_dir, test_id) concurrently.
+    returns, in the same order, the archive path or the exception raised.
+    """
+    def run(test_vector):
+        try:
+            return zip_test_vector(vectors_dir, *test_vector, overwrite=overwrite)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max(1, max_workers)) as executor:
+        return [*executor.map(run, test_vectors)]
+
+
+def extract_representation_ids(xml_file):
+    tree = ET.parse(xml_file)
+    root = tree.getroot()
+    ns = {"mpd": "urn:mpeg:dash:schema:mpd:2011"}
+    representation_elements = root.findall(".//mpd:Representation", ns)
+    ids = [rep.get("id") for rep in representation_elements if rep.get("id") is not None]
+    return ids
+
+
+def switching_set_name(mpd:Path) -> tuple[str, str]:
+    """
+    (fps family, name) of a switching set mpd named '$profile_$fpsFamily_$ssN_stream.mpd', eg. ('15_30_60', 'ss2_chh1')
+    """
+    parts = Path(mpd).name.split('_')
+    return '_'.join(parts[1:4]), f'{parts[4]}_{parts[0]}'
+
+
+def archive_switching_set(mpd:Path, vectors_dir:Path, batch_dir:str, overwrite=False) -> Path:
+    """
+    archive a switching set mpd and the representations it references into VECTORS_DIR/switching_sets/$fpsFamily/$name/$batch_dir/$name.zip,
+    reading representations from vectors_dir directly. paths in the archive are prefixed with $name.
+    """
+    fps, name = switching_set_name(mpd)
+    rep_ids = extract_representation_ids(mpd)
+    assert len(rep_ids) > 1, f'not a valid switching set playlist: {mpd}'
+    vectors_dir = Path(vectors_dir)
+    rep_paths = [Path(rep_id.replace("../", "")) for rep_id in rep_ids]
+    for rep_path in rep_paths:
+        if not (vectors_dir / rep_path).is_dir():
+            raise FileNotFoundError(f'missing representation: {vectors_dir / rep_path}')
+
+    ss_dir = Path("switching_sets") / fps / name / batch_dir
+    ss_out_dir = vectors_dir / ss_dir
+    if ss_out_dir.exists():
+        if overwrite:
+            shutil.rmtree(ss_out_dir)
+        else:
+            raise Exception(f"Directory already exists: {ss_out_dir}")
+    ss_out_dir.mkdir(parents=True)
+
+    ss_zip = ss_out_dir / f'{name}.zip'
+    tmp = ss_zip.with_name(ss_zip.name + '.tmp')
+    try:
+        with zipfile.ZipFile(tmp, 'w') as zf:
+            zf.write(mpd, Path(name) / ss_dir / 'stream.mpd', compress_type(Path(mpd)))
+            for rep_path in rep_paths:
+                for root, dirnames, filenames in os.walk(vectors_dir / rep_path):
+                    dirnames.sort()
+                    root = Path(root)
+                    arcdir = Path(name) / root.relative_to(vectors_dir)
+                    zf.write(root, arcdir)
+                    for filename in sorted(filenames):
+                        zf.write(root / filename, arcdir / filename, compress_type(root / filename))
+        os.replace(tmp, ss_zip)
+    finally:
+        tmp.unlink(missing_ok=True)
+    shutil.copy(mpd, ss_out_dir / 'stream.mpd')
+    return ss_zip
+
+
+def archive_switching_sets(mpds:list[Path], vectors_dir:Path, batch_dir:str, overwrite=False, max_workers=4) -> list:
+    """
+    archive_switching_set on each mpd concurrently.
+    returns, in the same order, the archive path or the exception raised.
+    """
+    def run(mpd):
+        try:
+            return archive_switching_set(mpd, vectors_dir, batch_dir, overwrite)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max(1, max_workers)) as executor:
+        return [*executor.map(run, mpds)]
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import shutil
+from pathlib import Path
+from contextlib import contextmanager
+
+JOURNAL_DIR = Path('.tcgen') / 'journal'
+PARTIAL_SUFFIX = '.partial'
+
+ENCODE = 'encode'
+ENCRYPT = 'encrypt'
+PATCH = 'patch'
+
+
+def partial_dir(d:Path) -> Path:
+    return Path(d).with_name(Path(d).name + PARTIAL_SUFFIX)
+
+
+def is_partial(d:Path) -> bool:
+    return Path(d).name.endswith(PARTIAL_SUFFIX)
+
+
+@contextmanager
+def atomic_dir(d:Path):
+    """
+    yield a '.partial' sibling of directory d to write into. on success, it replaces d.
+    on failure it is left behind for inspection, and discarded by the next attempt.
+    """
+    d = Path(d)
+    tmp = partial_dir(d)
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir(parents=True)
+    yield tmp
+    if d.exists():
+        shutil.rmtree(d)
+    tmp.rename(d)
+
+
+class Journal:
+    """
+    Append-only record of the steps completed for each test vector of a batch, one json object per line.
+    Lines are appended with a single O_APPEND write, so that concurrent jobs can safely share the journal,
+    and a crash never leaves more than a truncated last line.
+    The journal is parsed once, on first use: steps recorded since by other processes are not seen.
+    """
+
+    def __init__(self, path:Path, steps:dict=None):
+        self.path = Path(path)
+        # completed steps by test vector key, None until parsed
+        self.steps = steps
+
+    @classmethod
+    def for_batch(cls, vectors_dir:Path, batch_dir:str) -> 'Journal':
+        return cls(Path(vectors_dir) / JOURNAL_DIR / f'{batch_dir}.jsonl')
+
+    def reset(self):
+        if self.path.exists():
+            self.path.unlink()
+        self.steps = {}
+
+    def append(self, data:bytes):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def record(self, key:str, step:str):
+        self.append((json.dumps({"key": key, "step": step, "time": time.time()}) + '\n').encode())
+        if self.steps is not None:
+            self.steps.setdefault(key, set()).add(step)
+
+    def load(self) -> dict:
+        if self.steps is not None:
+            return self.steps
+        steps = {}
+        data = self.path.read_bytes() if self.path.exists() else b''
+        for line in data.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # interrupted write
+                continue
+            steps.setdefault(entry["key"], set()).add(entry["step"])
+        if data and not data.endswith(b'\n'):
+            # terminate the line truncated by a crash, the next record would be appended to it otherwise
+            self.append(b'\n')
+        self.steps = steps
+        return steps
+
+    def completed(self) -> set[tuple[str, str]]:
+        return {(key, step) for key, steps in self.load().items() for step in steps}
+
+    def is_done(self, key:str, step:str) -> bool:
+        return step in self.load().get(key, ())
+
+    def for_keys(self, *keys:str) -> 'Journal':
+        """
+        the same journal, only holding the completed steps of keys: all a job producing these test vectors checks,
+        and cheap to pass to its worker process.
+        """
+        steps = self.load()
+        return Journal(self.path, {key: set(steps.get(key, ())) for key in keys if key is not None})
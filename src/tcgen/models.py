@@ -4,6 +4,8 @@ import os
 from fractions import Fraction
 import json
 import csv
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # on Apple's "Numbers", csv exports use ";"
@@ -116,6 +118,10 @@ class FPS_FAMILY(str, Enum):
 class Mezzanine:
 
 	root_dir = Path(os.getenv('WAVE_MEZZANINE_DIR', '.'))
+	# tcgen.catalog.MezzanineIndex of root_dir, when one was built
+	index = None
+
+	__slots__ = ('content', 'label', 'resolution', 'fps', 'duration', 'hdr', '_properties', '_md5', '_copyright_notice', '_source_notice')
 
 	def __init__(self, basename:str, label:str, resolution:'VideoResolution', fps:FPS, duration:str, hdr:str):
 		self.content = basename
@@ -139,10 +145,14 @@ class Mezzanine:
 		
 	@property
 	def filename(self) -> str:
-		dur = str(self.duration)
+		return self.format_filename(self.content, self.label, self.resolution, self.fps, self.duration)
+
+	@staticmethod
+	def format_filename(basename:str, label:str, resolution:'VideoResolution', fps:FPS, duration:str) -> str:
+		dur = str(duration)
 		if dur.endswith(".0"):
 			dur = dur[:-2]
-		return f'{self.content}{self.label}_{self.resolution}@{self.fps.to_number()}_{dur}.mp4'
+		return f'{basename}{label}_{resolution}@{fps.to_number()}_{dur}.mp4'
 
 	@property
 	def copyright_notice(self) -> str:
@@ -210,17 +220,20 @@ class Mezzanine:
 			raise FileNotFoundError(f"Annotation file {annotation_filename} not found. Skipping entry.")
 		with open(annotation_filename, 'r') as fo:
 			data = json.load(fo)
-			
-			self._md5 = data["Mezzanine"]["md5"]
+		return self.set_annotations(data["Mezzanine"])
 
-			self._properties = data["Mezzanine"]["properties"]
-			assert self._properties["width"] == self.resolution.w, 'invalid mezzanine width found in metadata'
-			assert self._properties["height"] == self.resolution.h, 'invalid mezzanine height found in metadata'
-			assert str(self._properties["frame_rate"]) == str(self.fps.to_number()), 'invalid mezzanine frame_rate found in metadata'
+	def set_annotations(self, annotations:dict):
+		properties = annotations["properties"]
+		assert properties["width"] == self.resolution.w, 'invalid mezzanine width found in metadata'
+		assert properties["height"] == self.resolution.h, 'invalid mezzanine height found in metadata'
+		assert str(properties["frame_rate"]) == str(self.fps.to_number()), 'invalid mezzanine frame_rate found in metadata'
 
-			self._copyright_notice = data["Mezzanine"]["license"]
-			self._source_notice = "" + data["Mezzanine"]["name"] + " version " + str(data["Mezzanine"]["version"]) + " (" + data["Mezzanine"]["creation_date"] + ")"
-			return self._copyright_notice, self._source_notice
+		# only retained once validated, invalid annotations raise again on the next access
+		self._md5 = annotations["md5"]
+		self._copyright_notice = annotations["license"]
+		self._source_notice = "" + annotations["name"] + " version " + str(annotations["version"]) + " (" + annotations["creation_date"] + ")"
+		self._properties = properties
+		return self._copyright_notice, self._source_notice
 
 	@classmethod
 	def from_filename(cls, fp:Path) -> 'Mezzanine':
@@ -228,8 +241,55 @@ class Mezzanine:
 		duration = chunks[-1]
 		res, fps = chunks[-2].split('@')
 		mezzanine_id = chunks[-3]
-		hdr = chunks[-4]
-		return Mezzanine(fp.name, mezzanine_id, VideoResolution.from_string(res), FPS.from_string(fps), duration, hdr)
+		basename = fp.stem[:-len('_'.join(chunks[-3:]))]
+		hdr = next((h for h in ('sdr_bt2020', 'hlg10', 'hdr10') if f'_{h}_' in f'_{basename}'), None)
+		return MEZZANINES.get(basename, mezzanine_id, VideoResolution.from_string(res), FPS.from_string(fps), duration, hdr)
+
+
+class MezzanineRegistry:
+	"""
+	Hands out a single Mezzanine per file in Mezzanine.root_dir, so that its annotations are loaded and validated once per process.
+	"""
+
+	def __init__(self):
+		self._mezzanines = {}
+		self._lock = threading.Lock()
+
+	def get(self, basename:str, label:str, resolution:VideoResolution, fps:FPS, duration:str, hdr:str=None) -> Mezzanine:
+		key = (Mezzanine.root_dir, Mezzanine.format_filename(basename, label, resolution, fps, duration))
+		with self._lock:
+			m = self._mezzanines.get(key)
+			if m is None:
+				m = self._mezzanines[key] = Mezzanine(basename, label, resolution, fps, duration, hdr)
+			return m
+
+	def preload(self, mezzanines:list[Mezzanine], max_workers:int=8) -> list[Mezzanine]:
+		"""
+		loads the annotations of mezzanines not loaded yet, in a thread pool, or from Mezzanine.index when available.
+		mezzanines with invalid annotations are left to fail when accessed.
+		"""
+		index = Mezzanine.index
+		mezzanines = [m for m in {id(m): m for m in mezzanines}.values() if m._properties is None]
+
+		def load(m:Mezzanine):
+			try:
+				if index is not None:
+					m.set_annotations(index.annotations(m.filename))
+				else:
+					m.load_annotations()
+			except (OSError, ValueError, KeyError, TypeError, AssertionError):
+				pass
+
+		if index is not None:
+			for m in mezzanines:
+				load(m)
+		else:
+			with ThreadPoolExecutor(max_workers) as executor:
+				list(executor.map(load, mezzanines))
+		return mezzanines
+
+
+MEZZANINES = MezzanineRegistry()
 
 
 
@@ -256,14 +316,22 @@ class CmafBrand(str, Enum):
 
 def locate_source_content(tc:'TestContent', fps_family:FPS_FAMILY):
     m = tc.get_mezzanine(fps_family)
+    if Mezzanine.index is not None:
+        filename = Mezzanine.index.resolve(m.filename)
+        if filename is not None:
+            Mezzanine.index.check(filename)
+            if filename != m.filename:
+                duration = Path(filename).stem.split('_')[-1]
+                return MEZZANINES.get(m.content, m.label, m.resolution, m.fps, duration, m.hdr)
+            return m
     if not (Mezzanine.root_dir / m.filename).exists():
         # splice_ test vectors have no duration in the test matrix,
         # try figuring out the duration from source content filename
         if tc.duration == '-1':
             splice_sequence = [*Mezzanine.root_dir.glob(m.filename.replace('-1', '*'))]
             if len(splice_sequence) == 1:
-                m.duration = splice_sequence[0].stem.split('_')[-1]
-                return m
+                duration = splice_sequence[0].stem.split('_')[-1]
+                return MEZZANINES.get(m.content, m.label, m.resolution, m.fps, duration, m.hdr)
         raise Exception(f'test content "{tc.test_id}" - mezzanine file not found "{m.filename}"')
     return m
 
@@ -380,7 +448,7 @@ class TestContent:
 			hdr = 'hdr10'
 		fps = self.get_fps(fps_family)
 		basename = self.mezzanine_prefix_25HZ if fps.to_number() in (50, 25, 12.5) else self.mezzanine_prefix_30HZ
-		return Mezzanine(
+		return MEZZANINES.get(
 				basename=basename,
 				label=self.mezzanine_label, 
 				resolution=self.resolution, 
@@ -0,0 +1,519 @@
+import re
+import xml.parsers.expat
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+# profiles added to the MPD@profiles attribute
+CTA_PROFILES = ("urn:cta:wave:test-content-media-profile:2022", "urn:mpeg:dash:profile:cmaf:2019")
+INDENT = ' ' * 2
+# mpds are parsed by blocks of that size
+READ_BLOCK_SIZE = 64 * 1024
+
+TEXT = 'text'
+CDATA = 'cdata'
+
+
+def escape(data:str) -> str:
+    return data.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def escape_attribute(value:str) -> str:
+    """
+    whitespace other than space is escaped too, attribute value normalization would turn it into spaces otherwise.
+    """
+    return escape(value).replace("\"", "&quot;").replace("\r", "&#13;").replace("\n", "&#10;").replace("\t", "&#9;")
+
+
+def same_document(a:str, b:str) -> bool:
+    """
+    whether two serialized xml documents are the same once canonicalized (C14N 2.0), whitespace included.
+    """
+    return ET.canonicalize(a) == ET.canonicalize(b)
+
+
+def set_attribute(attrs:list, name:str, value:str) -> list:
+    """
+    set an attribute in place, or append it when missing, as minidom's setAttribute does.
+    """
+    for i, (n, _) in enumerate(attrs):
+        if n == name:
+            attrs[i] = (name, value)
+            return attrs
+    attrs.append((name, value))
+    return attrs
+
+
+class LineFilter:
+    """
+    writes through to out, dropping whitespace only lines.
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.line = ''
+        self.first = True
+
+    def write(self, s:str):
+        if '\n' not in s:
+            self.line += s
+            return
+        if s.isspace() and not self.line.strip():
+            # indentation between elements
+            self.line = s[s.rfind('\n') + 1:]
+            return
+        lines = (self.line + s).split('\n')
+        self.line = lines.pop()
+        for line in lines:
+            self.emit(line)
+
+    def emit(self, line:str):
+        if line.strip():
+            self.out.write(line if self.first else '\n' + line)
+            self.first = False
+
+    def close(self):
+        self.emit(self.line)
+        self.line = ''
+
+
+class Element:
+    """
+    an element being rewritten. its start tag is held back until its children are known:
+    an element without children is written as <name/>, and an element with a single text child on a single line.
+    """
+    __slots__ = ('name', 'attrs', 'indent', 'open', 'nodes', 'mergeable')
+
+    def __init__(self, name:str, attrs:list, indent:str):
+        self.name = name
+        self.attrs = attrs
+        self.indent = indent
+        # True once the start tag is written
+        self.open = False
+        # text and cdata children not written yet, as [kind, data]
+        self.nodes = []
+        # False once an element, comment or processing instruction follows the last text child
+        self.mergeable = False
+
+    def start_tag(self) -> str:
+        return self.indent + '<' + self.name + ''.join(f' {n}="{escape_attribute(v)}"' for n, v in self.attrs)
+
+
+def parse(filename, parser):
+    parser.buffer_text = True
+    parser.buffer_size = READ_BLOCK_SIZE
+    parser.ordered_attributes = True
+    parser.specified_attributes = True
+    with open(filename, 'rb') as fo:
+        parser.ParseFile(fo)
+
+
+def first_representation_mime_types(filename) -> list[str]:
+    """
+    the mimeType of the first Representation of each AdaptationSet of the first Period, None for AdaptationSets without Representation.
+    """
+    mime_types = []
+    stack = []
+    skip = 0
+    period = None
+    done = False
+
+    def start(name, attributes):
+        nonlocal skip, period
+        if skip or (stack and name == 'ProgramInformation'):
+            skip += 1
+            return
+        stack.append(name)
+        if name == 'Period' and period is None:
+            period = len(stack)
+        elif period is not None and not done and len(stack) > period:
+            if name == 'AdaptationSet':
+                mime_types.append(None)
+            elif name == 'Representation' and len(mime_types) and mime_types[-1] is None:
+                attrs = dict(zip(attributes[0::2], attributes[1::2]))
+                mime_types[-1] = attrs.get('mimeType', '')
+
+    def end(name):
+        nonlocal skip, done
+        if skip:
+            skip -= 1
+            return
+        if len(stack) == period:
+            done = True
+        stack.pop()
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parse(filename, parser)
+    return mime_types
+
+
+class MpdRewriter:
+    """
+    Applies the CTA content model to an mpd while parsing it, writing the result to out as it goes:
+    the memory used is bounded by the depth of the document rather than its size.
+    The output has the layout of minidom's toprettyxml(indent='  ') once whitespace only lines are dropped, see ContentModel.render_dom,
+    and the same canonical form: characters are escaped as minidom does from Python 3.13, quotes only in attribute values,
+    whatever the interpreter. Document type declarations are not supported.
+    With compact_timeline, consecutive SegmentTimeline S entries of equal duration are merged into a single S with a repeat count.
+    """
+
+    def __init__(self, out, structural_brand:str, media_profile:str, copyright_notice:str, source_notice:str, title_notice:str, compact_timeline=False):
+        self.out = out
+        self.compact_timeline = compact_timeline
+        # S entry being compacted, as [element, t, d, r]
+        self.run = None
+        # start time of the next S entry in the current SegmentTimeline, None when unknown
+        self.next_t = None
+        self.container_profiles = f'{structural_brand} {media_profile}'
+        self.program_information = (('Title', title_notice), ('Source', source_notice), ('Copyright', copyright_notice))
+        self.stack = []
+        self.skip = 0
+        self.in_cdata = False
+        self.periods = 0
+        self.period = None
+        self.adaptation_sets = 0
+        self.mime_types = None
+
+    def rewrite(self, filename):
+        self.filename = filename
+        parser = xml.parsers.expat.ParserCreate()
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.CharacterDataHandler = self.character_data
+        parser.StartCdataSectionHandler = self.start_cdata
+        parser.EndCdataSectionHandler = self.end_cdata
+        parser.CommentHandler = self.comment
+        parser.ProcessingInstructionHandler = self.processing_instruction
+        self.out.write('<?xml version="1.0" ?>\n')
+        parse(filename, parser)
+
+    # writing
+
+    def open(self, e:Element):
+        if not e.open:
+            self.out.write(e.start_tag() + '>\n')
+            e.open = True
+        self.flush(e)
+
+    def flush(self, e:Element):
+        for kind, data in e.nodes:
+            if kind == TEXT:
+                self.out.write(escape(f'{e.indent}{INDENT}{data}\n'))
+            else:
+                self.out.write(self.cdata_section(data))
+        e.nodes = []
+
+    def cdata_section(self, data:str) -> str:
+        if ']]>' in data:
+            raise ValueError("']]>' not allowed in a CDATA section")
+        return f'<![CDATA[{data}]]>'
+
+    def push(self, name:str, attrs:list):
+        if self.stack:
+            parent = self.stack[-1]
+            self.open(parent)
+            parent.mergeable = False
+        self.stack.append(Element(name, attrs, INDENT * len(self.stack)))
+
+    def pop(self):
+        e = self.stack.pop()
+        if e.open:
+            self.flush(e)
+            self.out.write(f'{e.indent}</{e.name}>\n')
+        elif not e.nodes:
+            self.out.write(e.start_tag() + '/>\n')
+        else:
+            kind, data = e.nodes[0]
+            self.out.write(e.start_tag() + '>' + (escape(data) if kind == TEXT else self.cdata_section(data)) + f'</{e.name}>\n')
+        return e
+
+    def append_data(self, kind:str, data:str, merge:bool):
+        if kind == CDATA or not data.isspace():
+            self.write_run()
+        e = self.stack[-1]
+        if merge and e.mergeable and e.nodes and e.nodes[-1][0] == kind:
+            e.nodes[-1][1] += data
+            return
+        if e.open:
+            self.flush(e)
+        elif e.nodes:
+            self.open(e)
+        e.nodes.append([kind, data])
+        e.mergeable = True
+
+    def write_program_information(self):
+        self.push('ProgramInformation', [])
+        for name, notice in self.program_information:
+            self.push(name, [])
+            self.append_data(TEXT, notice, False)
+            self.pop()
+        self.pop()
+
+    # content model
+
+    def patch_mpd(self, attrs:list) -> list:
+        profiles = dict(attrs).get('profiles', '')
+        for profile in CTA_PROFILES:
+            if profile not in profiles:
+                profiles += "," + profile
+        return set_attribute(attrs, 'profiles', profiles)
+
+    def patch_adaptation_set(self, attrs:list) -> list:
+        values = dict(attrs)
+        index = self.adaptation_sets
+        self.adaptation_sets += 1
+        if values.get('contentType', '') == '':
+            if self.mime_types is None:
+                self.mime_types = first_representation_mime_types(self.filename)
+            mime_type = self.mime_types[index] or values.get('mimeType', '')
+            if 'video' in mime_type:
+                set_attribute(attrs, 'contentType', 'video')
+            elif 'audio' in mime_type:
+                set_attribute(attrs, 'contentType', 'audio')
+        return set_attribute(attrs, 'containerProfiles', self.container_profiles)
+
+    # SegmentTimeline compaction
+
+    def is_timeline_entry(self, name:str, parent:Element) -> bool:
+        return self.compact_timeline and name == 'S' and parent is not None and parent.name == 'SegmentTimeline'
+
+    def timeline_entry(self, e:Element) -> tuple:
+        """
+        (t, d, r) of an S entry that can be compacted, None otherwise.
+        """
+        if e.open or e.nodes or not self.is_timeline_entry(e.name, self.stack[-2] if len(self.stack) > 1 else None):
+            return None
+        attrs = dict(e.attrs)
+        if 'd' not in attrs or len(attrs.keys() - {'t', 'd', 'r'}):
+            return None
+        try:
+            t = int(attrs['t']) if 't' in attrs else self.next_t
+            return t, int(attrs['d']), int(attrs.get('r', 0))
+        except ValueError:
+            return None
+
+    def extend_run(self, e:Element, t:int, d:int, r:int):
+        if self.run is not None:
+            _, run_t, run_d, run_r = self.run
+            if d == run_d and r >= 0 and run_r >= 0 and (dict(e.attrs).get('t') is None or t == self.next_t):
+                self.run[3] += r + 1
+                self.next_t = None if self.next_t is None else self.next_t + (r + 1) * d
+                return
+            self.write_run()
+        self.run = [e, t, d, r]
+        self.next_t = None if (t is None or r < 0) else t + (r + 1) * d
+
+    def write_run(self):
+        if self.run is None:
+            return
+        e, _, _, r = self.run
+        if r != 0 or 'r' in dict(e.attrs):
+            set_attribute(e.attrs, 'r', str(r))
+        self.out.write(e.start_tag() + '/>\n')
+        self.run = None
+
+    # expat handlers
+
+    def start_element(self, name, attributes):
+        if self.skip:
+            self.skip += 1
+            return
+        attrs = [*zip(attributes[0::2], attributes[1::2])]
+        if any(n.startswith('xmlns') for n in attributes[0::2]):
+            # minidom lists namespace declarations first
+            declarations = [a for a in attrs if a[0] == 'xmlns' or a[0].startswith('xmlns:')]
+            attrs = declarations + [a for a in attrs if a not in declarations]
+        if not self.stack:
+            attrs = self.patch_mpd(attrs)
+        elif name == 'ProgramInformation':
+            self.stack[-1].mergeable = False
+            self.skip = 1
+            return
+        elif name == 'Period':
+            self.periods += 1
+            if self.periods == 1:
+                if len(self.stack) != 1:
+                    raise ValueError('the first Period is not a child of the MPD element')
+                self.write_program_information()
+                self.period = len(self.stack) + 1
+        elif name == 'AdaptationSet' and self.period is not None and len(self.stack) >= self.period:
+            attrs = self.patch_adaptation_set(attrs)
+        elif name == 'SegmentTimeline':
+            self.next_t = 0
+        if not self.is_timeline_entry(name, self.stack[-1] if self.stack else None):
+            self.write_run()
+        self.push(name, attrs)
+
+    def end_element(self, name):
+        if self.skip:
+            self.skip -= 1
+            return
+        if len(self.stack) == 1 and self.periods == 0:
+            # no Period, ProgramInformation is appended
+            self.write_program_information()
+        if len(self.stack) == self.period:
+            self.period = None
+        entry = self.timeline_entry(self.stack[-1])
+        if entry is not None:
+            self.extend_run(self.stack.pop(), *entry)
+            return
+        self.write_run()
+        if name == 'S':
+            self.next_t = None
+        self.pop()
+
+    def character_data(self, data):
+        if self.skip or not self.stack:
+            return
+        if self.in_cdata:
+            self.append_data(CDATA, data, self.cdata_continue)
+            self.cdata_continue = True
+        else:
+            self.append_data(TEXT, data, True)
+
+    def start_cdata(self):
+        self.in_cdata = True
+        self.cdata_continue = False
+
+    def end_cdata(self):
+        self.in_cdata = False
+
+    def comment(self, data):
+        if self.skip:
+            return
+        if '--' in data:
+            raise ValueError("'--' is not allowed in a comment node")
+        self.write_child(f'<!--{data}-->\n')
+
+    def processing_instruction(self, target, data):
+        if self.skip:
+            return
+        self.write_child(f'<?{target} {data}?>\n')
+
+    def write_child(self, s:str):
+        self.write_run()
+        if self.stack:
+            parent = self.stack[-1]
+            self.open(parent)
+            parent.mergeable = False
+            s = parent.indent + INDENT + s
+        self.out.write(s)
+
+
+def rewrite_mpd(filename, out, structural_brand:str, media_profile:str, copyright_notice:str, source_notice:str, title_notice:str, compact_timeline=False):
+    """
+    write the patched mpd to out, see MpdRewriter.
+    """
+    lines = LineFilter(out)
+    MpdRewriter(lines, structural_brand, media_profile, copyright_notice, source_notice, title_notice, compact_timeline).rewrite(filename)
+    lines.close()
+
+
+def iter_boxes(data:bytes):
+    """
+    (type, payload) of the isobmff boxes in data.
+    """
+    pos = 0
+    while pos + 8 <= len(data):
+        size = int.from_bytes(data[pos:pos + 4], 'big')
+        box_type = data[pos + 4:pos + 8]
+        header = 8
+        if size == 1:
+            size = int.from_bytes(data[pos + 8:pos + 16], 'big')
+            header = 16
+        elif size == 0:
+            size = len(data) - pos
+        if size < header:
+            raise ValueError(f'invalid {box_type} box size: {size}')
+        yield box_type, data[pos + header:pos + size]
+        pos += size
+
+
+def find_box(data:bytes, *path:bytes) -> bytes:
+    for box_type, payload in iter_boxes(data):
+        if box_type == path[0]:
+            return payload if len(path) == 1 else find_box(payload, *path[1:])
+    return None
+
+
+def base_media_decode_time(segment:Path) -> int:
+    """
+    tfdt of the first track fragment of a media segment.
+    """
+    with open(segment, 'rb') as fo:
+        # only the moof is read
+        while header := fo.read(8):
+            size = int.from_bytes(header[:4], 'big')
+            if size == 1:
+                header += fo.read(8)
+                size = int.from_bytes(header[8:16], 'big')
+            if header[4:8] == b'moof':
+                tfdt = find_box(fo.read(size - len(header)), b'traf', b'tfdt')
+                if tfdt is None:
+                    break
+                return int.from_bytes(tfdt[4:12] if tfdt[0] == 1 else tfdt[4:8], 'big')
+            if size == 0:
+                break
+            fo.seek(size - len(header), 1)
+    raise ValueError(f'no tfdt found in {segment}')
+
+
+def local_name(tag:str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def segment_name(media:str, representation_id:str, bandwidth:str, number:int, time:int) -> str:
+    values = {'RepresentationID': representation_id, 'Bandwidth': bandwidth, 'Number': number, 'Time': time}
+
+    def substitute(match) -> str:
+        if match.group(0) == '$$':
+            return '$'
+        value = values[match.group(1)]
+        return (match.group(2) % int(value)) if match.group(2) else str(value)
+
+    return re.sub(r'\$\$|\$(RepresentationID|Bandwidth|Number|Time)(%0\d+d)?\$', substitute, media)
+
+
+def verify_segment_timeline(mpd_file:Path, mpd:str=None) -> list[str]:
+    """
+    check the start time of each segment listed in the SegmentTimelines of an mpd against the tfdt of the segment file.
+    mpd is the content of the mpd when it isn't written yet. returns the mismatches found.
+    """
+    root = ET.fromstring(mpd) if mpd is not None else ET.parse(mpd_file).getroot()
+    errors = []
+
+    def children(element, name:str) -> list:
+        return [c for c in element if local_name(c.tag) == name]
+
+    for period in children(root, 'Period'):
+        for adaptation_set in children(period, 'AdaptationSet'):
+            for representation in children(adaptation_set, 'Representation'):
+                templates = children(adaptation_set, 'SegmentTemplate') + children(representation, 'SegmentTemplate')
+                timelines = [tl for t in templates for tl in children(t, 'SegmentTimeline')]
+                if not len(timelines):
+                    continue
+                attrs = {k: v for t in templates for k, v in t.attrib.items()}
+                media = attrs.get('media', '')
+                if '$SubNumber$' in media:
+                    continue
+                t = 0
+                number = int(attrs.get('startNumber', 1))
+                for s in children(timelines[-1], 'S'):
+                    t = int(s.get('t', t))
+                    d = int(s.get('d'))
+                    r = int(s.get('r', 0))
+                    if r < 0:
+                        errors.append(f'{representation.get("id")}: S@r={r} not supported')
+                        break
+                    for _ in range(r + 1):
+                        segment = Path(mpd_file).parent / segment_name(media, representation.get('id'), representation.get('bandwidth'), number, t)
+                        try:
+                            tfdt = base_media_decode_time(segment)
+                            if tfdt != t:
+                                errors.append(f'{segment}: tfdt {tfdt}, SegmentTimeline {t}')
+                        except (OSError, ValueError) as e:
+                            errors.append(f'{segment}: {e}')
+                        t += d
+                        number += 1
+    return errors
@@ -0,0 +1,81 @@
+import json
+import time
+from pathlib import Path
+from fractions import Fraction
+
+PROGRESS_FILE = 'progress.jsonl'
+# seconds between two progress samples of a running gpac session
+PROGRESS_INTERVAL = 5
+# a job reporting no progress for that long is flagged as stalled
+STALL_TIMEOUT = 300
+
+
+class ProgressMonitor:
+    """
+    Samples the output of a running gpac session, and appends progress events to PROGRESS_FILE in the output directory.
+    Progress is measured on the output rather than parsed from gpac's console, which varies across gpac versions:
+    the number of DASH segments written gives the media duration encoded.
+    Intermediate elementary streams and raw frames have no segments, their progress is estimated from their bitrate.
+    """
+
+    def __init__(self, output_dir:Path, duration:float, fps:Fraction, segment_duration:Fraction, bitrate:int):
+        self.output_dir = Path(output_dir)
+        self.duration = float(duration)
+        self.fps = float(fps)
+        self.segment_duration = float(segment_duration)
+        self.bitrate = int(bitrate)
+        self.start = time.time()
+        self.last_change = self.start
+        self.last_bytes = 0
+
+    def media_time(self, segments:int, size:int) -> float:
+        if segments:
+            return min(self.duration, segments * self.segment_duration)
+        return min(self.duration, size * 8 / (self.bitrate * 1000))
+
+    def sample(self) -> dict:
+        segments = 0
+        size = 0
+        for p in self.output_dir.rglob('*'):
+            if p.suffix in ('.m4s', '.mp4', '.yuv') and p.is_file():
+                size += p.stat().st_size
+                segments += p.suffix == '.m4s'
+        now = time.time()
+        if size != self.last_bytes:
+            self.last_bytes = size
+            self.last_change = now
+        elapsed = now - self.start
+        media_time = self.media_time(segments, size)
+        frames = round(media_time * self.fps)
+        event = {
+            "time": now,
+            "elapsed": round(elapsed, 1),
+            "frames": frames,
+            "fps": round(frames / elapsed, 2) if elapsed > 0 else 0,
+            "speed": round(media_time / elapsed, 3) if elapsed > 0 else 0,
+            "bitrate": round(size * 8 / media_time / 1000) if media_time > 0 else 0,
+            "percent": round(100 * media_time / self.duration, 1) if self.duration > 0 else 0,
+            "bytes": size,
+            "stalled": now - self.last_change > STALL_TIMEOUT
+        }
+        with open(self.output_dir / PROGRESS_FILE, 'a') as fo:
+            fo.write(json.dumps(event) + '\n')
+        return event
+
+
+def last_progress_event(progress_file:Path) -> dict:
+    try:
+        with open(progress_file, 'rb') as fo:
+            lines = fo.read().splitlines()
+        return json.loads(lines[-1]) if len(lines) else None
+    except (OSError, ValueError):
+        return None
+
+
+def format_progress_event(key:str, event:dict) -> str:
+    if event is None:
+        return f'{key}: starting'
+    line = f'{key}: {event["percent"]:5.1f}% - {event["frames"]} frames - {event["fps"]:.1f} fps - x{event["speed"]:.2f} - {event["bitrate"]} kbps'
+    if event["stalled"]:
+        line += ' - STALLED'
+    return line
@@ -1,12 +1,15 @@
 import sys
+import logging
 import subprocess
 import getopt
+import functools
 from enum import Enum
 from fractions import Fraction
 from pathlib import Path
 
 ########################################################################################
-# TODO: legacy. script should NOT be called as a subprocess, but exported as functions.
+# Representation, DASH and format_gpac_command are used in-process by tcgen.
+# The command line interface below is kept for standalone usage.
 ########################################################################################
 
 # Supported codecs
@@ -109,50 +112,43 @@ class HEVCCHD1:
 # DASHing
 class DASH:
     
-    def __init__(self, dash_config=None):
-
-        self.m_segment_duration = "2"
-        self.m_segment_signaling = "timeline"
-        self.m_fragment_type = "duration"
-        self.m_fragment_duration = "2"
+    def __init__(self, segment_duration="2", segment_signaling="timeline", fragment_type="duration", fragment_duration="2",
+                 frame_rate=None, cmaf_brand="cmf2"):
+
+        if segment_signaling not in ("template", "timeline"):
+            raise ValueError("Segment Signaling can either be Segment Template denoted by \"template\" or "
+                             "SegmentTemplate with Segment Timeline denoted by \"timeline\".")
+        if fragment_type not in ("none", "duration", "pframes", "every_frame"):
+            raise ValueError("Fragment Type can be \"none\", \"duration\", \"pframes\" or \"every_frame\".")
+
+        self.m_segment_duration = str(segment_duration)
+        self.m_segment_signaling = segment_signaling
+        self.m_fragment_type = fragment_type
+        self.m_fragment_duration = str(fragment_duration)
         self.m_num_b_frames = 2 # necessary for p-to-p fragmentation, see https://github.com/cta-wave/Test-Content-Generation/issues/54
-        self.m_frame_rate = None
-        self.m_cmaf_brand = "cmf2"
-        
+        if fragment_type == "every_frame":
+            self.m_num_b_frames = 0 # only P-frames
+        self.m_frame_rate = frame_rate
+        self.m_cmaf_brand = cmaf_brand
+
+    @classmethod
+    def from_config(cls, dash_config=None) -> 'DASH':
+        """
+        parse the run_encode.py --dash option, eg. "sd:2,fd:2,ft:duration,fr:25/1,cmaf:cmf2"
+        """
+        names = {"sd": "segment_duration", "ss": "segment_signaling", "ft": "fragment_type",
+                 "fd": "fragment_duration", "fr": "frame_rate", "cmaf": "cmaf_brand"}
+        kwargs = {}
         if dash_config is not None:
-            config = dash_config.split(',')
-            for i in range(0, len(config)):
-                config_opt = config[i].split(":")
-                name = config_opt[0]
-                value = config_opt[1]
-
-                if name == "sd":
-                    self.m_segment_duration = value
-                elif name == "ss":
-                    if value != "template" and value != "timeline":
-                        print("Segment Signaling can either be Segment Template denoted by \"template\" or "
-                              "SegmentTemplate with Segment Timeline denoted by \"timeline\".")
-                        exit(1)
-                    else:
-                        self.m_segment_signaling = value
-                elif name == "ft":
-                    if value != "none" and value != "duration" and value != "pframes" and value != "every_frame":
-                        print("Fragment Type can be \"none\", \"duration\", \"pframes\" or \"every_frame\".")
-                        exit(1)
-                    else:
-                        self.m_fragment_type = value
-                        if value == "every_frame":
-                            self.m_num_b_frames = 0 # only P-frames
-
-                elif name == "fd":
-                    self.m_fragment_duration = value
-                elif name == "fr":
-                    self.m_frame_rate = value
-                elif name == "cmaf":
-                    self.m_cmaf_brand = value
+            for config_opt in dash_config.split(','):
+                name, value = config_opt.split(":")[:2]
+                if name in names:
+                    kwargs[names[name]] = value
+        return cls(**kwargs)
     
 
-    def dash_package_command(self, index_v, index_a, output_file):
+    # source_ids overrides the streams packaged, eg. the output of a cecrypt filter
+    def dash_package_command(self, index_v, index_a, output_file, source_ids=None):
         dash_command = f"-o {output_file}"
         dash_command += ":!deps:profile=live" + \
                         ":ctmode=negctts" + \
@@ -177,6 +173,8 @@ class DASH:
             dash_command += ":cdur=" + str(frag_dur)
 
         dash_command += ":SID="
+        if source_ids is not None:
+            return dash_command + source_ids
         if index_a > 0:
             dash_command += "A" + str(index_a - 1) + ","
         for i in range(index_v):
@@ -213,208 +211,139 @@ class DASH:
 # cmaf profile. When optional parameters are present these will override the default values for the specified CMAF profile
 ####################################################################################
 
+CMAF_PROFILE_DEFAULTS = {
+    "avcsd": AVCSD,
+    "avchd": AVCHD,
+    "avchdhf": AVCHDHF,
+    "chh1": HEVCCHHD,
+    "chd1": HEVCCHD1,
+    "cud1": HEVCCUD1,
+    "clg1": HEVCCLG1
+}
+
 class Representation:
     
-    def __init__(self, representation_config):
-
-        self.m_profile = None
-        self.m_level = None
-        self.m_frame_rate = None
-        self.m_color_primary = None
+    def __init__(self, id:str, input:str, media_type:str, codec:str, bitrate, cmaf_profile:str,
+                 video_sample_entry:str=None, resolution:str=None, frame_rate=None, aspect_ratio:str=None,
+                 profile:str=None, level:str=None, color_primary:str=None, num_b_frames:int=2, hlg_signaling:str=None,
+                 pic_timing:bool=False, vui_timing:bool=True, segment_duration=None,
+                 hdr_mastering_display:str=None, max_cll_fall:str=None, time_range:tuple=None, raw_input:bool=False):
+
+        if None in (id, input, media_type, codec, bitrate, cmaf_profile):
+            raise ValueError("For each representation at least the following 6 parameters must be provided: " +
+                "<representation_id>{0},<input_file>{1},<media_type>{2},<codec>{3},<bitrate>{4},<cmaf_profile>{5}"\
+                    .format(id, input, media_type, codec, bitrate, cmaf_profile))
+
+        if codec not in (VideoCodecOptions.AVC.value, VideoCodecOptions.HEVC.value, AudioCodecOptions.AAC.value, AudioCodecOptions.COPY.value):
+            raise ValueError("Supported codecs are AVC denoted by \"h264\" and HEVC denoted by \"h265\" for video, and "
+                             "AAC denoted by \"aac\" or the special value \"copy\" disables the audio transcoding.")
+
+        if video_sample_entry is not None and video_sample_entry not in [vse.value for vse in VisualSampleEntry]:
+            raise ValueError("Supported video sample entries for AVC are \"avc1\", \"avc3\", \"avc1+3\" and"
+                             " for HEVC \"hev1\" and \"hvc1\".")
+
+        self.m_id = id
+        self.m_input = str(input)
+        self.m_media_type = media_type
+        self.m_codec = codec
+        self.m_bitrate = str(bitrate)
+        self.m_cmaf_profile = cmaf_profile
+        self.m_video_sample_entry = video_sample_entry
+        self.m_profile = profile
+        self.m_level = level
+        self.m_frame_rate = frame_rate
+        self.m_color_primary = color_primary
         self.m_color_trc = None
         self.m_prefered_color_trc = None
         self.m_colorspace = None
         self.m_resolution_w = None
         self.m_resolution_h = None
-        self.m_hdr_mastering_display = None
-        self.m_max_cll_fall = None
+        if resolution is not None:
+            self.m_resolution_w, self.m_resolution_h = str(resolution).split('x')
         self.m_aspect_ratio_x = None
         self.m_aspect_ratio_y = None
-        
-        config = representation_config.split(",")
-        for i in range(0, len(config)):
-            config_opt = config[i].split(":")
-            name = config_opt[0]
-            value = config_opt[1]
-
-            if name == "id":
-                self.m_id = value
-            elif name == "input":
-                self.m_input = value
-            elif name == "type":
-                self.m_media_type = value
-            elif name == "codec":
-                if value != VideoCodecOptions.AVC.value and value != VideoCodecOptions.HEVC.value \
-                   and value != AudioCodecOptions.AAC.value and value != AudioCodecOptions.COPY.value:
-                    print("Supported codecs are AVC denoted by \"h264\" and HEVC denoted by \"h265\" for video, and "
-                          "AAC denoted by \"aac\" or the special value \"copy\" disables the audio transcoding.")
-                    sys.exit(1)
-                self.m_codec = value
-            elif name == "vse":
-                if value != VisualSampleEntry.AVC1.value and value != VisualSampleEntry.AVC3.value and \
-                   value != VisualSampleEntry.AVC1p3.value and \
-                   value != VisualSampleEntry.HEV1.value and value != VisualSampleEntry.HVC1.value:
-                    print("Supported video sample entries for AVC are \"avc1\", \"avc3\", \"avc1+3\" and"
-                          " for HEVC \"hev1\" and \"hvc1\".")
-                    sys.exit(1)
-                else:
-                    self.m_video_sample_entry = value
-            elif name == "cmaf":
-                self.m_cmaf_profile = value
-                if value == "avcsd":
-                    if self.m_profile is None:
-                        self.m_profile = AVCSD.m_profile
-                    if self.m_level is None:
-                        self.m_level = AVCSD.m_level
-                    if self.m_frame_rate is None:
-                        self.m_frame_rate = AVCSD.m_frame_rate
-                    if self.m_color_primary is None:
-                        self.m_color_primary = AVCSD.m_color_primary
-                    if self.m_resolution_w is None and self.m_resolution_h is None:
-                        self.m_resolution_w = AVCSD.m_resolution_w
-                        self.m_resolution_h = AVCSD.m_resolution_h
-                elif value == "avchd":
-                    if self.m_profile is None:
-                        self.m_profile = AVCHD.m_profile
-                    if self.m_level is None:
-                        self.m_level = AVCHD.m_level
-                    if self.m_frame_rate is None:
-                        self.m_frame_rate = AVCHD.m_frame_rate
-                    if self.m_color_primary is None:
-                        self.m_color_primary = AVCHD.m_color_primary
-                    if self.m_resolution_w is None and self.m_resolution_h is None:
-                        self.m_resolution_w = AVCHD.m_resolution_w
-                        self.m_resolution_h = AVCHD.m_resolution_h
-                elif value == "avchdhf":
-                    if self.m_profile is None:
-                        self.m_profile = AVCHDHF.m_profile
-                    if self.m_level is None:
-                        self.m_level = AVCHDHF.m_level
-                    if self.m_frame_rate is None:
-                        self.m_frame_rate = AVCHDHF.m_frame_rate
-                    if self.m_color_primary is None:
-                        self.m_color_primary = AVCHDHF.m_color_primary
-                    if self.m_resolution_w is None and self.m_resolution_h is None:
-                        self.m_resolution_w = AVCHDHF.m_resolution_w
-                        self.m_resolution_h = AVCHDHF.m_resolution_h
-                elif value == "chh1":
-                    if self.m_profile is None:
-                        self.m_profile = HEVCCHHD.m_profile
-                    if self.m_level is None:
-                        self.m_level = HEVCCHHD.m_level
-                    if self.m_frame_rate is None:
-                        self.m_frame_rate = HEVCCHHD.m_frame_rate
-                    if self.m_color_primary is None:
-                        self.m_color_primary = HEVCCHHD.m_color_primary
-                    if self.m_resolution_w is None and self.m_resolution_h is None:
-                        self.m_resolution_w = HEVCCHHD.m_resolution_w
-                        self.m_resolution_h = HEVCCHHD.m_resolution_h
-                elif value == "chd1":
-                    if self.m_profile is None:
-                        self.m_profile = HEVCCHD1.m_profile
-                    if self.m_level is None:
-                        self.m_level = HEVCCHD1.m_level
-                    if self.m_frame_rate is None:
-                        self.m_frame_rate = HEVCCHD1.m_frame_rate
-                    if self.m_color_primary is None:
-                        self.m_color_primary = HEVCCHD1.m_color_primary
-                    if self.m_color_trc is None:
-                        self.m_color_trc = HEVCCHD1.m_color_trc
-                    if self.m_colorspace is None:
-                        self.m_colorspace = HEVCCHD1.m_colorspace
-                    if self.m_resolution_w is None and self.m_resolution_h is None:
-                        self.m_resolution_w = HEVCCHD1.m_resolution_w
-                        self.m_resolution_h = HEVCCHD1.m_resolution_h
-                elif value == "cud1":
-                    if self.m_profile is None:
-                        self.m_profile = HEVCCUD1.m_profile
-                    if self.m_level is None:
-                        self.m_level = HEVCCUD1.m_level
-                    if self.m_frame_rate is None:
-                        self.m_frame_rate = HEVCCUD1.m_frame_rate
-                    if self.m_color_primary is None:
-                        self.m_color_primary = HEVCCUD1.m_color_primary
-                    if self.m_color_trc is None:
-                        self.m_color_trc = HEVCCUD1.m_color_trc
-                    if self.m_colorspace is None:
-                        self.m_colorspace = HEVCCUD1.m_colorspace
-                    if self.m_resolution_w is None and self.m_resolution_h is None:
-                        self.m_resolution_w = HEVCCUD1.m_resolution_w
-                        self.m_resolution_h = HEVCCUD1.m_resolution_h
-                elif value == "clg1":
-                    if self.m_profile is None:
-                        self.m_profile = HEVCCLG1.m_profile
-                    if self.m_level is None:
-                        self.m_level = HEVCCLG1.m_level
-                    if self.m_frame_rate is None:
-                        self.m_frame_rate = HEVCCLG1.m_frame_rate
-                    if self.m_color_primary is None:
-                        self.m_color_primary = HEVCCLG1.m_color_primary
-                    if self.m_color_trc is None:
-                        self.m_color_trc = HEVCCLG1.m_color_trc
-                        self.m_prefered_color_trc = HEVCCLG1.m_prefered_color_trc
-                    if self.m_colorspace is None:
-                        self.m_colorspace = HEVCCLG1.m_colorspace
-                    if self.m_resolution_w is None and self.m_resolution_h is None:
-                        self.m_resolution_w = HEVCCLG1.m_resolution_w
-                        self.m_resolution_h = HEVCCLG1.m_resolution_h
-                else:
-                    print("Unknown CMAF profile: " + name)
-
-            elif name == "bitrate":
-                self.m_bitrate = value
-            elif name == "res":
-                resolution_w_h = value.split('x')
-                self.m_resolution_w = resolution_w_h[0]
-                self.m_resolution_h = resolution_w_h[1]
-            elif name == "fps":
-                self.m_frame_rate = value
-            elif name == "sar":
-                sar_x_y = value.split('/')
-                self.m_aspect_ratio_x = sar_x_y[0]
-                self.m_aspect_ratio_y = sar_x_y[1]
-            elif name == "profile":
-                self.m_profile = value
-            elif name == "level":
-                self.m_level = value
+        if aspect_ratio is not None:
+            self.m_aspect_ratio_x, self.m_aspect_ratio_y = str(aspect_ratio).split('/')
+        self.m_num_b_frames = num_b_frames
+        self.m_pic_timing = str(bool(pic_timing))
+        self.m_vui_timing = str(bool(vui_timing))
+        self.m_segment_duration = None if segment_duration is None else str(segment_duration)
+        self.m_hdr_mastering_display = hdr_mastering_display
+        self.m_max_cll_fall = max_cll_fall
+        # (start, end) in seconds, end being None for the end of the input
+        self.m_time_range = time_range
+        # input is raw video, already scaled to the representation resolution in raw_pixel_format
+        self.m_raw_input = raw_input
+
+        # CMAF profile defaults, for options not explicitly set
+        defaults = CMAF_PROFILE_DEFAULTS.get(cmaf_profile)
+        if defaults is None:
+            logging.info("Unknown CMAF profile: " + cmaf_profile)
+        else:
+            for attr in ("m_profile", "m_level", "m_frame_rate", "m_color_primary", "m_color_trc", "m_prefered_color_trc", "m_colorspace"):
+                if getattr(self, attr) is None:
+                    setattr(self, attr, getattr(defaults, attr, None))
+            if self.m_resolution_w is None and self.m_resolution_h is None:
+                self.m_resolution_w = defaults.m_resolution_w
+                self.m_resolution_h = defaults.m_resolution_h
+
+        # HLG signaled in VUI instead of SEI
+        if hlg_signaling == "vui":
+            self.m_color_trc = HEVCCLG1.m_prefered_color_trc
+            self.m_prefered_color_trc = None
+
+        if self.m_frame_rate is not None and Fraction(self.m_frame_rate) < 14:
+            logging.info("Low framerate detected: disabling B-Frames.")
+            self.m_num_b_frames = 0
+
+    @classmethod
+    def from_config(cls, representation_config) -> 'Representation':
+        """
+        parse a run_encode.py --reps option, see the syntax above.
+        """
+        names = {"id": "id", "input": "input", "type": "media_type", "codec": "codec", "vse": "video_sample_entry",
+                 "cmaf": "cmaf_profile", "bitrate": "bitrate", "res": "resolution", "fps": "frame_rate", "sar": "aspect_ratio",
+                 "profile": "profile", "level": "level", "color": "color_primary", "hlg": "hlg_signaling", "sd": "segment_duration"}
+        kwargs = dict.fromkeys(("id", "input", "media_type", "codec", "bitrate", "cmaf_profile"))
+        for config_opt in representation_config.split(","):
+            name, value = config_opt.split(":")[:2]
+            if name in names:
+                kwargs[names[name]] = value
             elif name == "bf":
-                if value == "every_frame":
-                    self.m_num_b_frames = 0
-                else:
-                    self.m_num_b_frames = 2
-            elif name == "color":
-                self.m_color_primary = value
-            elif name == "hlg" and value == "vui":
-                self.m_color_trc = HEVCCLG1.m_prefered_color_trc
-                self.m_prefered_color_trc = None
+                kwargs["num_b_frames"] = 0 if value == "every_frame" else 2
             elif name == "pic_timing":
-                self.m_pic_timing = value
+                kwargs["pic_timing"] = value == "True"
             elif name == "vui_timing":
-                self.m_vui_timing = value
-            elif name == "sd":
-                self.m_segment_duration = value
-            elif name == "hdr_mastering_display":
-                self.m_hdr_mastering_display = value.replace('~',',')
-            elif name == "max_cll_fall":
-                self.m_max_cll_fall = value.replace('~',',')
+                kwargs["vui_timing"] = value != "False"
+            elif name in ("hdr_mastering_display", "max_cll_fall"):
+                kwargs[name] = value.replace('~',',')
             else:
                 print("Unknown configuration option for representation: " + name + " , it will be ignored.")
-
-        # Sanity checks
-        if self.m_id is None or self.m_input is None or self.m_media_type is None or self.m_codec is None or \
-            self.m_bitrate is None and self.m_cmaf_profile:
-            print("For each representation at least the following 6 parameters must be provided: " +
-                "<representation_id>{0},<input_file>{1},<media_type>{2},<codec>{3},<bitrate>{4},<cmaf_profile>{5}"\
-                    .format(self.m_id, self.m_input, self.m_media_type, self.m_codec, self.m_bitrate, self.m_cmaf_profile))
-            sys.exit(1)
-
-        if Fraction(self.m_frame_rate) < 14:
-            print("Low framerate detected: disabling B-Frames.")
-            self.m_num_b_frames = 0
-
-    def format_command(self, i):
-        index = str(i)
+        return cls(**kwargs)
+
+    def format_bitstream_rewrite(self):
+        bsrw = None
+        rmseis = []
+        if self.m_vui_timing == "False":
+            bsrw = "novuitiming"
+            rmseis.append("0")
+
+        # HLG signaled in VUI instead of SEI
+        if self.m_color_trc == HEVCCLG1.m_prefered_color_trc:
+            rmseis.append("147")
+
+        options = ""
+        if bsrw is not None:
+            options += ":novuitiming"
+        if len(rmseis):
+            options += ":rmsei:seis=" + ",".join(rmseis)
+        return options
+
+    def format_input(self):
         input_file_command = "-i \"" + self.m_input + "\""
+        if self.m_raw_input:
+            input_file_command += ":size=" + self.m_resolution_w + "x" + self.m_resolution_h + \
+                                  ":spfmt=" + self.raw_pixel_format() + ":fps=" + str(self.m_frame_rate)
         input_file_command += ":#StartNumber=-2000000" + ":#Representation=1"
 
         if self.m_cmaf_profile == "avchd":
@@ -424,102 +353,151 @@ class Representation:
         else:
             input_file_command +=  ":#IsoBrand=" + self.m_cmaf_profile
         # other media need to have the brand embedded in the source
+        return input_file_command
+
+    # pixel format the scaler outputs, None keeps the pixel format of the input
+    def scaled_pixel_format(self):
+        if self.m_cmaf_profile in ("chh1", "chd1", "cud1", "clg1"):
+            return "yuv420_10"
+        return None
+
+    # pixel format of raw frames scaled for this representation
+    def raw_pixel_format(self):
+        return self.scaled_pixel_format() or "yuv420"
+
+    def format_scaler(self, pixel_format=None):
+        command = "ffsws:osize=" + self.m_resolution_w + "x" + self.m_resolution_h
+        pixel_format = pixel_format or self.scaled_pixel_format()
+        if pixel_format is not None:
+            command += ":ofmt=" + pixel_format
+        return command
+
+    # video encoder, along with its encoder specific parameters
+    def format_encoder(self, source_id=None):
+        is_avc = self.m_codec == VideoCodecOptions.AVC.value
+        is_hevc = self.m_codec == VideoCodecOptions.HEVC.value
+        command = "enc:gfloc"
+        if source_id is not None:
+            command += ":SID=" + source_id
+        if is_avc:
+            command += ":c=libx264"
+        elif is_hevc:
+            command += ":c=libx265"
+        command += ":b=" + self.m_bitrate + "k"
+        command += ":bf=" + str(self.m_num_b_frames)
+        command += ":fintra=" + self.m_segment_duration            
+        gop = Fraction(self.m_segment_duration) * Fraction(self.m_frame_rate)
+        command += ":g=" + str(gop)
+        command += ":profile=" + self.m_profile
+        command += ":color_primaries=" + self.m_color_primary
+        command += ":color_trc=" + ( self.m_color_trc or self.m_color_primary )
+        command += ":colorspace=" + ( self.m_colorspace or self.m_color_primary )
+
+        if is_avc:
+            command += "::x264-params=\""
+            # by default, x264 disables open-gop
+            command += "no-scenecut=1"
+            if self.m_num_b_frames > 0:
+                command += ":b-adapt=0"
+            command += ":level=" + self.m_level
+
+        elif is_hevc:
+            command += "::x265-params=\""
+            command += "scenecut=0"
+            command += ":no-open-gop=1"
+            # disabling adaptative B 'frames' placement ensures we have them where expected, 
+            # otherwise they may be absent from the generated test content
+            # same options for x264 & x265                       
+            if self.m_num_b_frames > 0:
+                command += ":b-adapt=0"
+            command += ":level-idc=" + self.m_level
+            # for now, all content described in test matrix uses Main tier
+            command += ":no-high-tier=1" 
+
+            if self.m_prefered_color_trc is not None:
+                command += f":atc-sei={self.m_prefered_color_trc}"
+
+            hdr_metadata = bool(self.m_hdr_mastering_display) or bool(self.m_max_cll_fall)
+            if hdr_metadata:
+                command += ":repeat-headers=1"
+            if bool(self.m_hdr_mastering_display):
+                command += f":master-display={self.m_hdr_mastering_display}"
+            if bool(self.m_max_cll_fall):
+                command += f":max-cll={self.m_max_cll_fall}"
+
+        if self.m_pic_timing == "True":
+            if is_avc:
+                command += ":nal-hrd=vbr"
+            elif is_hevc:
+                command += ":hrd=1"
 
-        input_file_command +=  ":FID=" + "GEN" + self.m_id
-
-        command = ""
-        if self.m_media_type in ("v", "video"):
-            is_avc = self.m_codec == VideoCodecOptions.AVC.value
-            is_hevc = self.m_codec == VideoCodecOptions.HEVC.value
+        # common x264 / x265 options
+        command += ":vbv-bufsize=" + str(int(self.m_bitrate) * 3) + \
+               ":vbv-maxrate=" + str(int(int(self.m_bitrate) * 3 / 2))
 
-            # Resize
-            command += "ffsws:osize=" + self.m_resolution_w + "x" + self.m_resolution_h
+        if self.m_aspect_ratio_x and self.m_aspect_ratio_y:
+            command += ":sar=" + self.m_aspect_ratio_x + "\\:" + self.m_aspect_ratio_y
+        
+        command += "\":" # closing encoder specific parameters
+        return command
+
+    def format_bs_switch(self):
+        if self.m_video_sample_entry is None:
+            return None
+        if self.m_video_sample_entry == "avc1" or self.m_video_sample_entry == "hvc1": #Romain: call them inband, outband, both
+            return "off"
+        elif self.m_video_sample_entry == "avc3" or self.m_video_sample_entry == "hev1":
+            return "inband"
+        elif self.m_video_sample_entry == "avc1+3" or self.m_video_sample_entry == "hevc1+3":
+            return "both"
+        raise ValueError("Supported video sample entries are \"avc1\", \"avc3\", and \"avc1+3\".")
+
+    # stage "encode" stops after the encoder, producing an elementary stream that can be packaged several times.
+    # stage "package" expects such an elementary stream as input, and only applies bitstream rewriting.
+    # with a time range, only that range of the input is encoded, from the previous SAP of the input.
+    def format_command(self, i, stage=None):
+        index = str(i)
+        is_video = self.m_media_type in ("v", "video")
+        input_file_command = self.format_input()
 
-            if self.m_cmaf_profile in ("chh1", "chd1", "cud1", "clg1"):
-                command += ":ofmt=yuv420_10"
+        if stage == "package" and is_video and not self.format_bitstream_rewrite():
+            input_file_command +=  ":FID=V" + index
+        else:
+            input_file_command +=  ":FID=" + "GEN" + self.m_id
 
-            command += ":SID=" + "GEN" + self.m_id
+        command = ""
+        if is_video and stage == "package":
+            bsrw = self.format_bitstream_rewrite()
+            if bsrw:
+                command += "bsrw:SID=" + "GEN" + self.m_id + bsrw + ":FID=V" + index
+
+        elif is_video:
+            source_id = "GEN" + self.m_id
+            if self.m_time_range is not None:
+                start, end = self.m_time_range
+                command += "reframer:xs=" + str(start)
+                if end is not None:
+                    command += ":xe=" + str(end)
+                command += ":xround=seek:SID=" + source_id + ":FID=RNG" + self.m_id + " "
+                source_id = "RNG" + self.m_id
+
+            if self.m_raw_input:
+                command += self.format_encoder(source_id)
+            else:
+                # Resize
+                command += self.format_scaler()
+                command += ":SID=" + source_id
 
-            # Encode
-            command += " @ "
-            command += "enc:gfloc"
-            if is_avc:
-                command += ":c=libx264"
-            elif is_hevc:
-                command += ":c=libx265"
-            command += ":b=" + self.m_bitrate + "k"
-            command += ":bf=" + str(self.m_num_b_frames)
-            command += ":fintra=" + self.m_segment_duration            
-            gop = Fraction(self.m_segment_duration) * Fraction(self.m_frame_rate)
-            command += ":g=" + str(gop)
-            command += ":profile=" + self.m_profile
-            command += ":color_primaries=" + self.m_color_primary
-            command += ":color_trc=" + ( self.m_color_trc or self.m_color_primary )
-            command += ":colorspace=" + ( self.m_colorspace or self.m_color_primary )
+                # Encode
+                command += " @ "
+                command += self.format_encoder()
 
-            if is_avc:
-                command += "::x264-params=\""
-                # by default, x264 disables open-gop
-                command += "no-scenecut=1"
-                if self.m_num_b_frames > 0:
-                    command += ":b-adapt=0"
-                command += ":level=" + self.m_level
+            if stage == "encode":
+                return [input_file_command, command + ":FID=V" + index]
 
-            elif is_hevc:
-                command += "::x265-params=\""
-                command += "scenecut=0"
-                command += ":no-open-gop=1"
-                # disabling adaptative B 'frames' placement ensures we have them where expected, 
-                # otherwise they may be absent from the generated test content
-                # same options for x264 & x265                       
-                if self.m_num_b_frames > 0:
-                    command += ":b-adapt=0"
-                command += ":level-idc=" + self.m_level
-                # for now, all content described in test matrix uses Main tier
-                command += ":no-high-tier=1" 
-
-                if self.m_prefered_color_trc is not None:
-                    command += f":atc-sei={self.m_prefered_color_trc}"
-
-                hdr_metadata = bool(self.m_hdr_mastering_display) or bool(self.m_max_cll_fall)
-                if hdr_metadata:
-                    command += ":repeat-headers=1"
-                if bool(self.m_hdr_mastering_display):
-                    command += f":master-display={self.m_hdr_mastering_display}"
-                if bool(self.m_max_cll_fall):
-                    command += f":max-cll={self.m_max_cll_fall}"
-
-            if self.m_pic_timing == "True":
-                if is_avc:
-                    command += ":nal-hrd=vbr"
-                elif is_hevc:
-                    command += ":hrd=1"
-
-            # common x264 / x265 options
-            command += ":vbv-bufsize=" + str(int(self.m_bitrate) * 3) + \
-                   ":vbv-maxrate=" + str(int(int(self.m_bitrate) * 3 / 2))
-
-            if self.m_aspect_ratio_x and self.m_aspect_ratio_y:
-                command += ":sar=" + self.m_aspect_ratio_x + "\\:" + self.m_aspect_ratio_y
-            
-            command += "\":" # closing encoder specific parameters
-
-            bsrw = None
-            rmseis = []
-            if self.m_vui_timing == "False":
-                bsrw = "novuitiming"
-                rmseis.append("0")
-
-            # HLG signaled in VUI instead of SEI
-            if self.m_color_trc == HEVCCLG1.m_prefered_color_trc:
-                rmseis.append("147")
-            
-            if bsrw is not None or len(rmseis):
-                command += " @ bsrw"
-                if bsrw is not None:
-                    command += ":novuitiming"
-                if len(rmseis):
-                    command += ":rmsei:seis=" + ",".join(rmseis)
+            bsrw = self.format_bitstream_rewrite()
+            if bsrw:
+                command += " @ bsrw" + bsrw
 
             command += ":FID=V" + index
         # end if v / video #####
@@ -535,16 +513,9 @@ class Representation:
                 input_file_command += ":FID=A" + index
 
         #TODO: move: this is a video-only muxing option, not an encoding option. Setting as global.
-        if self.m_video_sample_entry is not None:
-            if self.m_video_sample_entry == "avc1" or self.m_video_sample_entry == "hvc1": #Romain: call them inband, outband, both
-                command += " --bs_switch=off"
-            elif self.m_video_sample_entry == "avc3" or self.m_video_sample_entry == "hev1":
-                command += " --bs_switch=inband"
-            elif self.m_video_sample_entry == "avc1+3" or self.m_video_sample_entry == "hevc1+3":
-                command += " --bs_switch=both"
-            else:
-                print("Supported video sample entries are \"avc1\", \"avc3\", and \"avc1+3\".")
-                sys.exit(1)
+        bs_switch = self.format_bs_switch()
+        if bs_switch is not None:
+            command += " --bs_switch=" + bs_switch
 
         return [input_file_command, command]
 
@@ -554,6 +525,7 @@ class Representation:
 # GPAC binary path: -–path="path/to/gpac"
 # Representation configuration: --reps="<rep1_config rep2_config … repN_config>"
 # DASHing configuration: --dash="<dash_config>"
+# Encode or package only: --stage="encode|package"
 def parse_args(args):
     gpac_path = None
     output_file = None
@@ -565,6 +537,7 @@ def parse_args(args):
     title_notice = None
     bframes = None
     wave_media_profile = None
+    stage = None
     dry_run = False
     for opt, arg in args:
         if opt == '-h':
@@ -590,9 +563,30 @@ def parse_args(args):
             title_notice = arg
         elif opt in ("-pf", "--profile"):
             wave_media_profile = arg
+        elif opt in ("--stage"):
+            if arg not in ("encode", "package"):
+                print("Stage can either be \"encode\" or \"package\".")
+                sys.exit(1)
+            stage = arg
 
     # print(representations)
-    return [gpac_path, output_file, representations, dashing, outDir, copyright_notice, source_notice, title_notice, wave_media_profile, dry_run]
+    return [gpac_path, output_file, representations, dashing, outDir, copyright_notice, source_notice, title_notice, wave_media_profile, stage, dry_run]
+
+
+# gpac version and capabilities, probed once per process
+@functools.cache
+def gpac_version(gpac_path):
+    result = subprocess.run([gpac_path, "-version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return result.stdout.decode(errors='replace').strip()
+
+
+def assert_gpac(gpac_path):
+    try:
+        version = gpac_version(gpac_path)
+    except OSError:
+        version = ""
+    if "gpac - GPAC command line filter engine - version" not in version:
+        raise FileNotFoundError("gpac binary is checked in the \"" + str(gpac_path) + "\" path, but not found.")
 
 
 # Check if the input arguments are correctly given
@@ -602,9 +596,10 @@ def assert_configuration(configuration):
     representations = configuration[2]
     dashing = configuration[3]
     out_dir = configuration[4]
-    result = subprocess.run(gpac_path + " -version", shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if "gpac - GPAC command line filter engine - version" not in result.stderr.decode('ascii'):
-        print("gpac binary is checked in the \"" + gpac_path + "\" path, but not found.")
+    try:
+        assert_gpac(gpac_path)
+    except FileNotFoundError as e:
+        print(e)
         sys.exit(1)
 
     if output_file is None:
@@ -625,7 +620,7 @@ def assert_configuration(configuration):
 
 def parse_config():
     try:
-        arguments, _ = getopt.getopt(sys.argv[1:], 'ho:r:d:p:od:c:s:t:pf', ['out=', 'reps=', 'dash=', 'path=', 'outdir=', 'copyright=', 'source=', 'title=', 'profile=', 'dry-run'])
+        arguments, _ = getopt.getopt(sys.argv[1:], 'ho:r:d:p:od:c:s:t:pf', ['out=', 'reps=', 'dash=', 'path=', 'outdir=', 'copyright=', 'source=', 'title=', 'profile=', 'stage=', 'dry-run'])
     except getopt.GetoptError:
         sys.exit(2)
     configuration = parse_args(arguments)
@@ -633,6 +628,76 @@ def parse_config():
     return configuration
 
 
+# Assemble the gpac command encoding and packaging the given representations
+# With cenc_output_file, the session also encrypts the encoded streams and packages them a second time.
+def format_gpac_command(gpac_path, representations:list[Representation], dash:DASH, output_file, stage=None,
+                        cenc_output_file=None, drm_config=None) -> str:
+    options = []
+    index_v = 0
+    index_a = 0
+    for representation in representations:
+        if representation.m_media_type in ("v", "video"):
+            options.append(representation.format_command(index_v, stage))
+            index_v += 1
+        elif representation.m_media_type in ("a", "audio"):
+            options.append(representation.format_command(index_a, stage))
+            index_a += 1
+        else:
+            raise ValueError("Media type for a representation denoted by <type> can either be \"v\" or \"video\" for video media"
+                             "or \"a\" or \"audio\" for audio media.")
+
+    input_command = ""
+    encode_command = ""
+    for option in options:
+        input_command += option[0] + " "
+        encode_command += option[1] + " "
+    if stage == "encode":
+        # intermediate elementary stream, packaged later on with --stage=package
+        dash_package_command = f"-o {output_file}:SID=" + ",".join(f"V{i}" for i in range(index_v))
+    else:
+        dash_package_command = dash.dash_package_command(index_v, index_a, output_file)
+        if cenc_output_file is not None:
+            source_ids = [f"V{i}" for i in range(index_v)] + ([f"A{index_a - 1}"] if index_a > 0 else [])
+            dash_package_command += f" cecrypt:cfile={drm_config}:SID={','.join(source_ids)}:FID=CENC " + \
+                                    dash.dash_package_command(index_v, index_a, cenc_output_file, "CENC") + ":pssh=mv"
+
+    command = str(gpac_path) + " " + \
+              input_command + " " + \
+              encode_command + " " + \
+              dash_package_command
+    return command
+
+
+# Assemble a gpac command decoding and scaling the input once, feeding one encoder per video representation.
+# outputs are (representation, dash, output_file, stage, cenc_output_file) tuples, whose representations share
+# the same input, resolution and CMAF profile. Each representation is packaged to its own output, with its own sample entry,
+# or with stage "encode", written to an intermediate elementary stream.
+def format_gpac_fan_out_command(gpac_path, outputs:list[tuple], drm_config=None) -> str:
+    representation = outputs[0][0]
+    command = str(gpac_path) + " " + representation.format_input() + ":FID=GEN"
+    source_id = "GEN"
+    if not representation.m_raw_input:
+        command += " " + representation.format_scaler() + ":SID=GEN:FID=SCL"
+        source_id = "SCL"
+    for i, (representation, dash, output_file, stage, cenc_output_file) in enumerate(outputs):
+        index = str(i)
+        command += " " + representation.format_encoder(source_id)
+        bsrw = representation.format_bitstream_rewrite()
+        if stage != "encode" and bsrw:
+            command += " @ bsrw" + bsrw
+        command += ":FID=V" + index
+        if stage == "encode":
+            command += f" -o {output_file}:SID=V" + index
+            continue
+        bs_switch = representation.format_bs_switch()
+        bs_switch = "" if bs_switch is None else ":bs_switch=" + bs_switch
+        command += " " + dash.dash_package_command(1, 0, output_file, "V" + index) + bs_switch
+        if cenc_output_file is not None:
+            command += f" cecrypt:cfile={drm_config}:SID=V{index}:FID=CENC{index} " + \
+                       dash.dash_package_command(1, 0, cenc_output_file, "CENC" + index) + bs_switch + ":pssh=mv"
+    return command
+
+
 HR_SPLIT_LOG = f'\n\n{"="*64}\n\n'
 
 if __name__ == "__main__":
@@ -647,45 +712,21 @@ if __name__ == "__main__":
     source_notice = cfg[6]
     title_notice = cfg[7]
     wave_media_profile = cfg[8]
+    stage = cfg[9]
     dry_run = cfg[-1]
 
     if out_dir is not None:
         output_file = out_dir / output_file
         out_dir.mkdir(parents=True, exist_ok=True)
 
-    options = []
-    index_v = 0
-    index_a = 0
-    for representation_config in representations:
-        representation = Representation(representation_config)
-        if representation.m_media_type in ("v", "video"):
-            options.append(representation.format_command(index_v))
-            index_v += 1
-        elif representation.m_media_type in ("a", "audio"):
-            options.append(representation.format_command(index_a))
-            index_a += 1
-        else:
-            print("Media type for a representation denoted by <type> can either be \"v\" or \"video\" for video media"
-                  "or \"a\" or \"audio\" for audio media.")
-            exit(1)
-
-    input_command = ""
-    encode_command = ""
-    for option in options:
-        input_command += option[0] + " "
-        encode_command += option[1] + " "
-    dash_options = DASH(dash)
-    dash_package_command = dash_options.dash_package_command(index_v, index_a, output_file)
-
-    command = gpac_path + " " + \
-              input_command + " " + \
-              encode_command + " " + \
-              dash_package_command
+    representations = [Representation.from_config(r) for r in representations]
+    command = format_gpac_command(gpac_path, representations, DASH.from_config(dash), output_file, stage)
     sys.stdout.write(HR_SPLIT_LOG)
     sys.stdout.write(command)
     sys.stdout.write(HR_SPLIT_LOG)
-    subprocess.run(gpac_path + " -version", shell=True)
+    sys.stdout.write(gpac_version(gpac_path))
     sys.stdout.write(HR_SPLIT_LOG)
+    sys.stdout.flush()
     if not dry_run:
         subprocess.run(command, shell=True).check_returncode()
         
\ No newline at end of file
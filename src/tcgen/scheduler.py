@@ -0,0 +1,260 @@
+import re
+import time
+import resource
+import subprocess
+from pathlib import Path
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable
+
+from tcgen.models import TestContent, Mezzanine, PROFILES_TYPE
+from tcgen.timing import TimingInfo
+
+# rough peak resident memory of a gpac session, in bytes per megapixel of output resolution.
+# x265 keeps a much larger lookahead / reference buffer than x264, 10-bit samples add to that.
+ENCODER_MEMORY_PER_MEGAPIXEL = {
+    "h264": 160 * 2**20,
+    "h265": 450 * 2**20
+}
+GPAC_BASE_MEMORY = 256 * 2**20
+HIGH_BIT_DEPTH_FACTOR = 1.5
+
+# relative encoding cost per pixel and frame: x265 is several times slower than x264 at comparable presets,
+# 10-bit and B-frames add a sizeable overhead to both.
+ENCODER_COST_PER_PIXEL = {
+    "h264": 1.0,
+    "h265": 4.0
+}
+HIGH_BIT_DEPTH_COST_FACTOR = 1.3
+B_FRAMES_COST_FACTOR = 1.15
+# 10-bit CMAF media profiles (HHD10, UHD10, HLG10), the others are 8-bit
+HIGH_BIT_DEPTH_PROFILES = ("chd1", "cud1", "clg1")
+
+SIZE_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def parse_size(s) -> int:
+    """
+    parse a human readable size, eg. '512M', '32G', or a number of bytes.
+    """
+    if s is None:
+        return None
+    m = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?)I?B?\s*', str(s).upper())
+    if m is None:
+        raise ValueError(f'invalid size: {s}')
+    return int(float(m.group(1)) * SIZE_UNITS[m.group(2)])
+
+
+def format_size(n:int) -> str:
+    for unit in ("T", "G", "M", "K"):
+        if n >= SIZE_UNITS[unit]:
+            return f'{n / SIZE_UNITS[unit]:.1f}{unit}'
+    return f'{n}B'
+
+
+def bit_depth(tc:TestContent) -> int:
+    """
+    bit depth of the test vector's CMAF media profile.
+    """
+    return 10 if tc.cmaf_media_profile.value in HIGH_BIT_DEPTH_PROFILES else 8
+
+
+def estimate_memory(tc:TestContent) -> int:
+    """
+    estimated peak memory footprint of a single test vector encode.
+    """
+    media_type, codec, _ = PROFILES_TYPE[tc.cmaf_media_profile]
+    if media_type != "video" or codec not in ENCODER_MEMORY_PER_MEGAPIXEL:
+        return GPAC_BASE_MEMORY
+    megapixels = tc.resolution.w * tc.resolution.h / 1e6
+    footprint = megapixels * ENCODER_MEMORY_PER_MEGAPIXEL[codec]
+    if bit_depth(tc) > 8:
+        footprint *= HIGH_BIT_DEPTH_FACTOR
+    return GPAC_BASE_MEMORY + int(footprint)
+
+
+def estimate_cost(m:Mezzanine, tc:TestContent, b_frames:int) -> float:
+    """
+    estimated relative cost of a test vector encode: pixels x frames, weighted by codec, bit depth and B-frames.
+    """
+    media_type, codec, _ = PROFILES_TYPE[tc.cmaf_media_profile]
+    if media_type != "video" or codec not in ENCODER_COST_PER_PIXEL:
+        return 0
+    frames = float(m.duration) * float(m.fps)
+    cost = tc.resolution.w * tc.resolution.h * frames * ENCODER_COST_PER_PIXEL[codec]
+    if bit_depth(tc) > 8:
+        cost *= HIGH_BIT_DEPTH_COST_FACTOR
+    if b_frames:
+        cost *= B_FRAMES_COST_FACTOR
+    return cost
+
+
+@dataclass
+class Job:
+    key: str
+    func: Callable
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+    memory: int = 0
+    depends: list[str] = field(default_factory=list)
+    stage: str = None
+    # expected duration in seconds, or any relative measure of it. longer jobs are started first.
+    cost: float = 0
+    timing: TimingInfo = None
+    # progress events written by the job while it runs, see progress.py
+    progress: Path = None
+    # keys of other jobs this job stands for, jobs depending on them depend on this job
+    provides: list[str] = field(default_factory=list)
+
+
+@dataclass
+class JobResult:
+    key: str
+    exit_code: int
+    error: str = None
+    elapsed: float = 0
+    value: object = None
+    cpu: float = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_code == 0
+
+
+def exit_code(e:BaseException) -> int:
+    if isinstance(e, subprocess.CalledProcessError):
+        return e.returncode
+    if isinstance(e, SystemExit) and isinstance(e.code, int):
+        return e.code
+    return 1
+
+
+def cpu_time() -> float:
+    """
+    user + system time of this process and of its terminated child processes (eg. gpac).
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def run_job(func, args, kwargs=None):
+    start = time.monotonic()
+    cpu_start = cpu_time()
+    try:
+        value = func(*args, **(kwargs or {}))
+        return 0, None, time.monotonic() - start, value, cpu_time() - cpu_start
+    except BaseException as e:
+        return exit_code(e), str(e), time.monotonic() - start, None, cpu_time() - cpu_start
+
+
+def critical_path_ranks(jobs:list[Job]) -> dict:
+    """
+    rank each job by its cost plus the highest rank among jobs depending on it,
+    so that long jobs, and jobs that long jobs wait for, are started first.
+    """
+    dependants = {}
+    for job in jobs:
+        for d in job.depends:
+            dependants.setdefault(d, []).append(job)
+    ranks = {}
+
+    def rank(job:Job) -> float:
+        if job.key not in ranks:
+            ranks[job.key] = job.cost + max((rank(j) for key in (job.key, *job.provides) for j in dependants.get(key, [])), default=0)
+        return ranks[job.key]
+
+    for job in jobs:
+        rank(job)
+    return ranks
+
+
+class Scheduler:
+    """
+    Runs jobs in a process pool, admitting a job only when enough workers and memory are available.
+    A job exceeding the memory budget on its own is still run, but never alongside another job.
+    Jobs listing dependencies are held back until all of them completed successfully.
+    stage_limits caps the number of concurrent jobs of a given stage, eg. {"encode": 2, "zip": 8}.
+    Jobs are admitted by decreasing critical path rank, see critical_path_ranks.
+    """
+
+    def __init__(self, max_workers:int=1, max_memory:int=None, initializer=None, initargs=(), stage_limits:dict=None):
+        self.max_workers = max(1, max_workers)
+        self.max_memory = max_memory
+        self.initializer = initializer
+        self.initargs = initargs
+        self.stage_limits = stage_limits or {}
+
+    def admissible(self, job:Job, running:dict) -> bool:
+        if len(running) >= self.max_workers:
+            return False
+        if job.stage in self.stage_limits:
+            if sum(1 for j in running.values() if j.stage == job.stage) >= self.stage_limits[job.stage]:
+                return False
+        if self.max_memory is None:
+            return True
+        used = sum(j.memory for j in running.values())
+        return used == 0 or used + job.memory <= self.max_memory
+
+    def run(self, jobs:list[Job], on_result:Callable[[JobResult], None]=None,
+            on_tick:Callable[[list[Job]], None]=None, tick:float=None) -> list[JobResult]:
+        """
+        run jobs, calling on_result as each of them completes,
+        and on_tick with the running jobs at least every tick seconds.
+        """
+        ranks = critical_path_ranks(jobs)
+        pending = sorted(jobs, key=lambda j: ranks[j.key], reverse=True)
+        keys = {key for j in jobs for key in (j.key, *j.provides)}
+        provides = {j.key: j.provides for j in jobs}
+        results = {}
+        running = {}
+
+        def complete(result:JobResult):
+            results[result.key] = result
+            for key in provides[result.key]:
+                results[key] = result
+            if on_result:
+                on_result(result)
+
+        def admit(executor) -> bool:
+            changed = False
+            for job in [*pending]:
+                deps = [d for d in job.depends if d in keys]
+                failed = [d for d in deps if d in results and not results[d].ok]
+                if failed:
+                    pending.remove(job)
+                    complete(JobResult(job.key, 1, f'dependency failed: {", ".join(failed)}'))
+                    changed = True
+                    continue
+                if not all(d in results for d in deps):
+                    continue
+                if not self.admissible(job, running):
+                    continue
+                pending.remove(job)
+                running[executor.submit(run_job, job.func, job.args, job.kwargs)] = job
+                changed = True
+            return changed
+
+        with ProcessPoolExecutor(max_workers=self.max_workers, initializer=self.initializer, initargs=self.initargs) as executor:
+            while pending or running:
+                while admit(executor):
+                    pass
+
+                if not running:
+                    # remaining jobs depend on jobs that were never scheduled
+                    for job in pending:
+                        complete(JobResult(job.key, 1, 'unresolved dependencies'))
+                    break
+
+                done, _ = wait(running, timeout=tick, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        code, error, elapsed, value, cpu = future.result()
+                    except BaseException as e:
+                        code, error, elapsed, value, cpu = exit_code(e), str(e), 0, None, 0
+                    complete(JobResult(job.key, code, error, elapsed, value, cpu))
+                if on_tick:
+                    on_tick([*running.values()])
+
+        return [results[j.key] for j in jobs]
@@ -3,19 +3,27 @@ import subprocess
 import logging 
 import json
 import os
-import re
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 import requests
 import click
 import pysftp
 import asyncio
-import xml.etree.ElementTree as ET
 import shutil
-
-from tcgen.models import TestContent, FPS_FAMILY, locate_source_content, Mezzanine
-from tcgen.database import Database, most_recent_batch
-from tcgen.encode import encode_stream, encrypt_stream_cenc, patch_mpd, HR_SPLIT_LOG
-from tcgen.validation import validate_test_vectors_async, JCCP_STAGING
+from contextlib import nullcontext
+
+from tcgen.models import TestContent, FPS_FAMILY, locate_source_content, Mezzanine, MEZZANINES
+from tcgen.database import Database, open_database, diff_databases, most_recent_batch
+from tcgen.batch import plan_encode_jobs, plan_pipeline_jobs, plan_batch, iter_batch_vectors, shared_streams_dir, staging_releaser, ZIP, VALIDATE, STAGE, PROMOTE
+from tcgen.scheduler import Scheduler, Job, JobResult, parse_size, format_size
+from tcgen.timing import TimingStore, output_size
+from tcgen.progress import last_progress_event, format_progress_event
+from tcgen.catalog import MezzanineIndex
+from tcgen.cache import EncodeCache, FrameCache, StagingCache, DEFAULT_CACHE_SIZE, DEFAULT_FRAME_CACHE_SIZE, DEFAULT_STAGING_SIZE
+from tcgen.journal import Journal, ENCODE
+from tcgen.export import zip_test_vectors, archive_switching_sets
+from tcgen.encode import clear_stream_location, use_frame_cache, use_staging, repatch_test_vector
+from tcgen.validation import validate_test_vectors_async, serve_content, JCCP_STAGING
 
 @click.group()
 @click.pass_context
@@ -40,40 +48,460 @@ def cli(ctx):
 @click.option('-f', '--fps-family', default='ALL', help='process only one of 14.985_29.97_59.94 - 12.5_25_50 - 15_30_60')
 @click.option('--drm-config', default=(Path(__file__) / '../../../DRM.xml').resolve(), help='path to DRM.xml config file')
 @click.option('--dry_run/--no-dry-run', default=False, help="dry run, usefull for debugging")
-def encode(ctx, mezzanine, config, vectors_dir, batch_dir, encode, format_mpd, test_id, fps_family, drm_config, dry_run):
+@click.option('-j', '--jobs', default=1, help='maximum number of test vectors processed concurrently. default: 1')
+@click.option('--max-memory', default=None, help='memory budget shared by concurrent jobs, eg. 48G. jobs are admitted based on their estimated footprint. default: unlimited')
+@click.option('--share-encodes/--no-share-encodes', default=True, help='encode once test vectors that only differ in packaging, then package each of them from the shared elementary stream. default: --share-encodes')
+@click.option('--cache/--no-cache', default=True, help='reuse previously encoded test vectors from VECTORS_DIR/.tcgen/cache when mezzanine, gpac command and gpac version match. default: --cache')
+@click.option('--cache-size', default=DEFAULT_CACHE_SIZE, help=f'size of the encode cache, least recently used entries are evicted after the batch. default: {DEFAULT_CACHE_SIZE}')
+@click.option('--resume', is_flag=True, default=False, help='skip test vectors and steps the batch journal lists as completed by a previous run, process the rest.')
+@click.option('--single-pass-cenc/--no-single-pass-cenc', default=True, help='encrypt test vectors in the gpac session encoding their clear counterpart, instead of reading it back from disk. default: --single-pass-cenc')
+@click.option('--progress-interval', default=60, help='seconds between two progress reports of running encodes, 0 disables them. default: 60')
+@click.option('--chunks', default=1, help='split each encode into up to CHUNKS time ranges starting on segment boundaries, encoded concurrently then joined. default: 1')
+@click.option('--fan-out', default=4, help='maximum number of encodes of the same mezzanine, resolution and pixel format run by a single gpac session, decoding and scaling the mezzanine once. 1 disables it. default: 4')
+@click.option('--frame-cache/--no-frame-cache', default=False, help='decode and scale mezzanines once into raw frames kept in VECTORS_DIR/.tcgen/frames, and encode from these frames. default: --no-frame-cache')
+@click.option('--frame-cache-size', default=DEFAULT_FRAME_CACHE_SIZE, help=f'size of the frame cache, least recently used entries are evicted after the batch. default: {DEFAULT_FRAME_CACHE_SIZE}')
+@click.option('--staging-dir', default=None, help='local directory mezzanines are copied to ahead of the encodes reading them, eg. on a local SSD when MEZZANINE is on network storage. default: no staging')
+@click.option('--staging-size', default=DEFAULT_STAGING_SIZE, help=f'size of the staging directory, least recently used mezzanines no longer needed are evicted. default: {DEFAULT_STAGING_SIZE}')
+@click.option('--staging-jobs', default=2, help='maximum number of mezzanines copied concurrently to the staging directory. default: 2')
+@click.option('--scratch-dir', default=None, help='local directory test vectors are encoded into, eg. on tmpfs or a local NVMe when VECTORS_DIR is on network storage. they are then moved to VECTORS_DIR while the next encodes run. default: encode into VECTORS_DIR')
+@click.option('--promote-jobs', default=2, help='maximum number of test vectors moved concurrently from the scratch directory to VECTORS_DIR. default: 2')
+def encode(ctx, mezzanine, config, vectors_dir, batch_dir, encode, format_mpd, test_id, fps_family, drm_config, dry_run, jobs, max_memory, share_encodes, cache, cache_size, resume, single_pass_cenc, progress_interval, chunks, fan_out,
+           frame_cache, frame_cache_size, staging_dir, staging_size, staging_jobs, scratch_dir, promote_jobs):
     """
     Encode content from MEZZANINE directory into test vectors using content options specified in CONFIG.
     """
 
-    Mezzanine.root_dir = Path(mezzanine)
+    framerates = select_framerates(fps_family)
+    use_mezzanine_dir(Path(mezzanine), iter_batch_vectors(config, framerates, test_id))
+
+    encode_cache = EncodeCache.in_vectors_dir(vectors_dir, parse_size(cache_size)) if cache else None
+    frames = FrameCache.in_vectors_dir(vectors_dir, parse_size(frame_cache_size)) if (frame_cache and encode) else None
+    staging = StagingCache(staging_dir, parse_size(staging_size)) if (staging_dir and encode) else None
+    journal = Journal.for_batch(vectors_dir, batch_dir)
+    if not (resume or dry_run):
+        journal.reset()
+    timings = None if dry_run else TimingStore.in_vectors_dir(vectors_dir)
+    encode_jobs = plan_encode_jobs(config, Path(vectors_dir), batch_dir, framerates=framerates, test_id=test_id, encode=encode, format_mpd=format_mpd,
+                                   drm_config=drm_config, dry_run=dry_run, share_encodes=share_encodes, cache=encode_cache, journal=journal,
+                                   single_pass_cenc=single_pass_cenc, timings=timings, chunks=chunks, fan_out=fan_out, frame_cache=frames,
+                                   staging=staging, scratch_dir=scratch_dir)
+
+    stage_limits = {ENCODE: jobs, STAGE: staging_jobs if staging else 0, PROMOTE: promote_jobs if scratch_dir else 0}
+    scheduler = Scheduler(sum(stage_limits.values()), parse_size(max_memory), init_worker, (Path(mezzanine), Mezzanine.index, frames, staging), stage_limits)
+    on_tick = progress_reporter(progress_interval) if progress_interval else None
+    report = job_reporter(encode_jobs, stage_limits, timings)
+    if staging is not None:
+        report = staging_releaser(encode_jobs, staging, report)
+    results = scheduler.run(encode_jobs, report, on_tick, progress_interval or None)
+    if encode_cache is not None:
+        encode_cache.prune()
+    if frames is not None:
+        frames.prune()
+    if staging is not None:
+        staging.prune()
+    failures = [r for r in results if not r.ok]
+    click.echo(f'\n{len(results) - len(failures)}/{len(results)} jobs processed successfully')
+    if len(failures):
+        ctx.exit(1)
+    for d in (vectors_dir, scratch_dir):
+        if d is not None and shared_streams_dir(d, batch_dir).exists():
+            shutil.rmtree(shared_streams_dir(d, batch_dir))
+
+
+def use_mezzanine_dir(root_dir:Path, vectors=()):
+    """
+    locate source content in root_dir, through its index when one was built with `tcgen mezzanine index`,
+    and preload the annotations of the mezzanines used by vectors, (tc, fps_family) pairs.
+    """
+    Mezzanine.root_dir = root_dir
+    Mezzanine.index = MezzanineIndex.load(root_dir)
+    if Mezzanine.index is not None:
+        Mezzanine.index.refresh()
+    mezzanines = []
+    for tc, fps_family in vectors:
+        try:
+            mezzanines.append(locate_source_content(tc, fps_family))
+        except Exception:
+            # missing mezzanines are reported by the jobs using them
+            continue
+    MEZZANINES.preload(mezzanines)
+
+
+def init_worker(root_dir:Path, index:MezzanineIndex=None, frame_cache:FrameCache=None, staging:StagingCache=None):
+    Mezzanine.root_dir = root_dir
+    Mezzanine.index = index
+    use_frame_cache(frame_cache)
+    use_staging(staging)
+
+
+def select_framerates(fps_family:str) -> list[FPS_FAMILY]:
     framerates = FPS_FAMILY.all()
-    
     if fps_family != 'ALL':
         if fps_family not in framerates:
             raise Exception(f'Invalid framerate configuration {fps_family}')
         framerates = [FPS_FAMILY.from_string(fps_family)]
+    return framerates
+
+
+def format_duration(seconds:float) -> str:
+    return str(timedelta(seconds=round(seconds)))
+
+
+def job_reporter(jobs:list[Job], stage_limits:dict, timings:TimingStore=None):
+    """
+    returns a Scheduler.run callback reporting each job result along with the batch ETA,
+    and recording the duration of successful jobs to timings.
+    the ETA adds up the remaining cost of each stage, divided by the number of concurrent jobs of that stage.
+    """
+    by_key = {j.key: j for j in jobs}
+    remaining = {j.key: j.cost for j in jobs}
+    # stages without a limit only share the scheduler's workers
+    workers = max(1, sum(stage_limits.values()))
+    stage_costs = {}
+    for j in jobs:
+        stage_costs[j.stage] = stage_costs.get(j.stage, 0) + j.cost
+
+    def eta() -> str:
+        return format_duration(sum(cost / max(1, stage_limits.get(stage) or workers) for stage, cost in stage_costs.items()))
+
+    click.echo(f'{len(jobs)} jobs, estimated duration: {eta()}')
+
+    def report(r:JobResult):
+        job = by_key[r.key]
+        stage_costs[job.stage] -= remaining.pop(r.key, 0)
+        if r.ok and timings is not None and job.timing is not None:
+            timings.record(job.timing.key, r.elapsed, r.cpu, output_size(r.value), job.timing.cost)
+        if r.ok:
+            click.echo(f'done: {r.key} ({r.elapsed:.1f}s) - eta {eta()}')
+        else:
+            click.echo(f'failed: {r.key} - exit code {r.exit_code} - {r.error} - eta {eta()}')
+
+    return report
+
+
+def progress_reporter(interval:float):
+    """
+    returns a Scheduler.run on_tick callback printing the progress of running jobs every interval seconds.
+    """
+    last = time.monotonic()
+
+    def tick(running:list[Job]):
+        nonlocal last
+        if time.monotonic() - last < interval:
+            return
+        last = time.monotonic()
+        reports = [format_progress_event(j.key, last_progress_event(j.progress)) for j in running if j.progress is not None]
+        if len(reports):
+            click.echo('\n'.join(['--- progress', *reports, '---']))
+
+    return tick
+
+
+###############################################################
+# PLAN
+###############################################################
+
+@cli.command()
+@click.pass_context
+@click.argument('mezzanine')
+@click.argument('config')
+@click.option('-v', '--vectors-dir', default='output', help='default: ./output')
+@click.option('-b', '--batch-dir', default=datetime.today().strftime('%Y-%m-%d'), help='batch directory name. default value uses the current date, eg. 2024-12-31')
+@click.option('-t', '--test-id', help='process only vector with id "-', default=None)
+@click.option('-f', '--fps-family', default='ALL', help='process only one of 14.985_29.97_59.94 - 12.5_25_50 - 15_30_60')
+@click.option('--cache/--no-cache', default=True, help='report encode cache hits. default: --cache')
+@click.option('--zip/--no-zip', default=True, help='include zip jobs. default: --zip')
+@click.option('--jccp', default=None, help='include validation jobs.')
+@click.option('--chunks', default=1, help='report cache hits of encodes split into up to CHUNKS time ranges, see tcgen encode --help. default: 1')
+@click.option('--json', 'json_output', default=None, help='write the plan as json to this file, "-" for stdout.')
+def plan(ctx, mezzanine, config, vectors_dir, batch_dir, test_id, fps_family, cache, zip, jccp, chunks, json_output):
+    """
+    Expand CONFIG into the jobs tcgen pipeline would run, without running anything. \
+    Reports missing mezzanine content, the estimated cost of each encode, encode cache hits and jobs already complete on disk.
+    """
+    framerates = select_framerates(fps_family)
+    use_mezzanine_dir(Path(mezzanine), iter_batch_vectors(config, framerates, test_id))
+    encode_cache = EncodeCache.in_vectors_dir(vectors_dir) if cache else None
+    entries = plan_batch(config, Path(vectors_dir), batch_dir, framerates=framerates, test_id=test_id, cache=encode_cache, zip=zip, jccp=jccp,
+                         chunks=chunks)
+
+    if json_output is not None:
+        if json_output == '-':
+            click.echo(json.dumps(entries, indent=4))
+            return
+        with open(json_output, 'w') as fo:
+            json.dump(entries, fo, indent=4)
+
+    missing = {e["mezzanine"]: e["missing"] for e in entries if e["missing"]}
+    for error in missing.values():
+        click.echo(f'missing: {error}')
+    if len(missing):
+        click.echo('')
+
+    def status(e):
+        if e["missing"]:
+            return 'missing source'
+        elif e["complete"]:
+            return 'complete'
+        elif e["cache_hit"]:
+            return 'cache hit'
+        return 'pending'
+
+    click.echo(f'{"JOB":<56} {"STAGE":<8} {"MEZZANINE":<44} {"COST":>8}  STATUS')
+    for e in entries:
+        cost = f'{e["cost"] / 1e9:.1f}' if e["cost"] else '-'
+        click.echo(f'{e["key"]:<56} {e["stage"]:<8} {e["mezzanine"]:<44} {cost:>8}  {status(e)}')
+
+    click.echo(f'\n{"FPS FAMILY":<20} {"JOBS":>6} {"PENDING":>8} {"ENCODES":>8} {"COST":>10}')
+    for fps in framerates:
+        family = [e for e in entries if e["fps_family"] == fps.value]
+        pending = [e for e in family if status(e) == 'pending']
+        encodes = [e for e in pending if e["stage"] == ENCODE]
+        cost = sum(e["cost"] for e in encodes) / 1e9
+        click.echo(f'{fps.value:<20} {len(family):>6} {len(pending):>8} {len(encodes):>8} {cost:>10.1f}')
+    click.echo('\ncost: pixels x frames, weighted by codec, bit depth and B-frames, in billions. only pending encodes are accounted for.')
 
-    for tc in TestContent.iter_vectors_in_batch_config(config):
-        if test_id != None and tc.test_id != test_id:
+
+###############################################################
+# PIPELINE
+###############################################################
+
+@cli.command()
+@click.pass_context
+@click.argument('mezzanine')
+@click.argument('config')
+@click.option('-v', '--vectors-dir', default='output', help='default: ./output')
+@click.option('-b', '--batch-dir', default=datetime.today().strftime('%Y-%m-%d'), help='batch directory name. default value uses the current date, eg. 2024-12-31')
+@click.option('-t', '--test-id', help='process only vector with id "-', default=None)
+@click.option('-f', '--fps-family', default='ALL', help='process only one of 14.985_29.97_59.94 - 12.5_25_50 - 15_30_60')
+@click.option('--drm-config', default=(Path(__file__) / '../../../DRM.xml').resolve(), help='path to DRM.xml config file')
+@click.option('-j', '--jobs', default=1, help='maximum number of concurrent encode jobs. default: 1')
+@click.option('--zip-jobs', default=4, help='maximum number of concurrent zip jobs. default: 4')
+@click.option('--validate-jobs', default=1, help='maximum number of concurrent validation jobs. default: 1')
+@click.option('--max-memory', default=None, help='memory budget shared by concurrent encode jobs, eg. 48G. default: unlimited')
+@click.option('--share-encodes/--no-share-encodes', default=True, help='see tcgen encode --help')
+@click.option('--cache/--no-cache', default=True, help='see tcgen encode --help')
+@click.option('--cache-size', default=DEFAULT_CACHE_SIZE, help=f'see tcgen encode --help. default: {DEFAULT_CACHE_SIZE}')
+@click.option('--resume', is_flag=True, default=False, help='skip encoding test vectors the batch journal lists as completed by a previous run.')
+@click.option('--single-pass-cenc/--no-single-pass-cenc', default=True, help='see tcgen encode --help')
+@click.option('--zip/--no-zip', default=True, help='generate individual .zip archive for test vectors. default: --zip')
+@click.option('--jccp', default=None, help="validate test vectors with DASH-IF's Joint Content Conformance Project, see tcgen jccp-validation --help. default: no validation")
+@click.option('--vectors-url', default=None, help='location JCCP retrieves test vectors from. default: VECTORS_DIR, served over http on --port')
+@click.option('-p', '--port', default=8000, help='port VECTORS_DIR is served on for JCCP when --vectors-url is not set. default=8000')
+@click.option('-d', '--database', default=None, help='path of a database file to create or patch with the test vectors processed successfully.')
+@click.option('--progress-interval', default=60, help='seconds between two progress reports of running encodes, 0 disables them. default: 60')
+@click.option('--chunks', default=1, help='see tcgen encode --help. default: 1')
+@click.option('--fan-out', default=4, help='see tcgen encode --help. default: 4')
+@click.option('--frame-cache/--no-frame-cache', default=False, help='see tcgen encode --help')
+@click.option('--frame-cache-size', default=DEFAULT_FRAME_CACHE_SIZE, help=f'see tcgen encode --help. default: {DEFAULT_FRAME_CACHE_SIZE}')
+@click.option('--staging-dir', default=None, help='see tcgen encode --help')
+@click.option('--staging-size', default=DEFAULT_STAGING_SIZE, help=f'see tcgen encode --help. default: {DEFAULT_STAGING_SIZE}')
+@click.option('--staging-jobs', default=2, help='see tcgen encode --help. default: 2')
+@click.option('--scratch-dir', default=None, help='see tcgen encode --help')
+@click.option('--promote-jobs', default=2, help='see tcgen encode --help. default: 2')
+def pipeline(ctx, mezzanine, config, vectors_dir, batch_dir, test_id, fps_family, drm_config, jobs, zip_jobs, validate_jobs, max_memory,
+             share_encodes, cache, cache_size, resume, single_pass_cenc, zip, jccp, vectors_url, port, database, progress_interval, chunks, fan_out,
+             frame_cache, frame_cache_size, staging_dir, staging_size, staging_jobs, scratch_dir, promote_jobs):
+    """
+    Encode, zip and validate the test vectors listed in CONFIG as a single graph of jobs: \
+    each test vector is zipped and validated as soon as it is encoded, regardless of other test vectors.
+    """
+    framerates = select_framerates(fps_family)
+    use_mezzanine_dir(Path(mezzanine), iter_batch_vectors(config, framerates, test_id))
+
+    encode_cache = EncodeCache.in_vectors_dir(vectors_dir, parse_size(cache_size)) if cache else None
+    frames = FrameCache.in_vectors_dir(vectors_dir, parse_size(frame_cache_size)) if frame_cache else None
+    staging = StagingCache(staging_dir, parse_size(staging_size)) if staging_dir else None
+    journal = Journal.for_batch(vectors_dir, batch_dir)
+    if not resume:
+        journal.reset()
+    timings = TimingStore.in_vectors_dir(vectors_dir)
+    if jccp is not None and vectors_url is None:
+        # jccp validates the test vectors just encoded, not the public ones
+        Path(vectors_dir).mkdir(parents=True, exist_ok=True)
+        content_server = serve_content(Path(vectors_dir).resolve(), port)
+    else:
+        content_server = nullcontext(vectors_url)
+    with content_server as vectors_url:
+        pipeline_jobs = plan_pipeline_jobs(config, Path(vectors_dir), batch_dir, framerates=framerates, test_id=test_id, drm_config=drm_config,
+                                           share_encodes=share_encodes, cache=encode_cache, journal=journal,
+                                           single_pass_cenc=single_pass_cenc, zip=zip, jccp=jccp, vectors_url=vectors_url, timings=timings,
+                                           chunks=chunks, fan_out=fan_out, frame_cache=frames, staging=staging, scratch_dir=scratch_dir)
+
+        stage_limits = {ENCODE: jobs, ZIP: zip_jobs, VALIDATE: validate_jobs, STAGE: staging_jobs if staging else 0, PROMOTE: promote_jobs if scratch_dir else 0}
+        scheduler = Scheduler(sum(stage_limits.values()), parse_size(max_memory), init_worker, (Path(mezzanine), Mezzanine.index, frames, staging), stage_limits)
+        on_tick = progress_reporter(progress_interval) if progress_interval else None
+        report = job_reporter(pipeline_jobs, stage_limits, timings)
+        if staging is not None:
+            report = staging_releaser(pipeline_jobs, staging, report)
+        results = scheduler.run(pipeline_jobs, report, on_tick, progress_interval or None)
+    if encode_cache is not None:
+        encode_cache.prune()
+    if frames is not None:
+        frames.prune()
+    if staging is not None:
+        staging.prune()
+
+    if database is not None:
+        db = open_database(database)
+        failed = {r.key for r in results if not r.ok}
+        for tc, fps in iter_batch_vectors(config, framerates, test_id):
+            key = Database.test_entry_key(fps, tc, batch_dir)
+            clear_key = str(clear_stream_location(Path(key)))
+            if key in failed or clear_key in failed or f'{ZIP}/{key}' in failed or f'{PROMOTE}/{clear_key}' in failed:
                 continue
-        
-        for fps_family in framerates:
-            try:
-                m = locate_source_content(tc, fps_family)
-                if tc.encryption:
-                    test_stream_cenc_dir =  Path(vectors_dir) / Database.test_entry_location(fps_family, tc, batch_dir)
-                    test_stream_dir =  Path(re.sub(r"[-_]c?enc/", "/", str(test_stream_cenc_dir)))
-                    output_mpd = encrypt_stream_cenc(test_stream_cenc_dir, test_stream_dir, drm_config, dry_run)
-                else:
-                    test_stream_dir =  Path(vectors_dir) / Database.test_entry_location(fps_family, tc, batch_dir)
-                    encode_dry_run = not encode
-                    output_mpd = encode_stream(m, tc, test_stream_dir, encode_dry_run)
-                if format_mpd:
-                    if not dry_run:
-                        patch_mpd(output_mpd, m, tc)
-            
-            except BaseException as e:
-                print(e)
+            db.add_entry(tc, locate_source_content(tc, fps), batch_dir)
+        db.save(database)
+
+    failures = [r for r in results if not r.ok]
+    click.echo(f'\n{len(results) - len(failures)}/{len(results)} jobs processed successfully')
+    if len(failures):
+        ctx.exit(1)
+    for d in (vectors_dir, scratch_dir):
+        if d is not None and shared_streams_dir(d, batch_dir).exists():
+            shutil.rmtree(shared_streams_dir(d, batch_dir))
+
+
+###############################################################
+# CACHE
+###############################################################
+
+@cli.group()
+def cache():
+    """
+    Manage the encode cache stored in VECTORS_DIR/.tcgen/cache, and the frame cache stored in VECTORS_DIR/.tcgen/frames
+    """
+
+
+@cache.command()
+@click.option('-v', '--vectors-dir', default='output', help='default: ./output')
+@click.option('--frames', is_flag=True, default=False, help='the frame cache instead of the encode cache.')
+def stats(vectors_dir, frames):
+    """
+    Print the number of entries and size of the encode cache.
+    """
+    s = (FrameCache if frames else EncodeCache).in_vectors_dir(vectors_dir).stats()
+    click.echo(f'location: {s["location"]}')
+    click.echo(f'entries: {s["entries"]}')
+    click.echo(f'size: {format_size(s["size"])}')
+    if s["entries"]:
+        click.echo(f'least recently used: {datetime.fromtimestamp(s["oldest_use"]).isoformat(timespec="seconds")}')
+        click.echo(f'most recently used: {datetime.fromtimestamp(s["latest_use"]).isoformat(timespec="seconds")}')
+
+
+@cache.command()
+@click.option('-v', '--vectors-dir', default='output', help='default: ./output')
+@click.option('--max-size', default=None, help=f'evict least recently used entries until the cache fits this size, 0 clears the cache. default: {DEFAULT_CACHE_SIZE}, {DEFAULT_FRAME_CACHE_SIZE} with --frames')
+@click.option('--frames', is_flag=True, default=False, help='the frame cache instead of the encode cache.')
+def prune(vectors_dir, max_size, frames):
+    """
+    Evict least recently used entries from the encode cache.
+    """
+    if max_size is None:
+        max_size = DEFAULT_FRAME_CACHE_SIZE if frames else DEFAULT_CACHE_SIZE
+    evicted = (FrameCache if frames else EncodeCache).in_vectors_dir(vectors_dir).prune(parse_size(max_size))
+    click.echo(f'evicted {len(evicted)} entries')
+
+
+###############################################################
+# MEZZANINE
+###############################################################
+
+@cli.group()
+def mezzanine():
+    """
+    Manage the index of mezzanine content stored in MEZZANINE/.tcgen/index.json
+    """
+
+
+@mezzanine.command('index')
+@click.pass_context
+@click.argument('mezzanine', envvar='WAVE_MEZZANINE_DIR')
+@click.option('-j', '--jobs', default=4, help='number of mezzanine files hashed concurrently. default: 4')
+@click.option('--force', is_flag=True, default=False, help='hash all mezzanine files, including unchanged ones.')
+def index(ctx, mezzanine, jobs, force):
+    """
+    Index the MEZZANINE directory, and verify the md5 of mezzanine files against their annotations. \
+    Files are only hashed again when their size or modification time changed. \
+    Once indexed, source content is located from the index, and corrupt mezzanine files are refused.
+    """
+    mezzanine_index = MezzanineIndex.load(mezzanine) or MezzanineIndex(mezzanine)
+    hashed = mezzanine_index.update(jobs, force)
+    mezzanine_index.save()
+    corrupt = mezzanine_index.corrupt()
+    for filename in corrupt:
+        click.echo(f'corrupt: {filename}')
+    click.echo(f'{len(mezzanine_index.filenames())} mezzanine files indexed, {len(hashed)} hashed, {len(corrupt)} corrupt')
+    if len(corrupt):
+        ctx.exit(1)
+
+
+###############################################################
+# PATCH MPD
+###############################################################
+
+@cli.command()
+@click.pass_context
+@click.argument('mezzanine')
+@click.argument('config')
+@click.option('-v', '--vectors-dir', default='output', help='default: ./output')
+@click.option('-b', '--batch-dir', default=None, help='batch directory name. default: the batch listed in DATABASE, or the most recent batch of each test vector')
+@click.option('-d', '--database', default=None, type=click.Path(exists=True), help='patch the batch of each test vector listed in this database.')
+@click.option('-t', '--test-id', help='process only vector with id "-', default=None)
+@click.option('-f', '--fps-family', default='ALL', help='process only one of 14.985_29.97_59.94 - 12.5_25_50 - 15_30_60')
+@click.option('-j', '--jobs', default=4, help='maximum number of mpds patched concurrently. default: 4')
+@click.option('--diff', is_flag=True, default=False, help='print the changes made to each mpd.')
+@click.option('--verify-timeline', is_flag=True, default=False, help='check the start time of each segment in the SegmentTimeline against the tfdt of the segment, an mpd is left untouched when they differ.')
+@click.option('--dry_run/--no-dry-run', default=False, help="report the changes without writing them")
+def patch_mpd(ctx, mezzanine, config, vectors_dir, batch_dir, database, test_id, fps_family, jobs, diff, verify_timeline, dry_run):
+    """
+    Patch again the mpd of the test vectors listed in CONFIG, eg. after the CTA content model changed, \
+    without encoding them. An mpd is only rewritten when the patched mpd differs from the one on disk.
+    """
+    use_mezzanine_dir(Path(mezzanine), iter_batch_vectors(config, select_framerates(fps_family), test_id))
+    vectors_dir = Path(vectors_dir)
+    db = None
+    if database is not None:
+        db = open_database(database, create=False)
+
+    patch_jobs = []
+    missing = 0
+    for tc, fps in iter_batch_vectors(config, select_framerates(fps_family), test_id):
+        vector_dir = vectors_dir / Database.test_entry_location(fps, tc, '')
+        if batch_dir is not None:
+            batches = [batch_dir]
+        elif db is not None:
+            batches = [k.rstrip('/').split('/')[3] for k in db.find(tc) if k.split('/')[1] == fps.value]
+        else:
+            batches = [most_recent_batch(vector_dir).name] if vector_dir.exists() else []
+        for batch in batches:
+            if not (vector_dir / batch / 'stream.mpd').exists():
+                logging.warning(f'missing: {vector_dir / batch / "stream.mpd"}')
+                missing += 1
+                continue
+            patch_jobs.append(Job(Database.test_entry_key(fps, tc, batch), repatch_test_vector, (tc, fps, vectors_dir, batch, dry_run, verify_timeline)))
+
+    changed = []
+    failed = []
+
+    def report(r:JobResult):
+        if not r.ok:
+            failed.append(r.key)
+            click.echo(f'failed: {r.key} - {r.error}')
+        elif r.value:
+            changed.append(r.key)
+            added = sum(1 for l in r.value.splitlines() if l.startswith('+') and not l.startswith('+++'))
+            removed = sum(1 for l in r.value.splitlines() if l.startswith('-') and not l.startswith('---'))
+            click.echo(f'{"changes" if dry_run else "patched"}: {r.key} (+{added} -{removed})')
+            if diff:
+                click.echo(r.value)
+
+    scheduler = Scheduler(jobs, initializer=init_worker, initargs=(Path(mezzanine), Mezzanine.index))
+    scheduler.run(patch_jobs, report)
+    unchanged = len(patch_jobs) - len(changed) - len(failed)
+    click.echo(f'\n{len(patch_jobs)} mpds: {len(changed)} {"to patch" if dry_run else "patched"}, {unchanged} unchanged, {len(failed)} failed, {missing} missing')
+    if len(failed):
+        ctx.exit(1)
 
 
 ###############################################################
@@ -86,19 +514,21 @@ def encode(ctx, mezzanine, config, vectors_dir, batch_dir, encode, format_mpd, t
 @click.argument('config')
 @click.option('-v', '--vectors-dir', default='output', help='default: ./output')
 @click.option('-d', '--database', default=None, help='Path to create database file. If the database already exists, it will be patched.')
-@click.option('--zip/--no-zip', default=True, help='generate individual .zip archive for test vectors. default: --zip')
-def export(ctx, mezzanine, config, vectors_dir, database, zip):
+@click.option('--zip/--no-zip', 'zip_vectors', default=True, help='generate individual .zip archive for test vectors. default: --zip')
+@click.option('-j', '--jobs', default=4, help='maximum number of test vectors zipped concurrently. default: 4')
+def export(ctx, mezzanine, config, vectors_dir, database, zip_vectors, jobs):
     """
     Prepare for upload by generating a database file and zip archives for the test vectors listed in CONFIG. \
     MEZZANINE directory is required to provide source content metadata.
     """
-    Mezzanine.root_dir = Path(mezzanine)
-    db = Database()
+    use_mezzanine_dir(Path(mezzanine), iter_batch_vectors(config, FPS_FAMILY.all()))
     if database is None:
         database = Path('./export') / Path(config).with_suffix('.json').name
-    elif Path(database).exists():
-        db.load(database)
+        db = Database({})
+    else:
+        db = open_database(database)
 
+    found = []
     for tv in TestContent.iter_vectors_in_batch_config(config):
         for fps in FPS_FAMILY.all():
             test_entry_key = Database.test_entry_key(fps, tv, '')
@@ -108,104 +538,138 @@ def export(ctx, mezzanine, config, vectors_dir, database, zip):
                 batch_dir = most_recent_batch(vector_dir)
                 stream_mpd = batch_dir / 'stream.mpd'
                 assert stream_mpd.exists(), f'missing: {batch_dir.stem}/stream.mpd'
-                batch_zip = batch_dir / f'{Database.test_id(tv)}.zip'
-                if zip and not batch_zip.exists():
-                    batch_rel_dir = batch_dir.relative_to(vectors_dir)
-                    batch_zip = batch_rel_dir / f'{Database.test_id(tv)}.zip'
-                    res = subprocess.run(f'zip -r {batch_zip} {str(batch_rel_dir)}', shell=True, cwd=vectors_dir)
-                    res.check_returncode()
-                elif zip:
-                    assert batch_zip.exists(), f'missing: {batch_dir.stem}/{Database.test_id(tv)}.zip'
-                m = locate_source_content(tv, fps)
-                db.add_entry(tv, m, batch_dir.name)
+                found.append((tv, fps, batch_dir))
             except BaseException as e:
                 logging.warning(f'{test_entry_key} : {e}')
 
+    zipped = [None] * len(found)
+    if zip_vectors:
+        zipped = zip_test_vectors(vectors_dir, [(batch_dir, Database.test_id(tv)) for tv, _, batch_dir in found], jobs)
+
+    for (tv, fps, batch_dir), archive in zip(found, zipped):
+        test_entry_key = Database.test_entry_key(fps, tv, '')
+        try:
+            if isinstance(archive, BaseException):
+                raise archive
+            m = locate_source_content(tv, fps)
+            db.add_entry(tv, m, batch_dir.name)
+        except BaseException as e:
+            logging.warning(f'{test_entry_key} : {e}')
+
     if database is not None:
         db.save(database)
 
 
+@cli.group()
+def db():
+    """
+    Manage test content databases. A database whose name ends with .sqlite or .db is stored with sqlite, \
+    and can be used in place of a json database by all commands.
+    """
+    pass
+
+
+@db.command('import')
+@click.argument('json_database', type=click.Path(exists=True, dir_okay=False))
+@click.argument('database')
+def db_import(json_database, database):
+    """
+    Replace the content of DATABASE with JSON_DATABASE.
+    """
+    target = open_database(database)
+    target.load(json_database)
+    target.save(database)
+
+
+@db.command('export')
+@click.argument('database', type=click.Path(exists=True, dir_okay=False))
+@click.argument('json_database')
+def db_export(database, json_database):
+    """
+    Write DATABASE as a json database to JSON_DATABASE, eg. for publication.
+    """
+    open_database(database, create=False).save(json_database)
+
+
+@db.command('merge')
+@click.argument('database')
+@click.argument('patches', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('-q', '--quiet', is_flag=True, default=False, help='only print the summary')
+def db_merge(database, patches, quiet):
+    """
+    Merge the PATCHES databases into DATABASE in one pass, only keeping the most recent batch of each test vector.
+    Prints the entries added, replaced, or dropped as deprecated by a more recent batch.
+    """
+    target = open_database(database)
+    report = target.merge(*[open_database(patch, create=False) for patch in patches])
+    if not quiet:
+        for status in ('added', 'replaced', 'dropped'):
+            for root_key, test_entry_key in getattr(report, status):
+                click.echo(f'{status}: {root_key} {test_entry_key}')
+    click.echo(f'{len(patches)} patches: {len(report.added)} added, {len(report.replaced)} replaced, '
+               f'{len(report.unchanged)} unchanged, {len(report.dropped)} dropped')
+    target.save(database)
+
+
+@db.command('diff')
+@click.argument('old_database', type=click.Path(exists=True, dir_okay=False))
+@click.argument('new_database', type=click.Path(exists=True, dir_okay=False))
+@click.option('-o', '--output', default=None, help='patch database to write the added and changed entries to, replacing it if it exists')
+@click.option('-q', '--quiet', is_flag=True, default=False, help='only print the summary')
+def db_diff(old_database, new_database, output, quiet):
+    """
+    Compare the most recent batch of each test vector in OLD_DATABASE and NEW_DATABASE.
+    A test vector changed when its batch, mpdPath, zipPath or representations differ.
+    Prints the test vectors added, removed, or changed.
+
+    The patch database can be given to upload, download or jccp-validation to only process what changed.
+    """
+    diff = diff_databases(open_database(old_database, create=False), open_database(new_database, create=False))
+    if not quiet:
+        for status in ('added', 'removed', 'changed'):
+            for root_key, test_entry_key in getattr(diff, status):
+                click.echo(f'{status}: {root_key} {test_entry_key}')
+    click.echo(f'{len(diff.added)} added, {len(diff.removed)} removed, {len(diff.changed)} changed')
+    if output is not None:
+        Path(output).unlink(missing_ok=True)
+        patch = open_database(output)
+        patch.replace(diff.patch.data)
+        patch.save(output)
+
+
 ###############################################################
 # SWITCHING SETS
 ###############################################################
 
-def extract_representation_ids(xml_file):
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
-    ns = {"mpd": "urn:mpeg:dash:schema:mpd:2011"}
-    representation_elements = root.findall(".//mpd:Representation", ns)
-    ids = [rep.get("id") for rep in representation_elements if rep.get("id") is not None]
-    return ids
-
 @cli.command()
 @click.pass_context
 @click.argument('mpd')
 @click.argument('vectors-dir')
 @click.option('-b', '--batch-dir', default=None, help='if unspecified, %Y-%m-%d will be used.')
 @click.option('--overwrite', is_flag=True, default=False, help='overwrite output directory.')
-@click.option('-t', '--tmp-dir', default=None, help='if unspecified, VECTORS_DIR/tmp will be used.')
-def archive_switching_set(ctx, mpd, vectors_dir, batch_dir, overwrite, tmp_dir):
+@click.option('-j', '--jobs', default=4, help='maximum number of switching sets archived concurrently when MPD is a directory. default: 4')
+def archive_switching_set(ctx, mpd, vectors_dir, batch_dir, overwrite, jobs):
     """
     Look up all representations from MPD switching set in VECTORS_DIR, \
         creates an archive containing the .mpd manifest and all representations, \
         and copy the result to VECTORS_DIR. Currently, the entry has to be added manually to the database.\n
-    MPD             filename must be formated as: '$profile_$fpsFamily_$ssN_stream.mpd'\n
+    MPD             filename must be formated as: '$profile_$fpsFamily_$ssN_stream.mpd', \
+        or a directory such as ./switching_sets, to archive all the '*_stream.mpd' it contains\n
     VECTORS_DIR     directory must contain the represenations referenced by MPD
     """
-    parts = Path(mpd).name.split('_')
-    profile = parts[0]
-    fps = '_'.join(parts[1:4])
-    name = f'{parts[4]}_{profile}'
-    rep_ids = extract_representation_ids(mpd)
-    assert len(rep_ids) > 1, 'not a valid switching set playlist'
-
-    vectors_dir = Path(vectors_dir)
-
     if batch_dir is None:
         batch_dir = datetime.now().strftime("%Y-%m-%d")
+    mpds = sorted(Path(mpd).glob('*_stream.mpd')) if Path(mpd).is_dir() else [Path(mpd)]
 
-    ss_dir = Path("switching_sets") / fps / name / batch_dir
-    ss_out_dir = vectors_dir / ss_dir
-    # check for overwrite
-    if ss_out_dir.exists():
-        if overwrite:
-            shutil.rmtree(ss_out_dir)
+    failed = 0
+    for m, result in zip(mpds, archive_switching_sets(mpds, Path(vectors_dir), batch_dir, overwrite, jobs)):
+        if isinstance(result, BaseException):
+            failed += 1
+            click.echo(f'failed: {m} - {result}')
         else:
-            raise Exception(f"Directory already exists: {ss_out_dir}")
-    
-    click.echo(f"Creating output directory: {ss_out_dir}")
-    Path.mkdir(ss_out_dir, exist_ok=False, parents=True)
-
-    if tmp_dir is None:
-        tmp_dir = Path(vectors_dir) / 'tmp' / name 
-    else:
-        tmp_dir = Path(tmp_dir) / name
-
-    if tmp_dir.exists():
-        click.echo(f"Creating tmp directory: {tmp_dir}")
-        shutil.rmtree(tmp_dir)
-
-    click.echo(f"Copying mpd to tmp dir")
-    Path.mkdir(tmp_dir / ss_dir, exist_ok=False, parents=True)
-    shutil.copy(mpd, tmp_dir / ss_dir / 'stream.mpd')
-
-    for rep_id in rep_ids:
-        rep_path = Path(rep_id.replace("../", ""))
-        src_path = vectors_dir / rep_path
-        dst_path = tmp_dir / rep_path
-        click.echo(f"Copying representation to tmp dir: {rep_path}")
-        shutil.copytree(src_path, dst_path)
-
-    click.echo(f"Creating archive: {tmp_dir}.zip")
-    shutil.make_archive(tmp_dir, 'zip', tmp_dir.parent, name)
-
-    click.echo(f"Copying to output directory")
-    shutil.copy(mpd, ss_out_dir / 'stream.mpd')
-    shutil.copy(tmp_dir.with_suffix('.zip'),  ss_out_dir / f'{name}.zip')
-    
-    if tmp_dir.exists():
-        click.echo(f"Removing tmp directory")
-        shutil.rmtree(tmp_dir)
+            click.echo(f'archived: {m} -> {result}')
+    if failed:
+        ctx.exit(1)
 
 
 ###############################################################
@@ -214,7 +678,7 @@ def archive_switching_set(ctx, mpd, vectors_dir, batch_dir, overwrite, tmp_dir):
 
 @cli.command()
 @click.pass_context
-@click.argument('database')
+@click.argument('database', type=click.Path(exists=True, dir_okay=False))
 @click.option('-j', '--jccp', default=JCCP_STAGING, help="DASH-IF's Joint Content Conformance Project. Can be one of: 1) API endpoint URI to call JCCP. 2) Docker container ID to execute JCCP on command line.")
 @click.option('-v', '--vectors-dir', default=None, help="overide the location of test vector's mpdPath")
 @click.option('-r', '--results-dir', default=None, help='optional directory to store the results')
@@ -281,7 +745,7 @@ def upload_db(sftp, db, content_dir, dry_run):
 
 @cli.command()
 @click.pass_context
-@click.argument('database')
+@click.argument('database', type=click.Path(exists=True, dir_okay=False))
 @click.option('-v', '--vectors-dir', default='output', help='path to the local directory containing the test vectors to be uploaded.')
 @click.option('--dry-run/--no-dry-run', default=False)
 def upload(ctx, database, vectors_dir, dry_run):
@@ -291,9 +755,7 @@ def upload(ctx, database, vectors_dir, dry_run):
     The key is expected to be stored as a file, with its absolute path exported to the environment variable `CDN_PRIVATE_KEY`.
     """
 
-    db = {}
-    with open(database, 'r') as fo:
-        db = json.load(fo)
+    db = open_database(database, create=False).data
 
     host = "dashstorage.upload.akamai.com"
     username = "sshacs"
@@ -329,15 +791,14 @@ def download_file(url, dst):
 
 @cli.command()
 @click.pass_context
-@click.argument('database')
+@click.argument('database', type=click.Path(exists=True, dir_okay=False))
 @click.option('-v', '--vectors-dir', default='output', help='directory where vectors will be downloaded. default: ./output')
 @click.option('-c', '--config', default=None, help='a csv config file normaly used for content geeration')
 def download(ctx, database, vectors_dir, config):
     """
     Download content listed in DATABASE into the specified directory, optionaly processing only vectors listed in a config file
     """
-    db = Database()
-    db.load(database)
+    db = open_database(database, create=False)
     if config is None:
         for k, v in db.iter_entries():
             zipPath = download_file(v["zipPath"], vectors_dir)
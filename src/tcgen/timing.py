@@ -0,0 +1,99 @@
+import time
+import sqlite3
+from pathlib import Path
+from dataclasses import dataclass
+
+from tcgen.models import TestContent, FPS_FAMILY, PROFILES_TYPE
+from tcgen.cache import tree_size
+
+TIMINGS_DB = Path('.tcgen') / 'timings.sqlite'
+
+# most recent runs considered when estimating a job duration
+HISTORY_DEPTH = 5
+
+# wall time per unit of scheduler.estimate_cost, until the timing store knows better
+DEFAULT_SECONDS_PER_COST = 1e-8
+
+
+@dataclass
+class TimingInfo:
+    key: tuple
+    # relative cost, see scheduler.estimate_cost
+    cost: float = 0
+
+
+def timing_key(stage:str, tc:TestContent, fps_family:FPS_FAMILY) -> tuple:
+    """
+    jobs sharing a timing key are expected to take about the same time: stage, profile, resolution, fps and codec.
+    """
+    _, codec, _ = PROFILES_TYPE[tc.cmaf_media_profile]
+    return (stage, tc.cmaf_media_profile.value, str(tc.resolution), str(tc.get_fps(fps_family)), codec)
+
+
+def output_size(output) -> int:
+    """
+    size of a job output: the whole test vector when output is its mpd.
+    """
+    if not isinstance(output, Path) or not output.exists():
+        return None
+    if output.suffix == '.mpd':
+        return tree_size(output.parent)
+    return output.stat().st_size
+
+
+def expected_duration(timings:'TimingStore', info:TimingInfo) -> float:
+    if info is None:
+        return 0
+    if timings is None:
+        return info.cost * DEFAULT_SECONDS_PER_COST
+    return timings.estimate(info.key, info.cost)
+
+
+class TimingStore:
+    """
+    Local history of job durations, used to estimate how long jobs of a new batch will take.
+    """
+
+    def __init__(self, path:Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(self.path)
+        self.con.execute('''CREATE TABLE IF NOT EXISTS timings (
+            stage TEXT, profile TEXT, resolution TEXT, fps TEXT, codec TEXT,
+            wall REAL, cpu REAL, size INTEGER, cost REAL, recorded_at REAL
+        )''')
+        self.con.execute('CREATE INDEX IF NOT EXISTS timings_key ON timings (stage, profile, resolution, fps, codec)')
+        self.con.commit()
+
+    @classmethod
+    def in_vectors_dir(cls, vectors_dir:Path) -> 'TimingStore':
+        return cls(Path(vectors_dir) / TIMINGS_DB)
+
+    def record(self, key:tuple, wall:float, cpu:float, size:int=None, cost:float=None):
+        self.con.execute('INSERT INTO timings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (*key, wall, cpu, size, cost, time.time()))
+        self.con.commit()
+
+    def history(self, key:tuple) -> list[float]:
+        rows = self.con.execute('''SELECT wall FROM timings WHERE stage = ? AND profile = ? AND resolution = ? AND fps = ? AND codec = ?
+            ORDER BY recorded_at DESC LIMIT ?''', (*key, HISTORY_DEPTH))
+        return [r[0] for r in rows]
+
+    def seconds_per_cost(self, stage:str) -> float:
+        """
+        observed wall time per unit of estimated cost, over all recorded jobs of a stage.
+        """
+        wall, cost = self.con.execute('SELECT SUM(wall), SUM(cost) FROM timings WHERE stage = ? AND cost > 0', (stage,)).fetchone()
+        return wall / cost if cost else None
+
+    def estimate(self, key:tuple, cost:float=0) -> float:
+        """
+        expected wall time of a job: mean of its most recent runs, or its estimated cost scaled by the stage throughput.
+        """
+        history = self.history(key)
+        if len(history):
+            return sum(history) / len(history)
+        ratio = self.seconds_per_cost(key[0])
+        return cost * (DEFAULT_SECONDS_PER_COST if ratio is None else ratio)
+
+    def close(self):
+        self.con.close()
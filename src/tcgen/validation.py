@@ -1,13 +1,15 @@
 import asyncio
 import socket
 import json
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 
 import aiohttp
 from aiohttp import web
 from tqdm.asyncio import tqdm_asyncio
 
-from tcgen.database import Database, PUBLIC_VECTORS_DIRECTORY
+from tcgen.database import open_database, PUBLIC_VECTORS_DIRECTORY
 
 DOCKER_EXE = "podman"
 JCCP_STAGING = "https://staging.conformance.dashif.org/"
@@ -17,8 +19,7 @@ def jccp_validation_report_location(db_entry):
     return Path(db_entry["mpdPath"][CDN_PREFIX_LEN:]).with_name('jccp-validation.json')
 
 def iter_jccp_validation_results(database, results_dir):
-    db = Database()
-    db.load(database)
+    db = open_database(database, create=False)
     for test_entry_key, db_entry in db.iter_entries():
         yield test_entry_key, Path(results_dir) / jccp_validation_report_location(db_entry)
 
@@ -39,6 +40,28 @@ async def start_content_server(content_dir, host, port):
     await site.start()
     return runner, site
 
+def content_server_url(port):
+    return f'http://{socket.gethostbyname(socket.gethostname())}:{port}/'
+
+@contextmanager
+def serve_content(content_dir, port, host='0.0.0.0'):
+    """
+    serve content_dir over http from a background thread while in the context, yields the url content is served at.
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        runner, _ = asyncio.run_coroutine_threadsafe(start_content_server(content_dir, host, port), loop).result()
+        try:
+            yield content_server_url(port)
+        finally:
+            asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
 ######################################################
 # Validation routines
 ######################################################
@@ -74,6 +97,7 @@ async def xhr_validate_stream(session, semaphore, jccp_xhr_endpoint, test_entry_
         uri = validation_request_uri(jccp_xhr_endpoint, test_vector_location(test_entry, vectors_hostname))
         try:
             async with session.get(uri) as response:
+                response.raise_for_status()
                 txt = await response.text()
                 res = json.loads(txt)
                 with open(Path(results_dir) / jccp_validation_report_location(test_entry), 'w') as fo:
@@ -104,10 +128,45 @@ async def cli_validate_stream(semaphore, jccp_container_id, test_entry_key, test
             return test_entry_key, stderr_data
 
 
+def validate_test_vector(test_entry_key, test_entry, jccp, vectors_hostname, results_dir):
+    """
+    validate a single test vector, for use outside of an event loop (eg. as a pipeline job).
+    """
+    async def validate():
+        semaphore = asyncio.Semaphore(1)
+        if jccp.startswith("http"):
+            async with aiohttp.ClientSession() as session:
+                return await xhr_validate_stream(session, semaphore, jccp, test_entry_key, test_entry, vectors_hostname, results_dir)
+        return await cli_validate_stream(semaphore, jccp, test_entry_key, test_entry, vectors_hostname, results_dir)
+
+    _, err = asyncio.run(validate())
+    if err:
+        raise Exception(f'validation failed: {err}')
+    report = Path(results_dir) / jccp_validation_report_location(test_entry)
+    with open(report) as fo:
+        verdict = validation_verdict(json.load(fo))
+    if verdict != "PASS":
+        raise Exception(f'validation verdict: {verdict}, see {report}')
+    return report
+
+
 ######################################################
 # Summary
 ######################################################
 
+def validation_verdict(report):
+    """
+    verdict of a jccp report: its own verdict when it has one, otherwise FAIL unless all of its entries PASS.
+    """
+    if "verdict" in report:
+        return report["verdict"]
+    entries = report.get("entries")
+    if not isinstance(entries, dict) or not entries:
+        return "FAIL"
+    if any(isinstance(v, dict) and v.get("verdict", "PASS") != "PASS" for v in entries.values()):
+        return "FAIL"
+    return "PASS"
+
 def get_validation_failures(test_result_file):
     
     def iter_test_failures(test):
@@ -184,8 +243,7 @@ async def validate_test_vectors_async(database, jccp, vectors_dir, results_dir,
     
     semaphore = asyncio.Semaphore(1)
     
-    db = Database()
-    db.load(database)
+    db = open_database(database, create=False)
     
     process_local_content = (vectors_dir is not None) and (not vectors_dir.startswith('http'))
     vectors_hostname = None 
@@ -196,7 +254,7 @@ async def validate_test_vectors_async(database, jccp, vectors_dir, results_dir,
     if process_local_content:
         assert Path(vectors_dir).exists(), f'--vectors-dir directory not found: {vectors_dir}'
         server, _ = await start_content_server(vectors_dir, '0.0.0.0', port)
-        vectors_hostname = f'http://{socket.gethostbyname(socket.gethostname())}:{port}/'
+        vectors_hostname = content_server_url(port)
         if results_dir is None:
             results_dir = vectors_dir
     else:
@@ -0,0 +1,44 @@
+import json
+import hashlib
+from pathlib import Path
+
+import pytest
+
+from tcgen.models import TestContent, Mezzanine, FPS_FAMILY
+
+REPO_DIR = Path(__file__).parent.parent
+CONFIG = REPO_DIR / 'profiles' / 'chh1.mezzanine_v4.csv'
+
+
+def write_mezzanine(root_dir:Path, m:Mezzanine, data:bytes=None) -> Path:
+    """
+    a stand-in mezzanine file and its annotations.
+    """
+    data = m.filename.encode() if data is None else data
+    mp4 = root_dir / m.filename
+    mp4.write_bytes(data)
+    annotations = {"md5": hashlib.md5(data).hexdigest(), "license": "license", "name": m.content, "version": 1, "creation_date": "2024-01-01",
+                   "properties": {"width": m.resolution.w, "height": m.resolution.h, "frame_rate": m.fps.to_number()}}
+    mp4.with_suffix('.json').write_text(json.dumps({"Mezzanine": annotations}))
+    return mp4
+
+
+def config_vector(test_id:str) -> TestContent:
+    return next(tc for tc in TestContent.iter_vectors_in_batch_config(CONFIG) if tc.test_id == test_id)
+
+
+@pytest.fixture
+def mezzanine_dir(tmp_path, monkeypatch) -> Path:
+    """
+    a mezzanine directory holding the source content of CONFIG, used to locate source content.
+    """
+    root_dir = tmp_path / 'mezzanine'
+    root_dir.mkdir()
+    for tc in TestContent.iter_vectors_in_batch_config(CONFIG):
+        for fps_family in FPS_FAMILY:
+            m = tc.get_mezzanine(fps_family)
+            if not (root_dir / m.filename).exists():
+                write_mezzanine(root_dir, m)
+    monkeypatch.setattr(Mezzanine, 'root_dir', root_dir)
+    monkeypatch.setattr(Mezzanine, 'index', None)
+    return root_dir
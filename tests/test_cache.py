@@ -0,0 +1,144 @@
+import os
+import json
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+
+import tcgen.encode
+from tcgen.cache import EncodeCache, StagingCache, ENTRY_MANIFEST
+from tcgen.encode import encode_cache_key
+
+
+def make_vector(d, mpd='<MPD/>'):
+    d.mkdir(parents=True, exist_ok=True)
+    (d / 'stream.mpd').write_text(mpd)
+    (d / '1').mkdir(exist_ok=True)
+    (d / '1' / 'init.mp4').write_bytes(b'init')
+    (d / '1' / '1.m4s').write_bytes(b'segment' * 100)
+    (d / 'progress.jsonl').write_text('{}\n')
+    return d
+
+
+def files(d) -> dict:
+    return {str(p.relative_to(d)): p.read_bytes() for p in sorted(d.rglob('*')) if p.is_file()}
+
+
+def set_last_used(cache:EncodeCache, key:str, last_used:float):
+    manifest = cache.entry_dir(key) / ENTRY_MANIFEST
+    entry = json.loads(manifest.read_text())
+    manifest.write_text(json.dumps({**entry, "last_used": last_used}))
+
+
+def test_store_lookup(tmp_path):
+    cache = EncodeCache(tmp_path / 'cache')
+    src = make_vector(tmp_path / 'src')
+    key = EncodeCache.key('md5', 'gpac -i $MEZZANINE', 'gpac 2.4')
+    assert not cache.contains(key)
+    assert not cache.materialize(key, tmp_path / 'missing')
+    cache.store(key, src, ignore=('progress.jsonl',))
+    assert cache.contains(key)
+
+    dst = tmp_path / 'dst'
+    assert cache.materialize(key, dst)
+    expected = files(src)
+    del expected['progress.jsonl']
+    assert files(dst) == expected
+    # media files are shared with the cache, the mpd is patched in place and copied
+    entry_dir = cache.lookup(key)
+    assert (dst / '1' / '1.m4s').stat().st_ino == (entry_dir / '1' / '1.m4s').stat().st_ino
+    assert (dst / 'stream.mpd').stat().st_ino != (entry_dir / 'stream.mpd').stat().st_ino
+    # materializing over an existing test vector replaces its files
+    (dst / 'stream.mpd').write_text('patched')
+    assert cache.materialize(key, dst)
+    assert files(dst) == expected
+
+
+def test_store_keeps_first_entry(tmp_path):
+    cache = EncodeCache(tmp_path / 'cache')
+    cache.store('k' * 64, make_vector(tmp_path / 'a', '<MPD id="a"/>'))
+    cache.store('k' * 64, make_vector(tmp_path / 'b', '<MPD id="b"/>'))
+    assert (cache.lookup('k' * 64) / 'stream.mpd').read_text() == '<MPD id="a"/>'
+    assert cache.stats()["entries"] == 1
+
+
+def test_encode_cache_key(monkeypatch):
+    monkeypatch.setattr(tcgen.encode, 'encode_command', lambda m, tc, input_file, output_file: f'gpac -i {input_file} {tc.options} -o {output_file}')
+    version = ['gpac 2.4']
+    monkeypatch.setattr(tcgen.encode, 'gpac_version', lambda executable: version[0])
+    m = SimpleNamespace(md5='0123')
+    tc = SimpleNamespace(options='crf=20')
+    key = encode_cache_key(m, tc)
+    assert key == encode_cache_key(SimpleNamespace(md5='0123'), SimpleNamespace(options='crf=20'))
+    assert key != encode_cache_key(SimpleNamespace(md5='4567'), tc)
+    assert key != encode_cache_key(m, SimpleNamespace(options='crf=21'))
+    assert key != encode_cache_key(m, tc, chunks=4)
+    assert encode_cache_key(m, tc, chunks=1) == key
+    version[0] = 'gpac 2.5'
+    assert key != encode_cache_key(m, tc)
+
+
+def test_stale_tmp_store_ignored(tmp_path):
+    cache = EncodeCache(tmp_path / 'cache')
+    key = EncodeCache.key('md5', 'gpac', 'gpac 2.4')
+    # a store interrupted before its rename
+    stale = cache.entry_dir(key).with_name(f'{key}.0123.tmp')
+    make_vector(stale)
+    (stale / ENTRY_MANIFEST).write_text(json.dumps({"key": key, "size": 1, "created": 0, "last_used": 0}))
+    assert not cache.contains(key)
+    assert cache.lookup(key) is None
+    assert cache.stats()["entries"] == 0
+    assert cache.prune(0) == []
+
+    cache.store(key, make_vector(tmp_path / 'src', '<MPD id="new"/>'))
+    assert cache.materialize(key, tmp_path / 'dst')
+    assert (tmp_path / 'dst' / 'stream.mpd').read_text() == '<MPD id="new"/>'
+
+
+def test_prune_least_recently_used_first(tmp_path):
+    cache = EncodeCache(tmp_path / 'cache', max_size=10**9)
+    src = make_vector(tmp_path / 'src')
+    keys = [EncodeCache.key(str(i)) for i in range(4)]
+    for key in keys:
+        cache.store(key, src)
+    size = cache.stats()["size"] // 4
+    for key, last_used in zip(keys, (30, 10, 40, 20)):
+        set_last_used(cache, key, last_used)
+
+    assert cache.prune() == []
+    assert cache.prune(2 * size) == [keys[1], keys[3]]
+    assert [cache.contains(k) for k in keys] == [True, False, True, False]
+    # a lookup makes an entry the most recently used one
+    cache.lookup(keys[0])
+    assert cache.prune(size) == [keys[2]]
+    assert cache.contains(keys[0])
+
+
+def test_prune_keeps_pinned_staged_mezzanines(tmp_path):
+    staging = StagingCache(tmp_path / 'staging')
+    mezzanine = tmp_path / 'mezzanine.mp4'
+    mezzanine.write_bytes(b'mezzanine')
+    with pytest.raises(Exception, match='corrupt'):
+        staging.stage('f' * 32, mezzanine, 'f' * 32, staging.process_token())
+    assert not staging.contains('f' * 32)
+
+    md5 = hashlib.md5(b'mezzanine').hexdigest()
+    staged = staging.stage(md5, mezzanine, md5, staging.process_token())
+    assert staged.read_bytes() == b'mezzanine'
+    assert staging.prune(0) == []
+    staging.unpin(md5, staging.process_token())
+    assert staging.prune(0) == [md5]
+    assert not staged.exists()
+
+
+def test_pins_of_terminated_processes(tmp_path):
+    staging = StagingCache(tmp_path / 'staging')
+    mezzanine = tmp_path / 'mezzanine.mp4'
+    mezzanine.write_bytes(b'mezzanine')
+    md5 = hashlib.md5(b'mezzanine').hexdigest()
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0)
+    os.waitpid(pid, 0)
+    staging.stage(md5, mezzanine, md5, str(pid))
+    assert staging.prune(0) == [md5]
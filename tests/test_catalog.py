@@ -0,0 +1,114 @@
+import os
+from pathlib import Path
+
+import pytest
+
+import tcgen.catalog
+from conftest import write_mezzanine
+from tcgen.catalog import MezzanineIndex
+from tcgen.models import Mezzanine
+
+FILENAMES = ('tos_L1_1920x1080@30_30.mp4', 'tos_L1_1920x1080@60_30.mp4', 'splice_main_L1_1920x1080@30_10.mp4')
+
+
+@pytest.fixture
+def root_dir(tmp_path) -> Path:
+    for filename in FILENAMES:
+        write_mezzanine(tmp_path, Mezzanine.from_filename(Path(filename)))
+    # not annotated, left out
+    (tmp_path / 'unannotated_L1_1920x1080@30_30.mp4').write_bytes(b'')
+    return tmp_path
+
+
+@pytest.fixture
+def hashed(monkeypatch) -> list:
+    hashed = []
+    file_md5 = tcgen.catalog.file_md5
+
+    def record(path):
+        hashed.append(Path(path).name)
+        return file_md5(path)
+
+    monkeypatch.setattr(tcgen.catalog, 'file_md5', record)
+    return hashed
+
+
+def touch(path:Path, data:bytes=None, mtime:float=None):
+    st = path.stat()
+    if data is not None:
+        path.write_bytes(data)
+    os.utime(path, (st.st_atime, st.st_mtime if mtime is None else mtime))
+
+
+def test_update_only_hashes_changes(root_dir, hashed):
+    index = MezzanineIndex(root_dir)
+    assert sorted(index.update()) == sorted(FILENAMES)
+    assert sorted(hashed) == sorted(FILENAMES)
+    assert index.corrupt() == []
+    index.save()
+
+    hashed.clear()
+    index = MezzanineIndex.load(root_dir)
+    assert index.update() == [] and hashed == []
+
+    tos30, tos60, splice = (root_dir / f for f in FILENAMES)
+    # size changed
+    touch(tos30, b're-encoded')
+    # mtime changed
+    touch(tos60, mtime=tos60.stat().st_mtime + 10)
+    # neither: not rehashed
+    touch(splice, bytes(reversed(splice.read_bytes())))
+    assert sorted(index.update()) == sorted([tos30.name, tos60.name])
+    assert index.corrupt() == [tos30.name]
+    assert sorted(index.update(force=True)) == sorted(FILENAMES)
+    assert sorted(index.corrupt()) == sorted([tos30.name, splice.name])
+
+
+def test_removed_mezzanines(root_dir):
+    index = MezzanineIndex(root_dir)
+    index.update()
+    (root_dir / FILENAMES[0]).unlink()
+    assert index.update() == []
+    assert sorted(index.filenames()) == sorted(FILENAMES[1:])
+
+
+def test_load_missing_index(tmp_path):
+    assert MezzanineIndex.load(tmp_path) is None
+
+
+def test_check(root_dir):
+    index = MezzanineIndex(root_dir)
+    index.update()
+    index.refresh()
+    tos30, tos60, splice = FILENAMES
+    index.check(tos30)
+
+    # md5 mismatch
+    touch(root_dir / tos30, b'corrupt')
+    index.update()
+    with pytest.raises(Exception, match='is corrupt'):
+        index.check(tos30)
+
+    # modified since it was indexed
+    touch(root_dir / tos60, mtime=(root_dir / tos60).stat().st_mtime + 10)
+    (root_dir / splice).unlink()
+    index.refresh()
+    with pytest.raises(Exception, match='changed since it was indexed'):
+        index.check(tos60)
+    with pytest.raises(Exception, match='changed since it was indexed'):
+        index.check(splice)
+
+
+def test_resolve(root_dir):
+    index = MezzanineIndex(root_dir)
+    index.update()
+    assert index.resolve('tos_L1_1920x1080@30_30.mp4') == 'tos_L1_1920x1080@30_30.mp4'
+    assert index.resolve('tos_L1_1920x1080@25_30.mp4') is None
+    # splice content: the duration is found from the indexed mezzanines
+    assert index.resolve('splice_main_L1_1920x1080@30_-1.mp4') == 'splice_main_L1_1920x1080@30_10.mp4'
+    assert index.resolve('splice_main_L1_1920x1080@60_-1.mp4') is None
+    # ambiguous
+    write_mezzanine(root_dir, Mezzanine.from_filename(Path('splice_main_L1_1920x1080@30_20.mp4')))
+    index.update()
+    assert index.resolve('splice_main_L1_1920x1080@30_-1.mp4') is None
+    assert index.resolve('tos_L1_1920x1080@30_-1.mp4') == 'tos_L1_1920x1080@30_30.mp4'
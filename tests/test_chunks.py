@@ -0,0 +1,120 @@
+import sys
+from fractions import Fraction
+from types import SimpleNamespace
+
+import pytest
+
+import tcgen.encode
+from tcgen.encode import chunk_ranges, chunk_dir, join_chunks, ELEMENTARY_STREAM, CHUNKS_DIR
+from tcgen.run_encode import Representation, format_gpac_command
+
+
+def source(duration, seg_dur):
+    m = SimpleNamespace(duration=duration)
+    tc = SimpleNamespace(get_seg_dur=lambda m: Fraction(seg_dur))
+    return m, tc
+
+
+@pytest.mark.parametrize('duration, seg_dur, chunks, expected', [
+    (30, 2, 4, [(0, 8), (8, 16), (16, 24), (24, None)]),
+    # 15 segments: the last chunk is shorter
+    (30, 2, 2, [(0, 16), (16, None)]),
+    # the duration isn't a whole number of segments
+    (29.5, 2, 4, [(0, 8), (8, 16), (16, 24), (24, None)]),
+    (7, 2, 4, [(0, 2), (2, 4), (4, 6), (6, None)]),
+    # fewer segments than chunks
+    (3, 2, 8, [(0, 2), (2, None)]),
+    # 10 segments in 4 chunks of 3: only 4 chunks, the last one a single segment
+    (20, 2, 4, [(0, 6), (6, 12), (12, 18), (18, None)]),
+    # 10 segments in 6 chunks of 2: 5 chunks
+    (20, 2, 6, [(0, 4), (4, 8), (8, 12), (12, 16), (16, None)]),
+    (30, 2, 1, [(0, None)]),
+    (30, 2, 0, [(0, None)])
+])
+def test_chunk_ranges(duration, seg_dur, chunks, expected):
+    assert chunk_ranges(*source(duration, seg_dur), chunks) == expected
+
+
+@pytest.mark.parametrize('duration', ['30', '29.97', '60.06', '10'])
+@pytest.mark.parametrize('chunks', [2, 3, 7, 16])
+def test_chunk_ranges_ntsc(duration, chunks):
+    seg_dur = Fraction(2) * Fraction(1001, 1000)
+    ranges = chunk_ranges(*source(duration, seg_dur), chunks)
+    assert 1 <= len(ranges) <= chunks
+    assert ranges[0][0] == 0 and ranges[-1][1] is None
+    for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+        # contiguous, whole segments, within the mezzanine
+        assert end == next_start
+        assert (end / seg_dur).denominator == 1
+        assert end < Fraction(duration)
+
+
+def representation(time_range=None, raw_input=False) -> Representation:
+    return Representation('1', 'mezzanine.mp4', 'video', 'h265', 6000, 'chh1', resolution='1920x1080', frame_rate='25',
+                          segment_duration=2, time_range=time_range, raw_input=raw_input)
+
+
+def test_reframer_time_range():
+    _, command = representation((Fraction(8), Fraction(16))).format_command(0, 'encode')
+    assert command.startswith('reframer:xs=8:xe=16:xround=seek:SID=GEN1:FID=RNG1 ')
+    # the scaler reads the reframer output
+    assert ':SID=RNG1 @ ' in command
+    assert command.endswith(':FID=V0')
+
+
+def test_reframer_last_chunk():
+    _, command = representation((Fraction(24), None)).format_command(0, 'encode')
+    assert command.startswith('reframer:xs=24:xround=seek:SID=GEN1:FID=RNG1 ')
+    assert 'xe=' not in command
+
+
+def test_reframer_ntsc_boundaries():
+    _, command = representation((Fraction(8008, 1000), Fraction(16016, 1000))).format_command(0, 'encode')
+    assert command.startswith('reframer:xs=1001/125:xe=2002/125:xround=seek:')
+
+
+def test_reframer_raw_input():
+    _, command = representation((Fraction(8), None), raw_input=True).format_command(0, 'encode')
+    assert command.startswith('reframer:xs=8:xround=seek:SID=GEN1:FID=RNG1 ')
+    assert 'SID=RNG1' in command.split(' ', 1)[1]
+
+
+def test_without_time_range():
+    _, command = representation().format_command(0, 'encode')
+    assert 'reframer' not in command
+    assert ':SID=GEN1 @ ' in command
+
+
+def test_chunk_command():
+    command = format_gpac_command('gpac', [representation((Fraction(8), Fraction(16)))], None, 'chunks/001/es.mp4', 'encode')
+    assert 'reframer:xs=8:xe=16' in command
+    assert command.endswith('-o chunks/001/es.mp4:SID=V0')
+
+
+def test_join_chunks_dry_run(tmp_path, capsys):
+    es_dir = tmp_path / 'es'
+    assert join_chunks(es_dir, 3, dry_run=True) == es_dir / ELEMENTARY_STREAM
+    srcs = ','.join(str(es_dir / CHUNKS_DIR / f'00{i}' / ELEMENTARY_STREAM) for i in range(3))
+    assert f'{tcgen.encode.GPAC_EXECUTABLE} -strict-error flist:srcs={srcs} -o {es_dir / ELEMENTARY_STREAM}' in capsys.readouterr().out
+
+
+def test_join_chunks(tmp_path, monkeypatch):
+    # concatenates the flist sources in order
+    fake_gpac = tmp_path / 'gpac'
+    fake_gpac.write_text(f'''#!{sys.executable}
+import sys
+srcs = sys.argv[2].split('=', 1)[1].split(',')
+with open(sys.argv[4], 'wb') as fo:
+    for src in srcs:
+        fo.write(open(src, 'rb').read())
+''')
+    fake_gpac.chmod(0o755)
+    monkeypatch.setattr(tcgen.encode, 'GPAC_EXECUTABLE', str(fake_gpac))
+    es_dir = tmp_path / 'es'
+    for i in range(12):
+        chunk_dir(es_dir, i).mkdir(parents=True)
+        (chunk_dir(es_dir, i) / ELEMENTARY_STREAM).write_bytes(f'[{i}]'.encode())
+    es_file = join_chunks(es_dir, 12)
+    assert es_file.read_bytes() == b''.join(f'[{i}]'.encode() for i in range(12))
+    assert not (es_dir / CHUNKS_DIR).exists()
+    assert 'flist:srcs=' in (es_dir / 'log.txt').read_text()
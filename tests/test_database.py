@@ -0,0 +1,189 @@
+import copy
+import json
+import random
+
+import pytest
+
+from tcgen.database import Database, SqliteDatabase, MergeReport, open_database, diff_databases
+
+BACKENDS = ('json', 'sqlite')
+
+
+@pytest.fixture(params=BACKENDS)
+def make_database(request, tmp_path):
+    databases = []
+
+    def make(data:dict) -> Database:
+        if request.param == 'json':
+            return Database(copy.deepcopy(data))
+        path = tmp_path / f'{len(databases)}.sqlite'
+        (tmp_path / 'data.json').write_text(json.dumps(data))
+        db = SqliteDatabase(path)
+        db.load(tmp_path / 'data.json')
+        databases.append(db)
+        return db
+
+    yield make
+    for db in databases:
+        db.close()
+
+
+def key(test_id:str, batch:str, fps='15_30_60') -> str:
+    return f'chh1_sets/{fps}/{test_id}/{batch}/'
+
+
+def entry(value) -> dict:
+    return {'mpdPath': f'https://cdn/{value}/stream.mpd'}
+
+
+def sorted_report(report:MergeReport) -> dict:
+    return {status: sorted(getattr(report, status)) for status in ('added', 'replaced', 'unchanged', 'dropped')}
+
+
+def test_merge_adds_new_vectors(make_database):
+    db = make_database({'CHH1': {key('t1', '2024-01-01'): entry(1)}})
+    report = db.merge(Database({'CHH1': {key('t2', '2024-01-01'): entry(2)}, 'CENC': {key('t1-cenc', '2024-01-01'): entry(3)}}))
+    assert report == MergeReport(added=[('CHH1', key('t2', '2024-01-01')), ('CENC', key('t1-cenc', '2024-01-01'))])
+    assert db.data == {'CHH1': {key('t1', '2024-01-01'): entry(1), key('t2', '2024-01-01'): entry(2)},
+                       'CENC': {key('t1-cenc', '2024-01-01'): entry(3)}}
+
+
+def test_merge_drops_deprecated_batch(make_database):
+    db = make_database({'CHH1': {key('t1', '2024-01-01'): entry(1)}})
+    report = db.merge(Database({'CHH1': {key('t1', '2024-02-01'): entry(2)}}))
+    assert report == MergeReport(added=[('CHH1', key('t1', '2024-02-01'))], dropped=[('CHH1', key('t1', '2024-01-01'))])
+    assert db.data == {'CHH1': {key('t1', '2024-02-01'): entry(2)}}
+
+
+def test_merge_drops_older_patch_entry(make_database):
+    db = make_database({'CHH1': {key('t1', '2024-02-01'): entry(1)}})
+    report = db.merge(Database({'CHH1': {key('t1', '2024-01-01'): entry(2)}}))
+    assert report == MergeReport(dropped=[('CHH1', key('t1', '2024-01-01'))])
+    assert db.data == {'CHH1': {key('t1', '2024-02-01'): entry(1)}}
+
+
+def test_merge_replaced_and_unchanged(make_database):
+    db = make_database({'CHH1': {key('t1', '2024-01-01'): entry(1), key('t2', '2024-01-01'): entry(2)}})
+    report = db.merge(Database({'CHH1': {key('t1', '2024-01-01'): entry(1), key('t2', '2024-01-01'): entry(3)}}))
+    assert report == MergeReport(replaced=[('CHH1', key('t2', '2024-01-01'))], unchanged=[('CHH1', key('t1', '2024-01-01'))])
+    assert db.data == {'CHH1': {key('t1', '2024-01-01'): entry(1), key('t2', '2024-01-01'): entry(3)}}
+
+
+def test_merge_across_patches(make_database):
+    db = make_database({'CHH1': {key('t1', '2024-01-01'): entry(1), key('t2', '2024-01-01'): entry(2), key('t3', '2024-01-01'): entry(3)}})
+    report = db.merge(
+        # t1: a newer batch, itself deprecated by the next patch. t2: changed, then changed back. t3: unchanged, then changed.
+        Database({'CHH1': {key('t1', '2024-02-01'): entry(4), key('t2', '2024-01-01'): entry(5), key('t3', '2024-01-01'): entry(3)}}),
+        Database({'CHH1': {key('t1', '2024-03-01'): entry(6), key('t2', '2024-01-01'): entry(2), key('t3', '2024-01-01'): entry(7)}}),
+        # an older batch, after the patches deprecating it
+        Database({'CHH1': {key('t1', '2024-02-01'): entry(8)}})
+    )
+    assert sorted_report(report) == {
+        'added': [('CHH1', key('t1', '2024-03-01'))],
+        'replaced': [('CHH1', key('t3', '2024-01-01'))],
+        'unchanged': [('CHH1', key('t2', '2024-01-01'))],
+        'dropped': [('CHH1', key('t1', '2024-01-01')), ('CHH1', key('t1', '2024-02-01'))]
+    }
+    assert db.data == {'CHH1': {key('t2', '2024-01-01'): entry(2), key('t3', '2024-01-01'): entry(7), key('t1', '2024-03-01'): entry(6)}}
+
+
+def test_merge_only_cleans_patched_roots(make_database):
+    duplicates = {key('t1', '2024-01-01'): entry(1), key('t1', '2024-02-01'): entry(2)}
+    db = make_database({'CHH1': dict(duplicates), 'CENC': dict(duplicates), 'CUD1': dict(duplicates)})
+    report = db.merge(Database({'CHH1': {key('t2', '2024-01-01'): entry(3)}, 'CENC': {}}))
+    assert sorted_report(report) == {
+        'added': [('CHH1', key('t2', '2024-01-01'))],
+        'replaced': [],
+        'unchanged': [],
+        'dropped': [('CENC', key('t1', '2024-01-01')), ('CHH1', key('t1', '2024-01-01'))]
+    }
+    assert db.data['CUD1'] == duplicates
+    assert db.data['CENC'] == {key('t1', '2024-02-01'): entry(2)}
+
+
+def test_merge_keys_without_batch(make_database):
+    db = make_database({'CHH1': {'chh1_sets/readme': entry(1)}})
+    report = db.merge(Database({'CHH1': {'chh1_sets/readme': entry(2), 'chh1_sets/notes': entry(3)}}))
+    assert report == MergeReport(added=[('CHH1', 'chh1_sets/notes')], replaced=[('CHH1', 'chh1_sets/readme')])
+
+
+def test_merge_twice(make_database):
+    db = make_database({'CHH1': {key('t1', '2024-01-01'): entry(1)}})
+    db.merge(Database({'CHH1': {key('t1', '2024-02-01'): entry(2)}}))
+    report = db.merge(Database({'CHH1': {key('t1', '2024-01-15'): entry(3), key('t1', '2024-03-01'): entry(4)}}))
+    assert sorted_report(report) == {
+        'added': [('CHH1', key('t1', '2024-03-01'))],
+        'replaced': [],
+        'unchanged': [],
+        'dropped': [('CHH1', key('t1', '2024-01-15')), ('CHH1', key('t1', '2024-02-01'))]
+    }
+    assert db.data == {'CHH1': {key('t1', '2024-03-01'): entry(4)}}
+
+
+def reference_merge(data:dict, patches:list[dict]) -> dict:
+    """
+    merge one patch at a time, sorting the batches of each test vector.
+    """
+    for patch in patches:
+        for root_key, table in patch.items():
+            data.setdefault(root_key, {}).update(table)
+            batches = {}
+            for k in data[root_key]:
+                *vector, batch = k.rstrip('/').split('/')
+                batches.setdefault('/'.join(vector), []).append((batch, k))
+            latest = {sorted(b)[-1][1] for b in batches.values()}
+            data[root_key] = {k: v for k, v in data[root_key].items() if k in latest}
+    return data
+
+
+def random_database(rnd:random.Random, size:int) -> dict:
+    data = {}
+    for _ in range(size):
+        root_key = rnd.choice(['CHH1', 'CENC', 'CUD1'])
+        k = key(f't{rnd.randint(1, 5)}', f'2024-02-0{rnd.randint(1, 6)}', rnd.choice(['15_30_60', '12.5_25_50']))
+        data.setdefault(root_key, {})[k] = entry(rnd.randint(1, 3))
+    return data
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_merge_matches_reference(make_database, seed):
+    rnd = random.Random(seed)
+    base = random_database(rnd, rnd.randint(0, 20))
+    patches = [random_database(rnd, rnd.randint(0, 8)) for _ in range(rnd.randint(1, 4))]
+    expected = reference_merge(copy.deepcopy(base), patches)
+    db = make_database(base)
+    report = db.merge(*[Database(p) for p in patches])
+
+    def entries(data):
+        return {(root_key, k): v for root_key, table in data.items() for k, v in table.items()}
+
+    merged = entries(db.data)
+    assert merged == entries(expected)
+    before = entries(base)
+    touched = {(root_key, k) for p in patches for root_key, table in p.items() for k in table}
+    assert sorted(report.added) == sorted(k for k in merged.keys() - before.keys())
+    assert sorted(report.replaced) == sorted(k for k in merged.keys() & before.keys() if merged[k] != before[k])
+    assert sorted(report.unchanged) == sorted(k for k in merged.keys() & touched if before.get(k) == merged[k])
+    assert sorted(report.dropped) == sorted((before.keys() | touched) - merged.keys())
+
+
+def test_open_missing_database(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        open_database(tmp_path / 'missing.sqlite', create=False)
+    assert not (tmp_path / 'missing.sqlite').exists()
+    with pytest.raises(FileNotFoundError):
+        open_database(tmp_path / 'missing.json', create=False)
+
+
+def test_diff(make_database):
+    old = make_database({'CHH1': {key('t1', '2024-01-01'): entry(1), key('t2', '2024-01-01'): entry(2),
+                                  key('t3', '2024-01-01'): entry(3), key('t4', '2024-01-01'): entry(4)}})
+    new = make_database({'CHH1': {key('t2', '2024-02-01'): entry(2), key('t3', '2024-01-01'): {**entry(5), 'source': 'x'},
+                                  key('t4', '2024-01-01'): {**entry(4), 'source': 'x'}, key('t5', '2024-01-01'): entry(6)}})
+    diff = diff_databases(old, new)
+    assert diff.added == [('CHH1', key('t5', '2024-01-01'))]
+    assert diff.removed == [('CHH1', key('t1', '2024-01-01'))]
+    # t4 only differs by a field diff_databases ignores
+    assert diff.changed == [('CHH1', key('t2', '2024-02-01')), ('CHH1', key('t3', '2024-01-01'))]
+    assert diff.patch.data == {'CHH1': {key('t2', '2024-02-01'): entry(2), key('t3', '2024-01-01'): {**entry(5), 'source': 'x'},
+                                        key('t5', '2024-01-01'): entry(6)}}
@@ -0,0 +1,136 @@
+import json
+import shutil
+
+import pytest
+
+from conftest import REPO_DIR, CONFIG, config_vector
+from tcgen.batch import plan_encode_jobs
+from tcgen.database import Database
+from tcgen.encode import encode_test_vector
+from tcgen.journal import Journal, atomic_dir, partial_dir, ENCODE, PATCH
+from tcgen.models import FPS_FAMILY
+
+BATCH_DIR = '2024-01-01'
+
+
+def test_record_completed(tmp_path):
+    journal = Journal.for_batch(tmp_path, BATCH_DIR)
+    assert journal.completed() == set()
+    journal.record('a', ENCODE)
+    journal.record('a', PATCH)
+    journal.record('b', ENCODE)
+    assert journal.is_done('a', PATCH)
+    reloaded = Journal.for_batch(tmp_path, BATCH_DIR)
+    assert reloaded.completed() == {('a', ENCODE), ('a', PATCH), ('b', ENCODE)}
+    assert reloaded.is_done('b', ENCODE) and not reloaded.is_done('b', PATCH)
+    reloaded.reset()
+    assert reloaded.completed() == set()
+    assert Journal.for_batch(tmp_path, BATCH_DIR).completed() == set()
+
+
+def test_parsed_once(tmp_path):
+    journal = Journal(tmp_path / 'journal.jsonl')
+    journal.record('a', ENCODE)
+    assert journal.is_done('a', ENCODE)
+    # recorded by another process
+    Journal(tmp_path / 'journal.jsonl').record('b', ENCODE)
+    journal.path.unlink()
+    assert journal.is_done('a', ENCODE) and not journal.is_done('b', ENCODE)
+
+
+def test_for_keys(tmp_path):
+    journal = Journal(tmp_path / 'journal.jsonl')
+    for key in ('a', 'b', 'c'):
+        journal.record(key, ENCODE)
+    view = journal.for_keys('a', 'c', None)
+    assert view.steps == {'a': {ENCODE}, 'c': {ENCODE}}
+    view.record('a', PATCH)
+    assert view.is_done('a', PATCH) and not journal.is_done('a', PATCH)
+    assert Journal(journal.path).completed() == {('a', ENCODE), ('b', ENCODE), ('c', ENCODE), ('a', PATCH)}
+
+
+def test_truncated_last_line(tmp_path):
+    journal = Journal(tmp_path / 'journal.jsonl')
+    journal.record('a', ENCODE)
+    with open(journal.path, 'a') as fo:
+        # interrupted by a crash
+        fo.write(json.dumps({"key": "b", "step": ENCODE})[:20])
+    resumed = Journal(journal.path)
+    assert resumed.completed() == {('a', ENCODE)}
+    resumed.record('c', ENCODE)
+    assert Journal(journal.path).completed() == {('a', ENCODE), ('c', ENCODE)}
+
+
+def test_atomic_dir(tmp_path):
+    d = tmp_path / 'vector'
+    d.mkdir()
+    (d / 'stream.mpd').write_text('previous')
+    with pytest.raises(RuntimeError):
+        with atomic_dir(d) as work_dir:
+            (work_dir / 'stream.mpd').write_text('failed')
+            raise RuntimeError('encode failed')
+    # left for inspection, d untouched
+    assert (partial_dir(d) / 'stream.mpd').read_text() == 'failed'
+    assert (d / 'stream.mpd').read_text() == 'previous'
+
+    with atomic_dir(d) as work_dir:
+        # the stale partial directory was discarded
+        assert work_dir == partial_dir(d) and [*work_dir.iterdir()] == []
+        (work_dir / 'stream.mpd').write_text('new')
+    assert [p.name for p in d.iterdir()] == ['stream.mpd']
+    assert (d / 'stream.mpd').read_text() == 'new'
+    assert not partial_dir(d).exists()
+
+
+def encoded_vector(vectors_dir, tc, fps_family):
+    """
+    a test vector directory, as left by an encode whose mpd wasn't patched.
+    """
+    test_stream_dir = vectors_dir / Database.test_entry_location(fps_family, tc, BATCH_DIR)
+    test_stream_dir.mkdir(parents=True)
+    shutil.copyfile(REPO_DIR / 'chunked' / 'stream_chh1.mpd', test_stream_dir / 'stream.mpd')
+    return test_stream_dir
+
+
+def test_resume_skips_completed_steps(mezzanine_dir, tmp_path):
+    tc, fps_family = config_vector('1'), FPS_FAMILY._12_25_50
+    vectors_dir = tmp_path / 'vectors'
+    test_stream_dir = encoded_vector(vectors_dir, tc, fps_family)
+    key = Database.test_entry_key(fps_family, tc, BATCH_DIR)
+    Journal.for_batch(vectors_dir, BATCH_DIR).record(key, ENCODE)
+
+    # gpac isn't run: the encode completed, only the mpd is patched
+    encode_test_vector(tc, fps_family, vectors_dir, BATCH_DIR, journal=Journal.for_batch(vectors_dir, BATCH_DIR))
+    patched = (test_stream_dir / 'stream.mpd').read_text()
+    assert '<ProgramInformation>' in patched
+    assert Journal.for_batch(vectors_dir, BATCH_DIR).completed() == {(key, ENCODE), (key, PATCH)}
+
+    (test_stream_dir / 'stream.mpd').write_text('patched')
+    encode_test_vector(tc, fps_family, vectors_dir, BATCH_DIR, journal=Journal.for_batch(vectors_dir, BATCH_DIR))
+    assert (test_stream_dir / 'stream.mpd').read_text() == 'patched'
+
+
+def test_resume_plans_remaining_steps(mezzanine_dir, tmp_path):
+    vectors_dir = tmp_path / 'vectors'
+    fps_family = FPS_FAMILY._12_25_50
+    journal = Journal.for_batch(vectors_dir, BATCH_DIR)
+    complete, encoded = config_vector('1'), config_vector('2')
+    for tc, steps in ((complete, (ENCODE, PATCH)), (encoded, (ENCODE,))):
+        encoded_vector(vectors_dir, tc, fps_family)
+        for step in steps:
+            journal.record(Database.test_entry_key(fps_family, tc, BATCH_DIR), step)
+    # listed as complete, but its directory is gone
+    missing = config_vector('3')
+    journal.record(Database.test_entry_key(fps_family, missing, BATCH_DIR), ENCODE)
+    journal.record(Database.test_entry_key(fps_family, missing, BATCH_DIR), PATCH)
+
+    jobs = plan_encode_jobs(CONFIG, vectors_dir, BATCH_DIR, framerates=[fps_family], journal=Journal.for_batch(vectors_dir, BATCH_DIR), share_encodes=False)
+    keys = {job.key: job for job in jobs}
+    assert Database.test_entry_key(fps_family, complete, BATCH_DIR) not in keys
+    encoded_key = Database.test_entry_key(fps_family, encoded, BATCH_DIR)
+    missing_key = Database.test_entry_key(fps_family, missing, BATCH_DIR)
+    assert encoded_key in keys and missing_key in keys
+    # each job is handed the journal entries of its own test vector only
+    job_journal = keys[encoded_key].kwargs['journal']
+    assert job_journal.path == journal.path
+    assert job_journal.steps == {encoded_key: {ENCODE}}
@@ -0,0 +1,38 @@
+from pathlib import Path
+
+from conftest import CONFIG, config_vector
+from tcgen.batch import iter_batch_vectors
+from tcgen.models import Mezzanine, FPS_FAMILY
+from tcgen.tcgen import use_mezzanine_dir
+
+
+def test_registry_shares_mezzanines(mezzanine_dir, monkeypatch):
+    tc, fps_family = config_vector('1'), FPS_FAMILY._12_25_50
+    m = tc.get_mezzanine(fps_family)
+    assert Mezzanine.from_filename(Path(m.filename)) is m
+    assert m.md5 is not None
+
+    created = []
+    init = Mezzanine.__init__
+
+    def record(self, *args):
+        created.append(args)
+        init(self, *args)
+
+    monkeypatch.setattr(Mezzanine, '__init__', record)
+    assert tc.get_mezzanine(fps_family) is m
+    assert created == []
+    # one Mezzanine per root_dir
+    monkeypatch.setattr(Mezzanine, 'root_dir', mezzanine_dir / 'other')
+    assert tc.get_mezzanine(fps_family) is not m
+    assert len(created) == 1
+
+
+def test_preload_selected_vectors(mezzanine_dir):
+    tc, fps_family = config_vector('1'), FPS_FAMILY._12_25_50
+    selected = tc.get_mezzanine(fps_family)
+    others = [t.get_mezzanine(f) for t, f in iter_batch_vectors(CONFIG, FPS_FAMILY.all()) if t.get_mezzanine(f) is not selected]
+    assert others
+    use_mezzanine_dir(mezzanine_dir, iter_batch_vectors(CONFIG, [fps_family], '1'))
+    assert selected._properties is not None
+    assert all(m._properties is None for m in others)
@@ -0,0 +1,123 @@
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import pytest
+
+from tcgen.encode import ContentModel
+from tcgen.models import CmafBrand, CmafStructuralBrand
+from tcgen.mpd import same_document
+
+REPO_DIR = Path(__file__).parent.parent
+MPDS = sorted(p for d in ('chunked', 'switching_sets') for p in (REPO_DIR / d).glob('*.mpd'))
+NOTICES = ('copyright & <c>', 'source "s"', 'title')
+
+TIMELINE_MPD = '''<?xml version="1.0"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" profiles="urn:mpeg:dash:profile:isoff-live:2011">
+ <Period id="p0">
+  <AdaptationSet mimeType="video/mp4">
+   <SegmentTemplate media="$Time$.m4s" initialization="init.mp4" timescale="1000">
+    <SegmentTimeline>
+{}
+    </SegmentTimeline>
+   </SegmentTemplate>
+   <Representation id="1" codecs="hvc1.2.4.L123.90" bandwidth="6000000"/>
+  </AdaptationSet>
+ </Period>
+</MPD>
+'''
+
+
+def content_model(path:Path, compact_timeline:bool) -> ContentModel:
+    return ContentModel(path, CmafStructuralBrand.CMF2.value, CmafBrand.CHH1, compact_timeline)
+
+
+def render(tmp_path:Path, entries:str, compact_timeline=True) -> str:
+    mpd = tmp_path / 'stream.mpd'
+    mpd.write_text(TIMELINE_MPD.format(entries))
+    return content_model(mpd, compact_timeline).render(*NOTICES)
+
+
+def timeline(mpd:str) -> list[dict]:
+    ns = {'mpd': 'urn:mpeg:dash:schema:mpd:2011'}
+    return [s.attrib for s in ET.fromstring(mpd.split('\n', 1)[1]).iterfind('.//mpd:S', ns)]
+
+
+def expand(entries:list[dict]) -> list[tuple]:
+    """
+    (t, d) of each segment, r=-1 entries being kept as is.
+    """
+    segments = []
+    t = 0
+    for s in entries:
+        t = int(s.get('t', t))
+        d, r = int(s['d']), int(s.get('r', 0))
+        if r < 0:
+            segments.append((t, d, r))
+            continue
+        for _ in range(r + 1):
+            segments.append((t, d))
+            t += d
+    return segments
+
+
+@pytest.mark.parametrize('mpd', MPDS, ids=lambda p: p.name)
+def test_render_matches_minidom(mpd):
+    # canonicalization keeps whitespace: the layout is compared too
+    assert same_document(content_model(mpd, False).render(*NOTICES), content_model(mpd, False).render_dom(*NOTICES))
+
+
+@pytest.mark.parametrize('mpd', MPDS, ids=lambda p: p.name)
+def test_compaction_preserves_timeline(mpd):
+    compacted = content_model(mpd, True).render(*NOTICES)
+    assert expand(timeline(compacted)) == expand(timeline(content_model(mpd, False).render(*NOTICES)))
+
+
+def test_compaction_merges_equal_durations(tmp_path):
+    mpd = render(tmp_path, '<S t="0" d="10"/><S d="10"/><S t="20" d="10" r="1"/>')
+    assert timeline(mpd) == [{'t': '0', 'd': '10', 'r': '3'}]
+
+
+def test_compaction_keeps_non_contiguous_time(tmp_path):
+    mpd = render(tmp_path, '<S t="0" d="10"/><S t="25" d="10"/><S d="10"/>')
+    assert timeline(mpd) == [{'t': '0', 'd': '10'}, {'t': '25', 'd': '10', 'r': '1'}]
+
+
+def test_compaction_splits_on_duration_change(tmp_path):
+    mpd = render(tmp_path, '<S t="0" d="10" r="2"/><S d="20"/><S d="20"/><S d="10"/>')
+    assert timeline(mpd) == [{'t': '0', 'd': '10', 'r': '2'}, {'d': '20', 'r': '1'}, {'d': '10'}]
+
+
+def test_compaction_never_merges_open_ended_repeat(tmp_path):
+    mpd = render(tmp_path, '<S t="0" d="10"/><S d="10" r="-1"/>')
+    assert timeline(mpd) == [{'t': '0', 'd': '10'}, {'d': '10', 'r': '-1'}]
+    mpd = render(tmp_path, '<S t="0" d="10" r="-1"/><S t="100" d="10"/>')
+    assert timeline(mpd) == [{'t': '0', 'd': '10', 'r': '-1'}, {'t': '100', 'd': '10'}]
+
+
+def test_compaction_keeps_other_attributes(tmp_path):
+    mpd = render(tmp_path, '<S t="0" d="10"/><S d="10" k="2"/><S d="10"/>')
+    assert timeline(mpd) == [{'t': '0', 'd': '10'}, {'d': '10', 'k': '2'}, {'d': '10'}]
+
+
+def test_compaction_is_idempotent(tmp_path):
+    compacted = render(tmp_path, '<S t="0" d="10"/><S d="10"/><S d="11"/><S t="40" d="10"/><S d="10" r="-1"/>')
+    mpd = tmp_path / 'compacted.mpd'
+    mpd.write_text(compacted)
+    assert content_model(mpd, True).render(*NOTICES) == compacted
+
+
+def test_without_compaction_matches_minidom(tmp_path):
+    entries = '<S t="0" d="10"/><S d="10"/><S t="25" d="10" r="-1"/>'
+    mpd = render(tmp_path, entries, compact_timeline=False)
+    assert same_document(mpd, content_model(tmp_path / 'stream.mpd', False).render_dom(*NOTICES))
+    assert len(timeline(mpd)) == 3
+
+
+def test_escaping(tmp_path):
+    mpd = tmp_path / 'stream.mpd'
+    mpd.write_text(TIMELINE_MPD.format('<S t="0" d="10"/>').replace('type="static"', 'type="static" id="a &amp; &quot;b&quot;&#10;&lt;c&gt;"'))
+    rendered = content_model(mpd, False).render('<c> & "d"', *NOTICES[1:])
+    assert 'id="a &amp; &quot;b&quot;&#10;&lt;c&gt;"' in rendered
+    assert '<Copyright>&lt;c&gt; &amp; "d"</Copyright>' in rendered
+    # minidom before Python 3.13 writes the newline as is, reading it back as a space
+    assert ET.fromstring(rendered.split('\n', 1)[1]).get('id') == 'a & "b"\n<c>'
@@ -0,0 +1,160 @@
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from tcgen.models import CmafBrand, VideoResolution
+from tcgen.scheduler import Job, Scheduler, critical_path_ranks, parse_size, format_size, estimate_memory, GPAC_BASE_MEMORY
+
+
+def span(value, duration=0.2):
+    """
+    a job recording when it ran.
+    """
+    start = time.time()
+    time.sleep(duration)
+    return value, start, time.time()
+
+
+def fail(code):
+    raise subprocess.CalledProcessError(code, 'gpac')
+
+
+def overlapping(a, b) -> bool:
+    _, a_start, a_end = a.value
+    _, b_start, b_end = b.value
+    return a_start < b_end and b_start < a_end
+
+
+def running(*jobs:Job) -> dict:
+    return {i: job for i, job in enumerate(jobs)}
+
+
+def test_parse_size():
+    assert parse_size('512M') == 512 * 2**20
+    assert parse_size('32g') == 32 * 2**30
+    assert parse_size('1.5GiB') == int(1.5 * 2**30)
+    assert parse_size(4096) == 4096
+    assert parse_size(None) is None
+    with pytest.raises(ValueError):
+        parse_size('32 gigs')
+    assert format_size(parse_size('1.5G')) == '1.5G'
+    assert format_size(512) == '512B'
+
+
+def test_estimate_memory():
+    def tc(profile, w, h):
+        return SimpleNamespace(cmaf_media_profile=profile, resolution=VideoResolution(w, h))
+
+    hd = estimate_memory(tc(CmafBrand.CHH1, 1920, 1080))
+    assert GPAC_BASE_MEMORY < hd < estimate_memory(tc(CmafBrand.CHH1, 3840, 2160))
+    # 10-bit
+    assert estimate_memory(tc(CmafBrand.CHD1, 1920, 1080)) > hd
+    assert estimate_memory(tc(CmafBrand.CUD1, 3840, 2160)) > estimate_memory(tc(CmafBrand.CHH1, 3840, 2160))
+
+
+def test_admissible_memory():
+    scheduler = Scheduler(max_workers=4, max_memory=100)
+    assert scheduler.admissible(Job('a', span, memory=60), running())
+    assert scheduler.admissible(Job('a', span, memory=40), running(Job('b', span, memory=60)))
+    assert not scheduler.admissible(Job('a', span, memory=41), running(Job('b', span, memory=60)))
+    # over budget on its own: only admitted when nothing else runs
+    assert scheduler.admissible(Job('a', span, memory=500), running())
+    assert not scheduler.admissible(Job('a', span, memory=500), running(Job('b', span, memory=1)))
+    assert Scheduler(max_workers=4).admissible(Job('a', span, memory=500), running(Job('b', span, memory=500)))
+
+
+def test_admissible_workers_and_stage_limits():
+    scheduler = Scheduler(max_workers=3, stage_limits={'zip': 1})
+    assert scheduler.admissible(Job('a', span, stage='zip'), running(Job('b', span, stage='encode')))
+    assert not scheduler.admissible(Job('a', span, stage='zip'), running(Job('b', span, stage='zip')))
+    assert scheduler.admissible(Job('a', span, stage='encode'), running(Job('b', span, stage='zip'), Job('c', span, stage='encode')))
+    assert not scheduler.admissible(Job('a', span), running(Job('b', span), Job('c', span), Job('d', span)))
+
+
+def test_run_memory_admission():
+    jobs = [Job(f'small{i}', span, (i,), memory=60) for i in range(3)] + [Job('large', span, ('large',), memory=500)]
+    results = Scheduler(max_workers=4, max_memory=100).run(jobs)
+    assert all(r.ok for r in results)
+    for i, a in enumerate(results):
+        for b in results[i + 1:]:
+            assert not overlapping(a, b), (a.key, b.key)
+
+
+def test_run_stage_limits():
+    jobs = [Job(f'zip{i}', span, (i,), stage='zip') for i in range(3)]
+    results = Scheduler(max_workers=4, stage_limits={'zip': 1}).run(jobs)
+    assert all(r.ok for r in results)
+    for i, a in enumerate(results):
+        for b in results[i + 1:]:
+            assert not overlapping(a, b), (a.key, b.key)
+
+
+def test_run_failed_dependencies():
+    jobs = [
+        Job('encode', fail, (3,)),
+        Job('zip', span, ('zip', 0), depends=['encode']),
+        Job('validate', span, ('validate', 0), depends=['zip']),
+        Job('other', span, ('other', 0)),
+        Job('exited', sys.exit, (4,))
+    ]
+    reported = []
+    results = Scheduler(max_workers=2).run(jobs, on_result=lambda r: reported.append(r.key))
+    assert [(r.key, r.exit_code) for r in results] == [('encode', 3), ('zip', 1), ('validate', 1), ('other', 0), ('exited', 4)]
+    assert results[1].error == 'dependency failed: encode'
+    assert results[2].error == 'dependency failed: zip'
+    assert sorted(reported) == sorted(j.key for j in jobs)
+
+
+def test_run_provides():
+    jobs = [
+        Job('fanout', span, ('fanout', 0.3), provides=['a', 'b']),
+        Job('zip/a', span, ('zip/a', 0), depends=['a']),
+        # dependencies on keys no job provides are ignored
+        Job('zip/b', span, ('zip/b', 0), depends=['b', 'unknown']),
+        Job('failed', fail, (1,), provides=['c']),
+        Job('zip/c', span, ('zip/c', 0), depends=['c'])
+    ]
+    results = Scheduler(max_workers=4).run(jobs)
+    fanout, zip_a, zip_b, failed, zip_c = results
+    assert fanout.ok and zip_a.ok and zip_b.ok
+    assert zip_a.value[1] >= fanout.value[2] and zip_b.value[1] >= fanout.value[2]
+    assert not failed.ok
+    assert zip_c.error == 'dependency failed: c'
+
+
+def test_run_results_in_job_order():
+    jobs = [Job(str(i), span, (i, 0.05 * (i % 3)), cost=i % 3) for i in range(8)]
+    results = Scheduler(max_workers=3).run(jobs)
+    assert [r.key for r in results] == [j.key for j in jobs]
+    assert [r.value[0] for r in results] == list(range(8))
+
+
+def test_run_kwargs():
+    results = Scheduler(max_workers=2).run([Job('a', span, ('a',), dict(duration=0)), Job('b', span, kwargs=dict(value='b', duration=0))])
+    assert [r.value[0] for r in results] == ['a', 'b']
+
+
+def test_critical_path_ranks():
+    jobs = [
+        Job('short', span, cost=1),
+        Job('encode', span, cost=5),
+        Job('zip', span, cost=2, depends=['encode']),
+        Job('validate', span, cost=3, depends=['zip']),
+        Job('fanout', span, cost=4, provides=['a']),
+        Job('zip/a', span, cost=2, depends=['a'])
+    ]
+    assert critical_path_ranks(jobs) == {'short': 1, 'encode': 10, 'zip': 5, 'validate': 3, 'fanout': 6, 'zip/a': 2}
+
+
+def test_run_by_rank():
+    jobs = [
+        Job('short', span, ('short', 0.05), cost=1),
+        Job('long', span, ('long', 0.05), cost=3),
+        Job('parent', span, ('parent', 0.05), cost=1),
+        Job('child', span, ('child', 0.05), cost=5, depends=['parent'])
+    ]
+    results = Scheduler(max_workers=1).run(jobs)
+    assert [r.key for r in sorted(results, key=lambda r: r.value[1])] == ['parent', 'child', 'long', 'short']